@@ -0,0 +1,146 @@
+"""Synthetic spacehaven.jar and mod corpus for the pipeline benchmarks
+
+Everything is generated from a seed so runs on different machines and commits compare like for like.
+"""
+
+import os
+import random
+import struct
+import zipfile
+import zlib
+
+import png
+
+from loader.assets.explode import PIXEL_SIZE, RGBA_FORMAT
+from loader.assets.library import PATCHABLE_CIM_FILES
+
+MERGE_MOD = "merge"
+PATCH_MOD = "patch"
+TEXTURE_MOD = "texture"
+MOD_KINDS = [MERGE_MOD, PATCH_MOD, TEXTURE_MOD]
+
+# sizes roughly matching the 0.14 game library
+DEFAULT_SIZES = {
+    "elements": 6000,
+    "texts": 30000,
+    "regions_per_page": 200,
+    "page_size": 1024,
+    "audio": 400,
+    "classes": 5000,
+}
+
+REGION_SIZE = 16
+
+
+def _cim(pageSize, rng):
+    header = struct.pack(">3i", pageSize, pageSize, RGBA_FORMAT)
+    # a few distinct rows so the page doesn't compress to nothing
+    rows = [bytes(rng.getrandbits(8) for _ in range(pageSize * PIXEL_SIZE)) for _ in range(8)]
+    return zlib.compress(header + b"".join(rows[row % len(rows)] for row in range(pageSize)))
+
+
+def _regions(sizes):
+    perRow = sizes["page_size"] // REGION_SIZE
+    regionId = 0
+    for page in range(len(PATCHABLE_CIM_FILES)):
+        for index in range(sizes["regions_per_page"]):
+            x, y = (index % perRow) * REGION_SIZE, (index // perRow) * REGION_SIZE
+            yield regionId, page, x, y
+            regionId += 1
+
+
+def make_jar(jarPath, sizes=None, seed=0):
+    """Write a fake spacehaven.jar with the library layout the loader expects"""
+    sizes = dict(DEFAULT_SIZES, **(sizes or {}))
+    rng = random.Random(seed)
+
+    haven = ["<data>", "<Element>"]
+    for mid in range(sizes["elements"]):
+        haven.append('<me mid="{0}" hp="{1}" tid="{0}"><name tid="{0}"/><props a="1" b="2"/></me>'.format(mid, rng.randint(1, 500)))
+    haven.append("</Element>")
+    haven.append("<Item>{}</Item>".format("".join('<i mid="{0}" w="{1}"/>'.format(mid, rng.randint(1, 9)) for mid in range(sizes["elements"] // 4))))
+    haven.append("</data>")
+
+    texts = ["<t>"] + ['<l id="{0}"><EN>Text number {0}</EN></l>'.format(tid) for tid in range(sizes["texts"])] + ["</t>"]
+
+    regions = "".join('<re n="{}" t="{}" x="{}" y="{}" w="{}" h="{}"/>'.format(n, page, x, y, REGION_SIZE, REGION_SIZE) for n, page, x, y in _regions(sizes))
+    pages = "".join('<t i="{0}" w="{1}" h="{1}"/>'.format(page, sizes["page_size"]) for page in range(len(PATCHABLE_CIM_FILES)))
+    textures = "<AllTexturesAndRegions><textures>{}</textures><regions>{}</regions></AllTexturesAndRegions>".format(pages, regions)
+
+    audio = "<audio>{}</audio>".format("".join('<a id="{0}" n="sound{0}" at="Sound" ogg="library/sound/ogg/sound{0}.ogg"/>'.format(n) for n in range(sizes["audio"])))
+
+    with zipfile.ZipFile(jarPath, "w", compression=zipfile.ZIP_DEFLATED) as jar:
+        jar.writestr("version.txt", "0.14.1\nbenchmark\n")
+        jar.writestr("library/haven", "\n".join(haven))
+        jar.writestr("library/texts", "\n".join(texts))
+        jar.writestr("library/animations", "<AllAnimations><animations></animations></AllAnimations>")
+        jar.writestr("library/textures", textures)
+        jar.writestr("library/audio", audio)
+        for cim in PATCHABLE_CIM_FILES:
+            # already zlib compressed, like the game's pages
+            jar.writestr(cim, _cim(sizes["page_size"], rng), compress_type=zipfile.ZIP_STORED)
+        for n in range(sizes["audio"]):
+            jar.writestr("library/sound/ogg/sound{}.ogg".format(n), rng.randbytes(256), compress_type=zipfile.ZIP_STORED)
+        for n in range(sizes["classes"]):
+            jar.writestr("fi/bugbyte/spacehaven/gen/Class{}.class".format(n), b"\xca\xfe\xba\xbe" + rng.randbytes(rng.randint(200, 4000)))
+    return sizes
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def _merge_mod(modPath, index, sizes, rng):
+    mids = rng.sample(range(sizes["elements"]), 20)
+    elements = "".join('<me mid="{}" hp="{}" tid="{}"><name tid="{}"/></me>'.format(mid, index, mid, mid) for mid in mids)
+    # new elements get ids above the vanilla ones
+    elements += "".join('<me mid="{}" hp="1"/>'.format(sizes["elements"] + index * 10 + n) for n in range(10))
+    _write(os.path.join(modPath, "library", "haven.xml"), "<data><Element>{}</Element></data>".format(elements))
+    texts = "".join('<l id="{}"><EN>Mod {} text</EN></l>'.format(tid, index) for tid in rng.sample(range(sizes["texts"]), 50))
+    _write(os.path.join(modPath, "library", "texts.xml"), "<t>{}</t>".format(texts))
+
+
+def _patch_mod(modPath, index, sizes, rng):
+    operations = []
+    for mid in rng.sample(range(sizes["elements"]), 10):
+        operations.append(
+            "<Operation Class=\"AttributeMath\"><xpath>/data/Element/me[@mid='{}']</xpath><attribute>hp</attribute><value opType=\"multiply\">2</value></Operation>".format(mid)
+        )
+    operations.append("<Operation Class=\"AttributeSet\"><xpath>/data/Item/i</xpath><attribute>w</attribute><value>{}</value></Operation>".format(index % 9 + 1))
+    operations.append(
+        "<Operation Class=\"NodeAdd\"><xpath>/data/Element/me[@mid='{}']</xpath><value><extra mod=\"{}\"/></value></Operation>".format(rng.randrange(sizes["elements"]), index)
+    )
+    _write(os.path.join(modPath, "patches", "haven.xml"), "<Patch>{}</Patch>".format("".join(operations)))
+
+
+def _texture_mod(modPath, index, sizes, rng):
+    regions = rng.sample(list(_regions(sizes)), 4)
+    res = "".join('<re n="{}.png" t="{}" x="{}" y="{}" w="{}" h="{}"/>'.format(n, page, x, y, REGION_SIZE, REGION_SIZE) for n, page, x, y in regions)
+    _write(os.path.join(modPath, "library", "textures.xml"), "<AllTexturesAndRegions><textures/><regions>{}</regions></AllTexturesAndRegions>".format(res))
+    _write(os.path.join(modPath, "library", "animations.xml"), "<AllAnimations><animations/></AllAnimations>")
+    os.makedirs(os.path.join(modPath, "textures"), exist_ok=True)
+    for n, _, _, _ in regions:
+        pixel = [index % 256, n % 256, 0, 255]
+        with open(os.path.join(modPath, "textures", "{}.png".format(n)), "wb") as f:
+            png.Writer(width=REGION_SIZE, height=REGION_SIZE, greyscale=False, alpha=True).write(f, [pixel * REGION_SIZE] * REGION_SIZE)
+
+
+def make_mods(modsDir, count, sizes=None, seed=0):
+    """Write `count` mods cycling through merge, patch and texture mods, returns their folders in load order"""
+    sizes = dict(DEFAULT_SIZES, **(sizes or {}))
+    rng = random.Random(seed)
+    builders = {MERGE_MOD: _merge_mod, PATCH_MOD: _patch_mod, TEXTURE_MOD: _texture_mod}
+
+    folders = []
+    for index in range(count):
+        kind = MOD_KINDS[index % len(MOD_KINDS)]
+        modPath = os.path.join(modsDir, "{:03d}_{}".format(index, kind))
+        _write(
+            os.path.join(modPath, "info.xml"),
+            "<mod><name>Benchmark {} {}</name><description>generated {} mod</description><modid>{}</modid></mod>".format(kind, index, kind, index + 1),
+        )
+        builders[kind](modPath, index, sizes, rng)
+        folders.append(modPath)
+    return folders
@@ -0,0 +1,118 @@
+"""Time the loading pipeline stage by stage on a synthetic game and mod corpus
+
+    python -m benchmarks.pipeline --mods 1,10,50,200 --output benchmark_results/pipeline.json
+
+Each mod count runs `load.build` on the jar like a launch does, with its stages taken from the build's timing report.
+The caches (core library, snapshots, atlas) are not used, every run is a cold build.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import ui.log
+import version
+
+import loader.cli
+import loader.load
+import loader.signature
+import loader.timing
+from benchmarks import corpus
+
+DEFAULT_MOD_COUNTS = [1, 10, 50, 200]
+RESULTS_DIR = "benchmark_results"
+# stages of the build taken from its timing report
+BUILD_STAGES = ["corecache.load", "doMerges", "doPatches", "repack textures", "write xml", "merge.mods", "library.patch"]
+
+
+def _timed(stages, name, function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    stages[name] = time.perf_counter() - started
+    return result
+
+
+def run_mod_count(workDir, jarPath, modCount, sizes, seed):
+    """Time every stage for `modCount` mods, returns {stage: seconds}"""
+    stages = {}
+    modsDir = os.path.join(workDir, "mods_{}".format(modCount))
+    folders = corpus.make_mods(modsDir, modCount, sizes, seed)
+    mods = loader.cli.load_mods(jarPath, folders)
+
+    # the build a launch runs, minus the caches
+    resultPath = os.path.join(workDir, "modded_{}.jar".format(modCount))
+    _timed(stages, "build", loader.load.build, jarPath, mods, resultPath, use_caches=False, cim_level=loader.load.LAUNCH_CIM_LEVEL)
+    report = loader.timing.read_report(loader.load.modloader_data_dir(jarPath))
+    for stage in BUILD_STAGES:
+        stages[stage] = report["stages"].get(stage, {"wall": 0.0})["wall"]
+
+    signature = _timed(stages, "signature", loader.signature.signature, jarPath, mods, loader.load.modloader_data_dir(jarPath))
+    loader.load.place_file(resultPath, loader.load.quick_launch_filename(signature, jarPath))
+    _timed(stages, "quickload", loader.load.quickload, jarPath, signature)
+    loader.load.unload(jarPath, message=False)
+
+    return stages
+
+
+def run(modCounts, sizes=None, seed=0, workDir=None):
+    """Generate the corpus and time the pipeline for each mod count, returns the JSON-ready report"""
+    report = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "loader_version": version.version,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "seed": seed,
+        "sizes": dict(corpus.DEFAULT_SIZES, **(sizes or {})),
+        "results": [],
+    }
+
+    with tempfile.TemporaryDirectory(dir=workDir) as tempDir:
+        gameDir = os.path.join(tempDir, "SpaceHaven")
+        os.makedirs(gameDir)
+        jarPath = os.path.join(gameDir, "spacehaven.jar")
+        started = time.perf_counter()
+        corpus.make_jar(jarPath, sizes, seed)
+        report["jar_bytes"] = os.path.getsize(jarPath)
+        report["jar_seconds"] = time.perf_counter() - started
+
+        for modCount in modCounts:
+            print("Timing {} mod(s)...".format(modCount), file=sys.stderr)
+            stages = run_mod_count(tempDir, jarPath, modCount, sizes, seed)
+            for stage, seconds in stages.items():
+                report["results"].append({"mods": modCount, "stage": stage, "seconds": round(seconds, 4)})
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.pipeline", description="Time the mod loading pipeline on generated data.")
+    parser.add_argument("--mods", default=",".join(str(count) for count in DEFAULT_MOD_COUNTS), help="comma separated mod counts (default: %(default)s)")
+    parser.add_argument("--output", help="JSON file to write (default: {}/pipeline-<timestamp>.json)".format(RESULTS_DIR))
+    parser.add_argument("--seed", type=int, default=0, help="corpus seed (default: %(default)s)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the size of the generated library")
+    parser.add_argument("--work-dir", help="where to generate the corpus (default: system temp)")
+    args = parser.parse_args(argv)
+
+    sizes = {key: max(1, int(value * args.scale)) for key, value in corpus.DEFAULT_SIZES.items() if key != "page_size"}
+    ui.log.logger.echo = False
+    report = run([int(count) for count in args.mods.split(",")], sizes, args.seed, args.work_dir)
+
+    output = args.output or os.path.join(RESULTS_DIR, "pipeline-{}.json".format(report["timestamp"].replace(":", "").replace("+0000", "")))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print("{:>6}  {:<16} {:>9}".format("mods", "stage", "seconds"))
+    for result in report["results"]:
+        print("{:>6}  {:<16} {:>9.3f}".format(result["mods"], result["stage"], result["seconds"]))
+    print("Wrote {}".format(output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
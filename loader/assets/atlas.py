@@ -0,0 +1,238 @@
+"""Sprites of every mod packed together into shared texture pages
+
+`_detect_textures` only allocates region ids for the sprites a mod generates regions for, `add_pages` places them once
+all mods are merged, on as few pages as fit them. `AtlasCache` keeps the layouts and composited pages between launches.
+Set MODLOADER_TEXTURE_DEBUG=1 to also write the generated pages as PNGs and their regions as `generated_textures.xml`
+to the texture debug folder, `mods/modloader/texture_debug`.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import lxml.etree
+import rectpack
+import ui.log
+
+from .explode import CIM_COMPRESSION_LEVEL
+from .library import PATCHABLE_CIM_FILES
+
+# Sprite sheets MUST be 2048 x 2048
+PAGE_SIZE = 2048
+# atlas pages follow the vanilla ones
+FIRST_PAGE_ID = len(PATCHABLE_CIM_FILES)
+
+ATLAS_DIRNAME = "atlas"
+TEXTURE_DEBUG_DIRNAME = "texture_debug"
+DEBUG_ENV = "MODLOADER_TEXTURE_DEBUG"
+DEBUG_TEXTURES_FILENAME = "generated_textures.xml"
+# bump when the layout or the pages change for the same sprites
+ATLAS_FORMAT = 1
+# layouts and pages kept for other load orders
+CACHE_ENTRIES = 16
+LAYOUT_SUFFIX = ".layout.json"
+PAGE_SUFFIX = ".cim"
+
+
+def debug_enabled():
+    return os.environ.get(DEBUG_ENV, "").strip() not in ("", "0")
+
+
+class AtlasCache:
+    """Packed layouts and composited pages in `cacheDir`, reused while the sprites are unchanged"""
+
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+
+    def _path(self, key, suffix):
+        return os.path.join(self.cacheDir, key + suffix)
+
+    def _write(self, path, write):
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            write(path + ".tmp")
+            os.replace(path + ".tmp", path)
+        except OSError as ex:
+            ui.log.log("  Failed to cache {}: {}".format(path, ex))
+
+    def layout(self, sizes, pageSize=PAGE_SIZE):
+        """`pack(sizes, pageSize)`, read from the cache when the same sprites were packed before"""
+        digest = hashlib.sha1("format {}\npage {}\n".format(ATLAS_FORMAT, pageSize).encode())
+        for region in sorted(sizes):
+            digest.update("{} {} {}\n".format(region, *sizes[region]).encode())
+        path = self._path(digest.hexdigest(), LAYOUT_SUFFIX)
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                pages = [{region: tuple(rect) for region, rect in page.items()} for page in json.load(f)]
+            os.utime(path)
+            ui.log.log("  Reusing the packed layout of {} generated texture(s)".format(len(sizes)))
+            return pages
+        except (OSError, ValueError):
+            pass
+
+        pages = pack(sizes, pageSize)
+
+        def _dump(tmpPath):
+            with open(tmpPath, "w", encoding="utf-8") as f:
+                json.dump(pages, f)
+
+        self._write(path, _dump)
+        return pages
+
+    def page_key(self, width, height, blits, level=None):
+        """Key of the page composited from `blits`, (png file, x, y, w, h) tuples, on an empty page written at zlib `level`"""
+        level = CIM_COMPRESSION_LEVEL if level is None else level
+        digest = hashlib.sha1("format {}\npage {} {}\nlevel {}\n".format(ATLAS_FORMAT, width, height, level).encode())
+        for pngFile, x, y, w, h in blits:
+            stat = os.stat(pngFile)
+            digest.update("{} {} {} {} {} {} {}\n".format(os.path.abspath(pngFile), stat.st_size, stat.st_mtime_ns, x, y, w, h).encode())
+        return digest.hexdigest()
+
+    def restore_page(self, key, cimPath):
+        """Copy the cached page `key` to `cimPath`, False if there is none"""
+        path = self._path(key, PAGE_SUFFIX)
+        try:
+            shutil.copyfile(path, cimPath)
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+
+    def save_page(self, key, cimPath):
+        self._write(self._path(key, PAGE_SUFFIX), lambda tmpPath: shutil.copyfile(cimPath, tmpPath))
+
+    def prune(self, entries=CACHE_ENTRIES):
+        """Keep the `entries` most recently used layouts and pages"""
+        if not os.path.isdir(self.cacheDir):
+            return
+        for suffix in (LAYOUT_SUFFIX, PAGE_SUFFIX):
+            paths = [os.path.join(self.cacheDir, entry) for entry in os.listdir(self.cacheDir) if entry.endswith(suffix)]
+            paths.sort(key=os.path.getmtime, reverse=True)
+            for path in paths[entries:]:
+                os.remove(path)
+
+
+def pack(sizes, pageSize=PAGE_SIZE):
+    """Place the rectangles of `sizes`, {region: (w, h)}, on as few pages as possible
+
+    Returns one {region: (x, y, w, h)} dict per page.
+    """
+    tooLarge = sorted(region for region, (w, h) in sizes.items() if w > pageSize or h > pageSize)
+    if tooLarge:
+        raise Exception("Textures larger than a {0}x{0} sprite sheet: {1}".format(pageSize, ", ".join(tooLarge)))
+
+    # fill a page as far as possible before opening the next one
+    packer = rectpack.newPacker(rotation=False, bin_algo=rectpack.PackingBin.Global)
+    packer.add_bin(pageSize, pageSize, count=float("inf"))
+    # sorted so the same sprites always end up in the same place
+    for region in sorted(sizes):
+        w, h = sizes[region]
+        packer.add_rect(w, h, region)
+    packer.pack()
+
+    pages = [{} for _ in range(len(packer))]
+    for page, x, y, w, h, region in packer.rect_list():
+        pages[page][region] = (x, y, w, h)
+    return pages
+
+
+def page_ids(count, taken, first=FIRST_PAGE_ID):
+    """`count` page ids from `first` up that no page in `taken` uses yet"""
+    ids = []
+    pageId = first
+    while len(ids) < count:
+        if str(pageId) not in taken:
+            ids.append(str(pageId))
+        pageId += 1
+    return ids
+
+
+def check_page_ids(coreLibrary):
+    """Raise when two texture pages share an id, pages are generated before the patches that could add another"""
+    seen = set()
+    duplicates = set()
+    for pageId in coreLibrary["library/textures"].getroot().xpath("textures/t/@i"):
+        (duplicates if pageId in seen else seen).add(str(pageId))
+    if duplicates:
+        raise Exception("Texture page ids used by more than one page: {}. A patch added a page with the id of another mod's or generated page.".format(", ".join(sorted(duplicates))))
+
+
+def add_pages(coreLibrary, pageSize=PAGE_SIZE, cache=None, debug_dir=None):
+    """Pack the sprites in `_all_modded_textures` marked for the atlas into new pages of the merged textures
+
+    `cache` is an `AtlasCache` to reuse the layout from, `debug_dir` gets the pages and regions added with the path of
+    each sprite. Returns the ids of the pages added.
+    """
+    sprites = {region: texture for region, texture in coreLibrary["_all_modded_textures"].items() if texture.get("atlas")}
+    if not sprites:
+        return []
+
+    sizes = {region: (texture["w"], texture["h"]) for region, texture in sprites.items()}
+    pages = cache.layout(sizes, pageSize) if cache is not None else pack(sizes, pageSize)
+
+    texturesRoot = coreLibrary["library/textures"].getroot()
+    texturesNode = texturesRoot.find("textures")
+    regionsNode = texturesRoot.find("regions")
+    taken = set(texturesRoot.xpath("textures/t/@i")) | set(coreLibrary["_custom_textures_cim"])
+    pageIds = page_ids(len(pages), taken)
+
+    generated = []
+    for pageId, page in zip(pageIds, pages):
+        newTex = lxml.etree.SubElement(texturesNode, "t")
+        newTex.set("i", pageId)
+        newTex.set("w", str(pageSize))
+        newTex.set("h", str(pageSize))
+        coreLibrary["_custom_textures_cim"][pageId] = newTex.attrib
+        ui.log.log("  Packed {} generated texture(s) into page {}".format(len(page), pageId))
+
+        for region, (x, y, w, h) in page.items():
+            newNode = lxml.etree.Element("re")
+            newNode.set("n", region)
+            newNode.set("t", pageId)
+            newNode.set("x", str(x))
+            newNode.set("y", str(y))
+            newNode.set("w", str(w))
+            newNode.set("h", str(h))
+            newNode.set("file", sprites[region]["filename"])
+            generated.append(newNode)
+
+    # the game expects new regions in id order, whichever page they are on
+    generated.sort(key=lambda node: int(node.get("n")))
+    if debug_dir is not None:
+        _write_debug_textures(debug_dir, [coreLibrary["_custom_textures_cim"][pageId] for pageId in pageIds], generated, sprites)
+    _insert_in_id_order(regionsNode, generated)
+
+    return pageIds
+
+
+def _insert_in_id_order(regionsNode, nodes):
+    """Insert `nodes`, sorted by id, each before the first region of `regionsNode` with a higher id"""
+    children = list(regionsNode)
+    position = 0
+    for node in nodes:
+        regionId = int(node.get("n"))
+        while position < len(children):
+            childId = children[position].get("n") or ""
+            if childId.isdecimal() and int(childId) > regionId:
+                break
+            position += 1
+        if position < len(children):
+            children[position].addprevious(node)
+        else:
+            regionsNode.append(node)
+
+
+def _write_debug_textures(debug_dir, pages, regions, sprites):
+    root = lxml.etree.Element("AllTexturesAndRegions")
+    texturesNode = lxml.etree.SubElement(root, "textures")
+    for attrib in pages:
+        lxml.etree.SubElement(texturesNode, "t", dict(attrib))
+    regionsNode = lxml.etree.SubElement(root, "regions")
+    for region in regions:
+        debugNode = lxml.etree.SubElement(regionsNode, "re", dict(region.attrib))
+        debugNode.set("path", sprites[region.get("n")]["path"])
+
+    os.makedirs(debug_dir, exist_ok=True)
+    lxml.etree.ElementTree(root).write(os.path.join(debug_dir, DEBUG_TEXTURES_FILENAME), pretty_print=True)
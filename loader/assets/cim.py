@@ -0,0 +1,106 @@
+"""Decoding CIM texture pages and cropping their regions
+
+Nothing here logs or imports the window, so `explode_page` can run in a freshly spawned process. Messages for the log
+are returned to the caller instead.
+"""
+
+import hashlib
+import os
+import struct
+import zlib
+
+from . import codec
+
+PIXEL_SIZE = 4
+RGBA_FORMAT = 4
+HEADER_SIZE = 12
+
+# pages are inflated and deflated in chunks of this size
+CIM_CHUNK_SIZE = 1024 * 1024
+
+
+def read_cim(f, path):
+    """Inflate the page read from the binary file object `f`, `path` is for the messages
+
+    Returns the header, the pixel data sized from the header and the messages to log. A short page is padded with zeros.
+    """
+    # inflate chunk by chunk straight into the page buffer, allocated once the header gives its size
+    decompressor = zlib.decompressobj()
+    md5 = hashlib.md5()
+    header = b""
+    data = None
+    filled = 0
+    overflow = 0
+
+    def _inflated(chunk):
+        nonlocal header, data, filled, overflow
+        md5.update(chunk)
+        if len(header) < HEADER_SIZE:
+            needed = HEADER_SIZE - len(header)
+            header += chunk[:needed]
+            chunk = chunk[needed:]
+            if len(header) == HEADER_SIZE:
+                width, height = struct.unpack_from(">2i", header)
+                data = bytearray(max(0, width * height * PIXEL_SIZE))
+        if chunk and data is not None:
+            room = len(data) - filled
+            data[filled : filled + min(room, len(chunk))] = chunk[:room]
+            filled += min(room, len(chunk))
+            overflow += max(0, len(chunk) - room)
+
+    for compressed in iter(lambda: f.read(CIM_CHUNK_SIZE), b""):
+        _inflated(decompressor.decompress(compressed))
+    _inflated(decompressor.flush())
+    messages = ["  %s vanilla md5 %s %d bytes" % (os.path.split(path)[1], md5.hexdigest(), len(header) + filled + overflow)]
+
+    if len(header) < HEADER_SIZE:
+        messages.append("ERROR: Truncated CIM header in %s" % path)
+        return header, bytearray(), messages
+
+    width, height, pageFormat = struct.unpack_from(">3i", header)
+    if pageFormat != RGBA_FORMAT:
+        messages.append("ERROR: Unknown CIM format: {}".format(pageFormat))
+    elif filled + overflow != len(data):
+        messages.append("ERROR: Wrong size %s: %d vs %d" % (path, filled + overflow, len(data)))
+    return header, data, messages
+
+
+def pixels(data, width, height):
+    """`data` as a (height, width, 4) numpy array over the same memory, None without numpy or when the size is off"""
+    if codec.numpy is None or len(data) != width * height * PIXEL_SIZE:
+        return None
+    return codec.numpy.frombuffer(data, dtype=codec.numpy.uint8).reshape(height, width, PIXEL_SIZE)
+
+
+def region(data, width, height, x, y, regionWidth, regionHeight):
+    """The pixels of a region, as a numpy array or a list of row copies like `codec.read_rgba` returns them"""
+    page = pixels(data, width, height)
+    if page is not None:
+        return page[y : y + regionHeight, x : x + regionWidth]
+
+    rows = []
+    for row in range(regionHeight):
+        start = (x + ((row + y) * width)) * PIXEL_SIZE
+        end = start + (regionWidth * PIXEL_SIZE)
+
+        rows.append(data[start:end])
+    return rows
+
+
+def explode_page(corePath, page, regions):
+    """Decode a page of `corePath` and write its `regions`, (name, x, y, w, h) tuples, and the whole page as PNGs
+
+    Returns the messages to log.
+    """
+    exploded = os.path.join(corePath, "library", "textures.exploded")
+    os.makedirs(os.path.join(exploded, page), exist_ok=True)
+
+    path = os.path.join(corePath, "library", "{}.cim".format(page))
+    with open(path, "rb") as f:
+        header, data, messages = read_cim(f, path)
+    width, height = struct.unpack_from(">2i", header) if len(header) == HEADER_SIZE else (0, 0)
+
+    for name, x, y, w, h in regions:
+        codec.write_rgba(os.path.join(exploded, page, "{}.png".format(name)), w, h, region(data, width, height, x, y, w, h))
+    codec.write_rgba(os.path.join(exploded, "{}.png".format(page)), width, height, region(data, width, height, 0, 0, width, height))
+    return messages
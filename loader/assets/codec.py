@@ -0,0 +1,144 @@
+"""Reading and writing the RGBA PNGs of texture regions
+
+PNGs are decoded with Pillow when it is installed, else with pypng. They are written by zlib directly, which is as
+fast as any C encoder since compression is the expensive part. Pixels are handed around as one (height, width, 4)
+numpy array when numpy is installed, else as a list of packed rows.
+`read_size` only parses the PNG header and `decode_cache` keeps decoded PNGs for the length of a launch.
+"""
+
+import collections
+import os
+import struct
+import threading
+import zlib
+
+import png
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from PIL import Image
+except ImportError:
+    # optional, pypng decodes the same files a lot slower
+    Image = None
+
+PIXEL_SIZE = 4
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+RGBA_COLOR_TYPE = 6
+
+BACKEND_PILLOW = "pillow"
+BACKEND_PYPNG = "pypng"
+BACKEND = BACKEND_PILLOW if Image is not None else BACKEND_PYPNG
+
+# zlib level of written PNGs, 1 is fastest and 9 smallest
+COMPRESSION_LEVEL = 6
+# PNG row filters, "up" stores the difference to the previous row which compresses textures better
+FILTER_NONE = 0
+FILTER_UP = 2
+
+# decoded pixels kept by `decode_cache`, a 2048x2048 sprite sheet is 16 MB
+DECODE_CACHE_BYTES = 256 * 1024**2
+
+
+def _rows(data, width, height):
+    if numpy is not None:
+        return numpy.frombuffer(data, dtype=numpy.uint8).reshape(height, width, PIXEL_SIZE)
+    stride = width * PIXEL_SIZE
+    view = memoryview(data)
+    return [view[row * stride : (row + 1) * stride] for row in range(height)]
+
+
+def read_rgba(path, backend=None):
+    """Decode `path` to 8 bit RGBA, returns (width, height, rows)"""
+    if (backend or BACKEND) == BACKEND_PILLOW:
+        with Image.open(path) as image:
+            image = image.convert("RGBA")
+            width, height = image.size
+            return width, height, _rows(image.tobytes(), width, height)
+
+    width, height, rows, _ = png.Reader(filename=path).asRGBA8()
+    return width, height, _rows(b"".join(rows), width, height)
+
+
+def read_size(path):
+    """(width, height) of the PNG at `path`, read from its IHDR chunk without decoding the pixels"""
+    with open(path, "rb") as f:
+        head = f.read(24)
+    if len(head) < 24 or head[:8] != PNG_SIGNATURE or head[12:16] != b"IHDR":
+        raise ValueError("Not a PNG file: {}".format(path))
+    return struct.unpack(">2I", head[16:24])
+
+
+class DecodeCache:
+    """Decoded PNGs by path and modification time, so a texture is decompressed once however often it is blitted"""
+
+    def __init__(self, maxBytes=DECODE_CACHE_BYTES):
+        self.maxBytes = maxBytes
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def read_rgba(self, path):
+        """`read_rgba` through the cache, the rows are shared and must not be written to"""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        decoded = read_rgba(path)
+        size = decoded[0] * decoded[1] * PIXEL_SIZE
+        with self.lock:
+            if key not in self.entries and size <= self.maxBytes:
+                self.entries[key] = decoded
+                self.bytes += size
+                while self.bytes > self.maxBytes:
+                    _, (width, height, _) = self.entries.popitem(last=False)
+                    self.bytes -= width * height * PIXEL_SIZE
+        return decoded
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+decode_cache = DecodeCache()
+
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)))
+
+
+def _scanlines(rows, width, height, filter):
+    """The rows each prefixed with their filter type, as the bytes to compress"""
+    stride = width * PIXEL_SIZE
+    if numpy is not None and not isinstance(rows, list):
+        lines = numpy.empty((height, stride + 1), dtype=numpy.uint8)
+        lines[:, 0] = filter
+        lines[:, 1:] = rows.reshape(height, stride)
+        if filter == FILTER_UP:
+            # uint8 arithmetic wraps around like the filter expects
+            lines[1:, 1:] -= rows.reshape(height, stride)[:-1]
+        return lines.tobytes()
+
+    # without numpy only the filter that leaves the rows alone
+    return b"".join(b"\x00" + bytes(row) for row in rows)
+
+
+def write_rgba(path, width, height, rows, level=None, filter=FILTER_UP):
+    """Write `rows` as returned by `read_rgba` to an 8 bit RGBA PNG at `path`"""
+    header = struct.pack(">2I5B", width, height, 8, RGBA_COLOR_TYPE, 0, 0, 0)
+    data = zlib.compress(_scanlines(rows, width, height, filter), COMPRESSION_LEVEL if level is None else level)
+    with open(path, "wb") as f:
+        f.write(PNG_SIGNATURE + _chunk(b"IHDR", header) + _chunk(b"IDAT", data) + _chunk(b"IEND", b""))
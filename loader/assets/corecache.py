@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import shutil
+
+import lxml.etree
+import ui.log
+
+from .library import PATCHABLE_XML_FILES, JarLibrary
+from .utils import create_xml_parser
+
+CORE_CACHE_DIRNAME = "core_cache"
+CORE_CACHE_INDEX = "index.json"
+# bump when the cached files or the index change shape
+CORE_CACHE_FORMAT = 1
+
+AUDIO_DIRECTORIES = ["library/sound/", "library/music/"]
+
+
+def cache_key(library: JarLibrary):
+    """Digest of the library entries of the jar, read from the zip directory without inflating anything"""
+    if library.jar is None:
+        return None
+
+    digest = hashlib.sha1()
+    digest.update("format {}\n".format(CORE_CACHE_FORMAT).encode())
+    for info in sorted(library.jar.infolist(), key=lambda info: info.filename):
+        if info.filename.startswith("library/"):
+            digest.update("{} {} {:08x}\n".format(info.filename, info.file_size, info.CRC).encode())
+    return digest.hexdigest()
+
+
+def _strip_blank_text(tree):
+    """Drop indentation-only text so the cached copy is compact, output is pretty printed again anyway
+
+    Applied whether or not the cache is used, so cached and freshly parsed trees merge the same.
+    """
+    for element in tree.iter():
+        if element.text is not None and len(element) and not element.text.strip():
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+
+
+def _cached_filename(filename):
+    return os.path.basename(filename) + ".xml"
+
+
+def core_facts(coreLibrary, library: JarLibrary):
+    """Values derived from the vanilla library that every launch needs"""
+    # find the last region in the texture file and remember its index
+    # we will need this to add mod textures with consecutive indexes...
+    lastRegion = None
+    for lastRegion in coreLibrary["library/textures"].iterfind(".//re[@n]"):
+        pass
+
+    originalAudio = []
+    for directory in AUDIO_DIRECTORIES:
+        originalAudio.extend(library.namelist(directory))
+
+    return {
+        "last_core_region_id": int(lastRegion.get("n")),
+        "original_audio": originalAudio,
+    }
+
+
+def _parse(library: JarLibrary):
+    coreLibrary = {}
+    for filename in PATCHABLE_XML_FILES:
+        with library.open(filename) as f:
+            coreLibrary[filename] = lxml.etree.parse(f, parser=create_xml_parser())
+        _strip_blank_text(coreLibrary[filename])
+    return coreLibrary
+
+
+def _read_cache(cachePath, key):
+    try:
+        with open(os.path.join(cachePath, CORE_CACHE_INDEX), "r", encoding="utf-8") as indexFile:
+            index = json.load(indexFile)
+    except FileNotFoundError:
+        return None
+    except Exception as ex:
+        ui.log.log("  Ignoring unreadable core library cache {}: {}".format(cachePath, ex))
+        return None
+
+    if index.get("format") != CORE_CACHE_FORMAT or index.get("key") != key:
+        return None
+
+    # the cached files were written by us, no need for the recovering parser
+    parser = lxml.etree.XMLParser(huge_tree=True, remove_comments=True)
+    coreLibrary = {}
+    try:
+        for filename in PATCHABLE_XML_FILES:
+            coreLibrary[filename] = lxml.etree.parse(os.path.join(cachePath, _cached_filename(filename)), parser=parser)
+        return coreLibrary, index["facts"]
+    except (lxml.etree.LxmlError, OSError, KeyError) as ex:
+        # a launch killed while the cache was replaced, or a damaged disk, rebuild it
+        ui.log.log("  Discarding broken core library cache {}: {}".format(cachePath, ex))
+        shutil.rmtree(cachePath, ignore_errors=True)
+        return None
+
+
+def _write_cache(cacheDir, cachePath, key, version, coreLibrary, facts):
+    tmpPath = cachePath + ".tmp"
+    shutil.rmtree(tmpPath, ignore_errors=True)
+    os.makedirs(tmpPath)
+
+    for filename in PATCHABLE_XML_FILES:
+        coreLibrary[filename].write(os.path.join(tmpPath, _cached_filename(filename)), encoding="UTF-8")
+    with open(os.path.join(tmpPath, CORE_CACHE_INDEX), "w", encoding="utf-8") as indexFile:
+        json.dump({"format": CORE_CACHE_FORMAT, "version": version or "unknown", "key": key, "facts": facts}, indexFile)
+
+    # only one game install per modloader data dir, older caches are useless
+    for entry in os.listdir(cacheDir):
+        entryPath = os.path.join(cacheDir, entry)
+        if entryPath != tmpPath and os.path.isdir(entryPath):
+            shutil.rmtree(entryPath, ignore_errors=True)
+    os.replace(tmpPath, cachePath)
+
+
+def cache_path(library: JarLibrary, cacheDir, version=None, key=None):
+    """Folder in `cacheDir` holding the cache of this game library, None without a jar to key it on
+
+    `version` is the game version from `GameInfo`, it only makes the folder name readable.
+    """
+    key = key or cache_key(library)
+    if key is None:
+        return None
+    version = version or "unknown"
+    return os.path.join(cacheDir, "{}_{}".format("".join(c if c.isalnum() or c in ".-" else "_" for c in version), key[:16]))
+
+
+def load(library: JarLibrary, cacheDir=None, version=None):
+    """Parse the vanilla XML files, going through the on-disk cache in `cacheDir` when possible
+
+    `version` is the game version the cache folder is named after, see `cache_path`.
+    Returns the parsed trees keyed by library filename and the `core_facts` of the library.
+    """
+    key = cache_key(library) if cacheDir else None
+    if key is None:
+        coreLibrary = _parse(library)
+        return coreLibrary, core_facts(coreLibrary, library)
+
+    cachePath = cache_path(library, cacheDir, version, key)
+
+    cached = _read_cache(cachePath, key)
+    if cached is not None:
+        ui.log.log("  Using cached core library {}".format(cachePath))
+        return cached
+
+    ui.log.log("  Building core library cache {}...".format(cachePath))
+    coreLibrary = _parse(library)
+    facts = core_facts(coreLibrary, library)
+
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        _write_cache(cacheDir, cachePath, key, version, coreLibrary, facts)
+    except Exception as ex:
+        ui.log.log("  Failed to write core library cache {}: {}".format(cachePath, ex))
+
+    return coreLibrary, facts
@@ -1,9 +1,10 @@
 import math
 import lxml.etree
-import png
 import os
 import rectpack
 
+from loader.assets import codec
+
 
 class TextureManager:
     _TexFileResolution = 2000
@@ -121,7 +122,7 @@ class RegisteredTexture:
         self.CoreRegionID = regionID
 
         filepath = TextureManager.getModTexturePath(self.ParentMod, self.TexPath)
-        (w, h, rows, info) = png.Reader(filepath).asRGBA()
+        w, h = codec.read_size(filepath)
 
         self.FileSizeX = w
         self.FileSizeY = h
@@ -1,33 +1,22 @@
+import concurrent.futures
+import contextlib
 import hashlib
-import io
+import multiprocessing
 import os
 import struct
+import sys
 import zlib
 
 import lxml.etree
-import png
 import ui.log
 
-from loader.assets.utils import create_xml_parser
-
-PIXEL_SIZE = 4
-RGBA_FORMAT = 4
-HEADER_SIZE = 12
-
-"""
-alt code for png
-        if 0:
-            from PIL import Image
-            reader = Image.open(path)
-            print(reader.format, reader.size, reader.mode)
-            width, height = reader.size
-            img_data = reader.getdata()
-            for row_idx in range(height):
-                start = (x + ((row_idx + y) * width)) * PIXEL_SIZE + HEADER_SIZE
-                end = start + (width * PIXEL_SIZE)
-                # FIXME might be tricky to get the image in the correct format ...
-        else:
-"""
+from loader.assets import cim, codec
+from loader.assets.cim import CIM_CHUNK_SIZE, HEADER_SIZE, PIXEL_SIZE, RGBA_FORMAT
+from loader.assets.utils import create_xml_parser, texture_workers
+
+# zlib level of written pages, the fast one trades a bigger jar for quicker launches
+CIM_COMPRESSION_LEVEL = 6
+CIM_FAST_COMPRESSION_LEVEL = 1
 
 
 class Texture:
@@ -48,52 +37,79 @@ class Texture:
 
         self.data = bytearray(self.width * self.height * PIXEL_SIZE)
 
+    @classmethod
+    def from_file(cls, f, name):
+        """Decode the page read from the binary file object `f`, `name` is for the log"""
+        texture = cls.__new__(cls)
+        texture._read_cim(f, name)
+        return texture
+
     def _import_cim(self, path):
-        data = io.BytesIO(zlib.decompress(open(path, "rb").read()))
-        md5 = hashlib.md5(data.getbuffer()).hexdigest()
-        ui.log.log("  %s vanilla md5 %s %d bytes" % (os.path.split(path)[1], md5, data.getbuffer().nbytes))
+        with open(path, "rb") as f:
+            self._read_cim(f, path)
+
+    def _read_cim(self, f, path):
+        self.header, self.data, messages = cim.read_cim(f, path)
+        for message in messages:
+            ui.log.log(message)
 
-        self.header = data.read(HEADER_SIZE)
+        if len(self.header) < HEADER_SIZE:
+            self.width = self.height = 0
+            return
         self.width = struct.unpack_from(">i", self.header)[0]
         self.height = struct.unpack_from(">i", self.header, offset=4)[0]
         self.format = struct.unpack_from(">i", self.header, offset=8)[0]
 
         if self.format == RGBA_FORMAT:
             self.mode = "RGBA"
-        else:
-            ui.log.log("ERROR: Unknown CIM format: {}".format(self.format))
-            return
 
-        self.data = bytearray(data.read())
-        expected_size = self.width * self.height * PIXEL_SIZE
-        if len(self.data) != expected_size:
-            ui.log.log("ERROR: Wrong size %s: %d vs %d" % (path, len(self.data), expected_size))
+    @property
+    def pixels(self):
+        """The page as a (height, width, 4) numpy array over the memory of `data`, None without numpy or on a bad page"""
+        return cim.pixels(self.data, self.width, self.height)
+
+    def region(self, x, y, width, height):
+        """The pixels of a region, as a numpy array or a list of row copies like `codec.read_rgba` returns them"""
+        return cim.region(self.data, self.width, self.height, x, y, width, height)
 
     def pack_png(self, path, x=0, y=0, w=0, h=0):
-        reader = png.Reader(filename=path)
-        (width, height, rows, info) = reader.asRGBA()
+        width, height, rows = codec.decode_cache.read_rgba(path)
         if w and w != width:
             ui.log.log("ERROR: Wrong width in %s: %d vs %d" % (path, width, w))
             return
         if h and h != height:
             ui.log.log("ERROR: Wrong width in %s: %d vs %d" % (path, height, h))
             return
+        if x + width > self.width or y + height > self.height:
+            ui.log.log("ERROR: %s at %d,%d does not fit the %dx%d page" % (path, x, y, self.width, self.height))
+            return
 
-        row_idx = 0
-        for row in rows:
-            start = (x + ((row_idx + y) * self.width)) * PIXEL_SIZE
-            end = start + (width * PIXEL_SIZE)
+        pixels = self.pixels
+        if pixels is not None:
+            pixels[y : y + height, x : x + width] = rows
+        else:
+            row_idx = 0
+            for row in rows:
+                start = (x + ((row_idx + y) * self.width)) * PIXEL_SIZE
+                end = start + (width * PIXEL_SIZE)
 
-            self.data[start:end] = row
-            row_idx += 1
+                self.data[start:end] = row
+                row_idx += 1
         ui.log.log("  Repacked {}...".format(os.path.split(path)[1]))
 
-    def export_cim(self, path):
-        export = self.header + self.data
-        md5 = hashlib.md5(export).hexdigest()
-        ui.log.log("  %s MODDED md5 %s %d bytes" % (os.path.split(path)[1], md5, len(export)))
-        with open(path, "wb") as cim:
-            cim.write(zlib.compress(export))
+    def export_cim(self, path, level=None):
+        """Deflate the page to `path` at zlib `level`, `CIM_COMPRESSION_LEVEL` by default"""
+        md5 = hashlib.md5(self.header)
+        md5.update(self.data)
+        ui.log.log("  %s MODDED md5 %s %d bytes" % (os.path.split(path)[1], md5.hexdigest(), len(self.header) + len(self.data)))
+
+        compressor = zlib.compressobj(CIM_COMPRESSION_LEVEL if level is None else level)
+        data = memoryview(self.data)
+        with open(path, "wb") as cimFile:
+            cimFile.write(compressor.compress(self.header))
+            for start in range(0, len(data), CIM_CHUNK_SIZE):
+                cimFile.write(compressor.compress(data[start : start + CIM_CHUNK_SIZE]))
+            cimFile.write(compressor.flush())
 
     def export_png(self, path, x=0, y=0, width=None, height=None):
         if width is None:
@@ -101,53 +117,59 @@ class Texture:
         if height is None:
             height = self.height
 
-        rows = []
-        for row in range(height):
-            start = (x + ((row + y) * self.width)) * PIXEL_SIZE
-            end = start + (width * PIXEL_SIZE)
+        codec.write_rgba(path, width, height, self.region(x, y, width, height))
 
-            rows.append(self.data[start:end])
 
-        with open(path, "wb") as file:
-            writer = png.Writer(width=width, height=height, greyscale=False, alpha=True)
-            writer.write_packed(file, rows)
+@contextlib.contextmanager
+def _main_script_hidden():
+    """Keep spawned workers from importing the script that was started, the window, again
 
+    Without a file to run, multiprocessing starts the children without a main module.
+    """
+    main = sys.modules["__main__"]
+    mainFile = getattr(main, "__file__", None)
+    if getattr(main, "__spec__", None) is not None or mainFile is None:
+        yield
+        return
+    del main.__file__
+    try:
+        yield
+    finally:
+        main.__file__ = mainFile
 
-def explode(corePath):
-    """Decode textures and write them out as individual regions"""
 
-    textures = lxml.etree.parse(os.path.join(corePath, "library", "textures"), parser=create_xml_parser())
-    cims = {}
-    # export_cims = {}
+def explode(corePath, workers=None):
+    """Decode textures and write them out as individual regions
 
-    regions = textures.xpath("//re[@n]")
+    Pages are independent of each other and exploded in up to `workers` processes, see `utils.texture_workers`.
+    """
 
-    ui.log.log("  Exploding textures at {}...".format(corePath))
+    textures = lxml.etree.parse(os.path.join(corePath, "library", "textures"), parser=create_xml_parser())
 
+    pages = {}
+    regions = textures.xpath("//re[@n]")
     for region in regions:
-        name = region.get("n")
-
-        x = int(region.get("x"))
-        y = int(region.get("y"))
-        w = int(region.get("w"))
-        h = int(region.get("h"))
-
-        page = region.get("t")
-
-        if page not in cims:
-            cim_filename = "{}.cim".format(page)
-            ui.log.updateBackgroundState("Unpacking textures ({})".format(cim_filename))
-            cims[page] = Texture(os.path.join(corePath, "library", cim_filename))
-
-        try:
-            os.makedirs(os.path.join(corePath, "library", "textures.exploded", page))
-        except FileExistsError:
-            pass
-
-        png_filename = os.path.join(corePath, "library", "textures.exploded", page, "{}.png".format(name))
-        cims[page].export_png(png_filename, x, y, w, h)
-
-    for page in cims:
-        cims[page].export_png(os.path.join(corePath, "library", "textures.exploded", "{}.png".format(page)))
+        pages.setdefault(region.get("t"), []).append((region.get("n"), int(region.get("x")), int(region.get("y")), int(region.get("w")), int(region.get("h"))))
+
+    workers = min(texture_workers() if workers is None else workers, len(pages))
+    ui.log.log("  Exploding textures at {} with {} worker(s)...".format(corePath, workers))
+
+    if workers <= 1:
+        for done, page in enumerate(pages):
+            ui.log.updateBackgroundState("Unpacking textures ({}/{} pages)".format(done, len(pages)))
+            for message in cim.explode_page(corePath, page, pages[page]):
+                ui.log.log(message)
+    else:
+        # spawned rather than forked, the parent runs the UI and log writer threads
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            # workers are started as tasks are submitted
+            with _main_script_hidden():
+                futures = [executor.submit(cim.explode_page, corePath, page, pages[page]) for page in pages]
+            ui.log.updateBackgroundState("Unpacking textures (0/{} pages)".format(len(pages)))
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                for message in future.result():
+                    ui.log.log(message)
+                ui.log.updateBackgroundState("Unpacking textures ({}/{} pages)".format(done, len(pages)))
 
     ui.log.log("    Wrote {} texture regions".format(len(regions)))
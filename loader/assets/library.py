@@ -1,7 +1,12 @@
+import copy
 import os
+import struct
+import zlib
 import zipfile39
 import ui.log
 
+from loader import timing
+
 PATCHABLE_XML_FILES = [
     "library/haven",
     "library/texts",
@@ -12,6 +17,13 @@ PATCHABLE_XML_FILES = [
 
 PATCHABLE_CIM_FILES = ["library/%d.cim" % i for i in range(24)]
 
+# Local file header layout (APPNOTE 4.3.7): signature, versions, flags, sizes, then name/extra lengths
+LOCAL_HEADER_SIGNATURE = b"PK\003\004"
+LOCAL_HEADER_SIZE = 30
+LOCAL_HEADER_LENGTHS_OFFSET = 26
+ZIP64_LIMIT = (1 << 31) - 1
+RAW_COPY_CHUNK_SIZE = 1024 * 1024
+
 
 def extract(jarPath, corePath):
     """Extract library files from spacehaven.jar"""
@@ -28,8 +40,112 @@ def extract(jarPath, corePath):
                 spacehaven.extract(file, corePath)
 
 
-def patch(jarPath, corePath, resultPath, extra_assets=None):
-    """Patch spacehaven.jar with custom library files"""
+class JarLibrary:
+    """Read access to the library files of spacehaven.jar without extracting them
+
+    Files written to `corePath` (merged XML, repacked pages, mod assets) shadow the jar entries.
+    Without a `jarPath` only `corePath` is used, which behaves like a fully extracted library.
+    """
+
+    def __init__(self, jarPath, corePath):
+        self.jarPath = jarPath
+        self.corePath = corePath
+        self.jar = zipfile39.ZipFile(jarPath, "r") if jarPath else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.jar:
+            self.jar.close()
+            self.jar = None
+
+    def path(self, file):
+        return os.path.join(self.corePath, file.replace("/", os.sep))
+
+    def namelist(self, prefix="library/"):
+        """Names of the files under `prefix`, from both the jar and `corePath`"""
+        names = set()
+        if self.jar:
+            names.update(file for file in self.jar.namelist() if file.startswith(prefix) and not file.endswith("/"))
+        for abs_dir, _, filenames in os.walk(self.path(prefix)):
+            rel_dir = os.path.relpath(abs_dir, self.corePath)
+            for filename in filenames:
+                names.add(os.path.join(rel_dir, filename).replace(os.sep, "/"))
+        return sorted(names)
+
+    def open(self, file):
+        """Open `file` for binary reading, streaming it from the jar unless a copy exists in `corePath`"""
+        path = self.path(file)
+        if self.jar is None or os.path.isfile(path):
+            return open(path, "rb")
+        return self.jar.open(file)
+
+    def extract(self, file):
+        """Make sure `file` exists in `corePath` and return its path"""
+        path = self.path(file)
+        if self.jar is not None and not os.path.isfile(path):
+            self.jar.extract(file, self.corePath)
+        return path
+
+
+def _modded_files(corePath, extra_assets=None):
+    """Patchable files and extra assets that were written to `corePath`"""
+    files = dict.fromkeys(PATCHABLE_XML_FILES + PATCHABLE_CIM_FILES + (extra_assets or []))
+    return [file for file in files if os.path.isfile(os.path.join(corePath, file.replace("/", os.sep)))]
+
+
+def _can_copy_raw(info):
+    """Whether `info` can be transferred without inflating it"""
+    if info.flag_bits & 0x01:
+        # encrypted entries carry an encryption header we don't want to reason about
+        return False
+    # the zip64 extra field would need rewriting, let zipfile handle those
+    return info.file_size < ZIP64_LIMIT and info.compress_size < ZIP64_LIMIT
+
+
+def _copy_raw(original, patched, info):
+    """Copy the compressed bytes of `info` from `original` straight into `patched`"""
+
+    original.fp.seek(info.header_offset)
+    header = original.fp.read(LOCAL_HEADER_SIZE)
+    if len(header) != LOCAL_HEADER_SIZE or header[:4] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile39.BadZipFile("Bad local file header for {}".format(info.filename))
+    nameLength, extraLength = struct.unpack_from("<2H", header, LOCAL_HEADER_LENGTHS_OFFSET)
+    original.fp.seek(nameLength + extraLength, os.SEEK_CUR)
+
+    zinfo = copy.copy(info)
+    # CRC and sizes are already known, so they go in the header instead of a trailing data descriptor
+    zinfo.flag_bits &= ~0x08
+
+    patched.fp.seek(patched.start_dir)
+    zinfo.header_offset = patched.fp.tell()
+    patched._writecheck(zinfo)
+    patched._didModify = True
+    patched.fp.write(zinfo.FileHeader(False))
+
+    remaining = zinfo.compress_size
+    while remaining > 0:
+        chunk = original.fp.read(min(remaining, RAW_COPY_CHUNK_SIZE))
+        if not chunk:
+            raise EOFError("Truncated data for {}".format(info.filename))
+        patched.fp.write(chunk)
+        remaining -= len(chunk)
+
+    patched.start_dir = patched.fp.tell()
+    patched.filelist.append(zinfo)
+    patched.NameToInfo[zinfo.filename] = zinfo
+
+
+@timing.timed("library.patch")
+def patch(jarPath, corePath, resultPath, extra_assets=None, raw_copy=True):
+    """Patch spacehaven.jar with custom library files
+
+    With `raw_copy`, untouched entries keep their original compression and are copied byte for byte.
+    """
 
     ui.log.log("Patch spacehaven.jar with custom library files...")
 
@@ -38,23 +154,64 @@ def patch(jarPath, corePath, resultPath, extra_assets=None):
 
     ui.log.updateBackgroundState("Merging vanilla files")
 
-    update_files = PATCHABLE_XML_FILES + PATCHABLE_CIM_FILES
-    for file in set(original.namelist()):
-        if not file.endswith("/") and file not in update_files:
-            try:
+    update_files = _modded_files(corePath, extra_assets)
+    skip_files = set(update_files)
+    seen_files = set()
+    for info in original.infolist():
+        file = info.filename
+        if file.endswith("/") or file in skip_files or file in seen_files:
+            continue
+        seen_files.add(file)
+        try:
+            if raw_copy and _can_copy_raw(info):
+                _copy_raw(original, patched, info)
+            else:
                 patched.writestr(file, original.read(file))
-            except Exception as e:
-                ui.log.log("ERROR: Unable to add {} to {}: {}".format(str(file), str(resultPath), str(e)))
-                pass
+        except Exception as e:
+            ui.log.log("ERROR: Unable to add {} to {}: {}".format(str(file), str(resultPath), str(e)))
+            pass
 
     original.close()
 
     ui.log.updateBackgroundState("Merging modded files")
 
-    if extra_assets:
-        update_files += extra_assets
     for file in update_files:
         ui.log.log("  Merging modded {}...".format(file))
         patched.write(os.path.join(corePath, file.replace("/", os.sep)), file)
 
     patched.close()
+
+
+def _is_modified(original, corePath, file):
+    """Whether the extracted copy of `file` differs from the entry in `original`"""
+    try:
+        info = original.getinfo(file)
+    except KeyError:
+        return True
+
+    path = os.path.join(corePath, file.replace("/", os.sep))
+    if os.path.getsize(path) != info.file_size:
+        return True
+
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(RAW_COPY_CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc != info.CRC
+
+
+@timing.timed("library.overlay")
+def overlay(jarPath, corePath, resultPath, extra_assets=None):
+    """Write the modded library files into a small jar meant to sit ahead of spacehaven.jar on the classPath"""
+
+    ui.log.log("Writing modded library files to overlay {}...".format(resultPath))
+
+    ui.log.updateBackgroundState("Writing overlay jar")
+
+    update_files = _modded_files(corePath, extra_assets)
+    with zipfile39.ZipFile(jarPath, "r") as original, zipfile39.ZipFile(resultPath, "w") as patched:
+        for file in update_files:
+            if file in PATCHABLE_CIM_FILES and not _is_modified(original, corePath, file):
+                continue
+            ui.log.log("  Adding modded {}...".format(file))
+            patched.write(os.path.join(corePath, file.replace("/", os.sep)), file)
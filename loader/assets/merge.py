@@ -1,20 +1,21 @@
+import concurrent.futures
 import copy
 import os
 from pathlib import Path
 import shutil
 
 import lxml.etree
-import png
-import rectpack
-import ui.database
 import ui.log
+from loader import timing
 
+from . import atlas, codec, corecache, moddigest, regionindex, snapshot
 from .explode import Texture
-from .library import PATCHABLE_CIM_FILES, PATCHABLE_XML_FILES
-from .patch import doPatches
-from .utils import create_xml_parser
+from .library import PATCHABLE_CIM_FILES, PATCHABLE_XML_FILES, JarLibrary
+from .patch import compileXPath, doPatches, logXPathCacheStats
+from .utils import create_xml_parser, texture_workers as default_texture_workers
 
 
+@timing.timed("_detect_textures", mod=lambda coreLibrary, modLibrary, mod: os.path.basename(mod))
 def _detect_textures(coreLibrary, modLibrary, mod):
     textures_path = os.path.join(mod, "textures")
     if not os.path.isdir(textures_path):
@@ -121,81 +122,12 @@ def _detect_textures(coreLibrary, modLibrary, mod):
             new_id = mapping_n_region[mod_local_id]
             asset.set("a", new_id)
 
-    if len(needs_autogeneration):
-        # image_count = len(needs_autogeneration)
-
-        regionsNode = textures_mod.find(".//regions")
-        texturesNode = textures_mod.find(".//textures")
-
-        textureID: int = ui.database.ModDatabase.getMod(mod).prefix
-
-        # Catch missing Modder ID.  Still try to process and move forward.
-        if not textureID or textureID <= 0:
-            ui.log.log("ERROR: info.xml is missing <modid>.  Mod Author should set this to their Discord ID for all mods they make.")
-            textureID = 9999
-
-        packer = rectpack.newPacker(rotation=False)
-
-        # Sprite sheets MUST be 2048 x 2048
-        standard_dimension: int = 2048
-        str_dimension: str = str(standard_dimension)
-        packer.add_bin(standard_dimension, standard_dimension)
-
-        # First get all the files and them to the packer pack them into a new texture square
-        for regionName in needs_autogeneration:
-            (w, h, rows, info) = png.Reader(textures_path + "/" + regionName).asRGBA()
-            packer.add_rect(w, h, regionName)
-
-        # Pack files and check that we packed everything
-        packer.pack()
-        rectangles_packed: int = sum(len(packer_bin) for packer_bin in packer)
-        if rectangles_packed < len(needs_autogeneration):
-            # TODO handle case when we can't pack all the textures into one bin instead of raising an Exception
-            raise Exception(
-                f"Mod '{os.path.basename(mod)}' exceeds available sprite sheet space. Contact Mod Author." " Mod Authors should spread the sprites into multiple mods to work around this limitation."
-            )
-
-        newTex = lxml.etree.SubElement(texturesNode, "t")
-        newTex.set("i", str(textureID))
-        newTex.set("w", str_dimension)
-        newTex.set("h", str_dimension)
-        coreLibrary["_custom_textures_cim"][str(textureID)] = newTex.attrib
-
-        # prepare to export packed PNG to mod directory.
-        kwargs = {
-            "create": True,
-            "width": standard_dimension,
-            "height": standard_dimension,
-        }
-        export_path = os.path.join(mod, f"custom_texture_{textureID}.png")
-        custom_png: Texture = Texture(export_path, **kwargs)
-
-        packedRectsSorted = {}
-        for rect in packer.rect_list():
-            b, x, y, w, h, rid = rect
-            remappedID = mapping_n_region[rid]
-            packedRectsSorted[remappedID] = (str(x), str(y), str(w), str(h), str(rid))
-            custom_png.pack_png(os.path.join(textures_path, rid), x, y, w, h)
-
-        # write back the cim file as png for debugging
-        # this only includes textures from this mod, not the final generated cim.
-        custom_png.export_png(export_path)
-
-        # NOT YET SORTED
-        packedRectsSorted = {k: v for k, v in sorted(packedRectsSorted.items())}
-        # NOW SORTED: We need this to make sure the IDs are added to the textures file in the correct order
-
-        for remappedID, data in packedRectsSorted.items():
-            x, y, w, h, regionFileName = data
-            # remapData = modded_textures[remappedID]
-            newNode = lxml.etree.SubElement(regionsNode, "re")
-            newNode.set("n", remappedID)
-            newNode.set("t", str(textureID))
-            newNode.set("x", x)
-            newNode.set("y", y)
-            newNode.set("w", w)
-            newNode.set("h", h)
-            newNode.set("file", regionFileName)
+    # the regions are placed once every mod is merged, see atlas.add_pages
+    for regionName in needs_autogeneration:
+        if regionName not in mapping_n_region:
+            continue
+        w, h = codec.read_size(os.path.join(textures_path, regionName))
+        modded_textures[mapping_n_region[regionName]].update(atlas=True, w=w, h=h)
 
     for asset in textures_mod.xpath("//re[@n]"):
         mod_local_id = asset.get("n")
@@ -205,13 +137,10 @@ def _detect_textures(coreLibrary, modLibrary, mod):
         ui.log.log("  Mapping texture 're' {} to {}...".format(mod_local_id, new_id))
         asset.set("n", new_id)
 
-    # write the new textures XML if changed.
-    if autoAnimations:
-        modLibrary["library/textures"][0].write(os.path.join(mod, "library", "generated_textures.xml"), pretty_print=True)
-
     return modded_textures
 
 
+@timing.timed("buildLibrary", mod=lambda location, mod: os.path.basename(mod))
 def buildLibrary(location: str, mod: str):
     """Build up a library dict of files in `location`"""
 
@@ -246,26 +175,111 @@ def buildLibrary(location: str, mod: str):
     return location_library
 
 
-def mods(corePath, activeMods, modPaths):
-    # Load the core library files
-    coreLibrary = {}
+@timing.timed("_repack_page")
+def _repack_page(page, cim_path, kwargs, regions, cache=None, debug_dir=None, level=None):
+    """Decode a texture page, blit the modded regions into it and write it back to `cim_path` at zlib `level`
+
+    New pages are taken from the `atlas.AtlasCache` `cache` when the same regions were blitted before,
+    `debug_dir` gets a PNG of each new page.
+    """
+    key = None
+    if cache is not None and kwargs["create"]:
+        key = cache.page_key(kwargs["width"], kwargs["height"], regions, level)
+        if cache.restore_page(key, cim_path):
+            ui.log.log("  Reusing composited {}.cim".format(page))
+            return
+
+    texture = Texture(cim_path, **kwargs)
+    for png_file, x, y, w, h in regions:
+        ui.log.log("  Patching {}.cim...".format(page))
+        texture.pack_png(png_file, x, y, w, h)
+
+    ui.log.log("  Writing {}.cim...".format(page))
+    texture.export_cim(cim_path, level)
+    if key is not None:
+        cache.save_page(key, cim_path)
+    if debug_dir is not None and kwargs["create"]:
+        os.makedirs(debug_dir, exist_ok=True)
+        texture.export_png(os.path.join(debug_dir, "{}.png".format(page)))
+
+
+def _snapshot_steps(activeMods, modPaths, cache):
+    """The merge and patch steps of the load order, as expected by `snapshot.step_keys`"""
+    steps = [(snapshot.MERGE_STEP, mod, snapshot.mod_digest(mod, snapshot.MERGE_DIRECTORIES, cache), []) for mod in modPaths]
+    steps += [(snapshot.PATCH_STEP, mod.path, snapshot.mod_digest(mod.path, snapshot.PATCH_DIRECTORIES, cache), [(var.name, var.value) for var in mod.variables]) for mod in activeMods]
+    return steps
+
+
+@timing.timed("merge.mods")
+def mods(corePath, activeMods, modPaths, library: JarLibrary = None, texture_workers: int = None, core_cache_dir=None, snapshot_dir=None, atlas_dir=None, texture_debug_dir=None, cim_level=None, digest_cache_path=None, game_version=None):
+    """Merge and patch mods into the core library, writing modified files to `corePath`
+
+    `library` serves the vanilla files, by default they are read from an extracted library in `corePath`.
+    `texture_workers` is the number of texture pages repacked concurrently, see `utils.texture_workers`.
+    `core_cache_dir` keeps a fast loading copy of the vanilla XML between launches, see `corecache.load`.
+    `snapshot_dir` keeps the merged library after each mod so a relaunch resumes after the unchanged mods, see `snapshot.SnapshotStore`.
+    `atlas_dir` keeps the layout and pixels of generated texture pages while their sprites are unchanged, see `atlas.AtlasCache`.
+    `texture_debug_dir` gets a PNG of every generated texture page and their regions, see `atlas.add_pages`.
+    `cim_level` is the zlib level of the repacked texture pages.
+    `digest_cache_path` remembers the digests of mod files for the snapshot keys, see `moddigest.DigestCache`.
+    `game_version` names the core cache folder, see `corecache.cache_path`.
+    """
+    if library is None:
+        library = JarLibrary(None, corePath)
+    # the spans are charged to mod folders, the cost report shows the names from info.xml like the window does
+    for mod in activeMods:
+        timing.name_mod(os.path.basename(mod.path), mod.name)
+    # a debug run writes every page out, not from the cache
+    atlasCache = atlas.AtlasCache(atlas_dir) if atlas_dir and not texture_debug_dir else None
+    # left over when the previous launch failed
+    codec.decode_cache.clear()
 
     def _core_path(filename):
         return os.path.join(corePath, filename.replace("/", os.sep))
 
-    for filename in PATCHABLE_XML_FILES:
-        with open(_core_path(filename), "rb") as f:
-            coreLibrary[filename] = lxml.etree.parse(f, parser=create_xml_parser())
-
-    # find the last region in the texture file and remember its index
-    # we will need this to add mod textures with consecutive indexes...
-    coreLibrary["_last_core_region_id"] = int(coreLibrary["library/textures"].find(".//re[@n][last()]").get("n"))
-    coreLibrary["_next_region_id"] = coreLibrary["_last_core_region_id"] + 1
-    coreLibrary["_all_modded_textures"] = {}
-    coreLibrary["_custom_textures_cim"] = {}
+    snapshots = None
+    snapshotKeys = []
+    resumed = 0
+    baseKey = snapshot.base_key(library) if snapshot_dir else None
+    if baseKey is not None:
+        digestCache = moddigest.DigestCache(digest_cache_path)
+        with timing.span("snapshot.keys"):
+            snapshotKeys = snapshot.step_keys(baseKey, _snapshot_steps(activeMods, modPaths, digestCache))
+        digestCache.save()
+        snapshots = snapshot.SnapshotStore(snapshot_dir)
+        with timing.span("snapshot.restore"):
+            resumed, coreLibrary, coreFacts = snapshots.restore(snapshotKeys)
+        if resumed:
+            ui.log.log("  Resuming from the snapshot taken after {} of {} mod steps".format(resumed, len(snapshotKeys)))
+
+    if not resumed:
+        # Load the core library files
+        with timing.span("corecache.load"):
+            coreLibrary, coreFacts = corecache.load(library, core_cache_dir, game_version)
+
+        coreLibrary["_next_region_id"] = coreFacts["last_core_region_id"] + 1
+        coreLibrary["_all_modded_textures"] = {}
+        coreLibrary["_custom_textures_cim"] = {}
+
+    # we will need the last core region to add mod textures with consecutive indexes...
+    coreLibrary["_last_core_region_id"] = coreFacts["last_core_region_id"]
+    coreLibrary["_merge_indexes"] = {}
+
+    # files changed between steps, saved with the next snapshot
+    untracked = set()
+
+    def _snapshot(step, touched):
+        if snapshots is not None:
+            with timing.span("snapshot.save"):
+                snapshots.save(snapshotKeys[step], coreLibrary, coreFacts, touched | untracked)
+            untracked.clear()
 
     # Merge in modded files
-    for mod in modPaths:
+    for step, mod in enumerate(modPaths):
+        if step < resumed:
+            ui.log.log("  Mod {} unchanged, merge restored from snapshot".format(mod))
+            continue
+
         ui.log.updateLaunchState("Installing {}".format(os.path.basename(mod)))
 
         ui.log.log("  Loading mod {}...".format(mod))
@@ -273,20 +287,43 @@ def mods(corePath, activeMods, modPaths):
         # Load the mod's library
         modLibrary = buildLibrary("library", mod)
         doMerges(coreLibrary, modLibrary, mod)
+        _snapshot(step, set(modLibrary))
+
+    # Patches can move or remove any node, the merge indexes are only valid until then
+    coreLibrary["_merge_indexes"] = {}
+
+    # Sprites of all mods share pages, patches see their regions like any other
+    if resumed <= len(modPaths):
+        with timing.span("pack atlas"):
+            if atlas.add_pages(coreLibrary, cache=atlasCache, debug_dir=texture_debug_dir):
+                untracked.add("library/textures")
 
     # Do patches after merges to avoid clobbers
-    for mod in activeMods:
+    xpathStats = compileXPath.cache_info()
+    for step, mod in enumerate(activeMods, len(modPaths)):
+        if step < resumed:
+            ui.log.log(f"  Mod {mod.path} unchanged, patches restored from snapshot")
+            continue
+
         ui.log.updateLaunchState(f"Patching {os.path.basename(mod.path)}")
         ui.log.log(f"  Loading patches {mod.path}...")
         modPatchesLibrary = buildLibrary("patches", mod.path)
         doPatches(coreLibrary, modPatchesLibrary, mod)
+        _snapshot(step, set(modPatchesLibrary))
+    logXPathCacheStats(xpathStats)
+    atlas.check_page_ids(coreLibrary)
+
+    if snapshots is not None:
+        snapshots.prune(snapshotKeys)
 
     ui.log.updateLaunchState("Updating XML")
 
     # Write out the new base library
-    for filename in PATCHABLE_XML_FILES:
-        with open(_core_path(filename), "wb") as f:
-            f.write(lxml.etree.tostring(coreLibrary[filename], pretty_print=True, encoding="UTF-8"))
+    os.makedirs(_core_path("library"), exist_ok=True)
+    with timing.span("write xml"):
+        for filename in PATCHABLE_XML_FILES:
+            with open(_core_path(filename), "wb") as f:
+                f.write(lxml.etree.tostring(coreLibrary[filename], pretty_print=True, encoding="UTF-8"))
 
     # EXTRA ASSETS ADDED BY MODS
     extra_assets = []
@@ -303,14 +340,7 @@ def mods(corePath, activeMods, modPaths):
     valid_audio_extensions = ["ogg", "mp3"]
 
     # get the game's original audio file list
-    original_audio_relative_paths = set()
-    for valid_audio_type in valid_audio_types:
-        original_audio_directory = os.path.join(corePath, "library", valid_audio_type.lower())
-        for abs_dir, _, filenames in os.walk(original_audio_directory):
-            for filename in filenames:
-                rel_dir = os.path.relpath(abs_dir, corePath)
-                rel_path = os.path.join(rel_dir, filename)
-                original_audio_relative_paths.add(rel_path.replace(os.sep, "/"))
+    original_audio_relative_paths = set(coreFacts["original_audio"])
 
     # process each audio entry in 'audio' file
     for audio in coreLibrary["library/audio"].xpath("//a[@n and @at]"):
@@ -367,14 +397,22 @@ def mods(corePath, activeMods, modPaths):
         # copy audio to library
         ui.log.log(f"  Copying {audio_relative_path}...")
         audio_dst_path = os.path.join(corePath, "library", audio_type.lower(), audio_encoding, audio_filename)
+        os.makedirs(os.path.dirname(audio_dst_path), exist_ok=True)
         shutil.copy(str(audio_src_path), audio_dst_path)
+        timing.count("audio_bytes", os.path.getsize(audio_dst_path), mod=audio_path_list[0][0])
         extra_assets.append(audio_relative_path)
 
     # TEXTURE
     ui.log.updateLaunchState("Packing textures")
     # add or overwrite textures from mods. This is done after all the XML has been merged into the core "textures" file
-    cims = {}
-    reexport_cims = {}
+    pages = {}
+
+    # vanilla pages are left alone when a mod ships their sprites unchanged
+    regionIndex = None
+    indexPath = corecache.cache_path(library, core_cache_dir, game_version) if core_cache_dir else None
+    if indexPath is not None:
+        regionIndex = regionindex.RegionIndex(library, os.path.join(indexPath, regionindex.REGION_INDEX_FILENAME))
+    unchangedRegions = 0
 
     for region in coreLibrary["library/textures"].xpath("//re[@n]"):
         name = region.get("n")
@@ -385,7 +423,19 @@ def mods(corePath, activeMods, modPaths):
         png_file = coreLibrary["_all_modded_textures"][name]["path"]
 
         page = region.get("t")
-        if page not in cims:
+        x = int(region.get("x"))
+        y = int(region.get("y"))
+        w = int(region.get("w"))
+        h = int(region.get("h"))
+
+        if regionIndex is not None and "library/{}.cim".format(page) in PATCHABLE_CIM_FILES:
+            with timing.span("region index"):
+                unchanged = regionIndex.unchanged(page, png_file, x, y, w, h)
+            if unchanged:
+                unchangedRegions += 1
+                continue
+
+        if page not in pages:
             cim_name = "{}.cim".format(page)
             kwargs = {"create": False}
             # TODO better cross checking of texture packs
@@ -394,30 +444,40 @@ def mods(corePath, activeMods, modPaths):
                 kwargs["width"] = coreLibrary["_custom_textures_cim"][page]["w"]
                 kwargs["height"] = coreLibrary["_custom_textures_cim"][page]["h"]
                 extra_assets.append("library/" + cim_name)
+                cim_path = _core_path("library/" + cim_name)
+            else:
+                # only pages receiving modded regions are pulled out of the jar
+                cim_path = library.extract("library/" + cim_name)
 
-            cims[page] = Texture(os.path.join(corePath, "library", cim_name), **kwargs)
+            pages[page] = (cim_path, kwargs, [])
 
-            reexport_cims[page] = set()
+        pages[page][2].append((png_file, x, y, w, h))
 
-        # write back the cim file as png for debugging
-        # reexport_cims[page].add(os.path.normpath(mod + "/textures"))
+    if regionIndex is not None:
+        regionIndex.save()
+    if unchangedRegions:
+        ui.log.log("  Skipped {} modded region(s) identical to vanilla".format(unchangedRegions))
 
-        x = int(region.get("x"))
-        y = int(region.get("y"))
-        w = int(region.get("w"))
-        h = int(region.get("h"))
+    # pages are independent of each other, regions within a page keep their order
+    workers = default_texture_workers() if texture_workers is None else max(1, texture_workers)
+    ui.log.log("  Repacking {} texture page(s) with {} worker(s)...".format(len(pages), workers))
+    with timing.span("repack textures"), concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_repack_page, page, *pages[page], atlasCache, texture_debug_dir, cim_level) for page in pages]
+        for future in futures:
+            future.result()
 
-        ui.log.log("  Patching {}.cim...".format(page))
-        cims[page].pack_png(png_file, x, y, w, h)
+    if atlasCache is not None:
+        atlasCache.prune()
 
-    # cims contains only the textures files that have actually been modified
-    for page in cims:
-        ui.log.log("  Writing {}.cim...".format(page))
-        cims[page].export_cim(os.path.join(corePath, "library", "{}.cim".format(page)))
+    decoded = codec.decode_cache
+    if decoded.hits:
+        ui.log.log(f"  Decoded PNGs reused {decoded.hits} times, {decoded.misses} decoded")
+    decoded.clear()
 
     return extra_assets
 
 
+@timing.timed("doMerges", mod=lambda coreLib, modLib, mod: os.path.basename(mod))
 def doMerges(coreLib, modLib, mod: str):
     """Do merge-based modding sequence"""
 
@@ -497,7 +557,9 @@ def doMerges(coreLib, modLib, mod: str):
         mergeAbortMessage(currentFile)
 
     # do that before merging animations and textures because references might have to be remapped!
-    coreLib["_all_modded_textures"].update(_detect_textures(coreLib, modLib, mod))
+    modded_textures = _detect_textures(coreLib, modLib, mod)
+    timing.count("texture_bytes", sum(os.path.getsize(texture["path"]) for texture in modded_textures.values() if os.path.isfile(texture["path"])))
+    coreLib["_all_modded_textures"].update(modded_textures)
 
     # this way the last mod loaded will overwrite previous textures
     # FIXME reimplement this test
@@ -521,14 +583,35 @@ def doMerges(coreLib, modLib, mod: str):
         mergeAbortMessage(currentFile)
 
 
+def _merge_index(baseLibrary, file, xpath, idAttribute):
+    """Return the id -> elements index of the section at `xpath`, built on first use
+
+    The index lives in the core library so every mod merged during the session reuses it.
+    """
+    indexes = baseLibrary.setdefault("_merge_indexes", {})
+    key = (file, xpath, idAttribute)
+    if key not in indexes:
+        try:
+            baseRoot = baseLibrary[file].xpath(xpath)[0]
+        except IndexError:
+            return None, None
+
+        index = {}
+        for child in baseRoot:
+            childID = child.get(idAttribute)
+            if childID is not None:
+                index.setdefault(childID, []).append(child)
+        indexes[key] = (baseRoot, index)
+    return indexes[key]
+
+
 def mergeDefinitions(baseLibrary, modLibrary, file, xpath, idAttribute):
     if file not in modLibrary:
         ui.log.log("    {}: Not present".format(file))
         return
 
-    try:
-        baseRoot = baseLibrary[file].xpath(xpath)[0]
-    except IndexError:
+    baseRoot, index = _merge_index(baseLibrary, file, xpath, idAttribute)
+    if baseRoot is None:
         # that's a big error if we can't find it in the core!
         ui.log.log("    {}: ERROR CORE NOTHING AT {}".format(file, xpath))
         return
@@ -543,20 +626,23 @@ def mergeDefinitions(baseLibrary, modLibrary, file, xpath, idAttribute):
         for element in list(modRoot):
 
             if isinstance(element, lxml.etree._Comment):
-                ui.log.log("Skipping comment in merge")
-                ui.log.log(lxml.etree.tostring(element, pretty_print=True).decode())
+                ui.log.debug("Skipping comment in merge")
+                ui.log.debug(lambda: lxml.etree.tostring(element, pretty_print=True).decode())
                 continue
 
             # TODO auto-id algo: if element.get(idAttribute + "_auto") then
             # id = prefix * idSpaceSize + id
-            conflicts = baseRoot.xpath("*[@{}='{}']".format(idAttribute, element.get(idAttribute)))
-
-            for conflict in conflicts:
+            elementID = element.get(idAttribute)
+            # elements without an id never conflict, nor can a later one replace them
+            for conflict in index.pop(elementID, []) if elementID is not None else []:
                 baseRoot.remove(conflict)
 
-            ui.log.log("Merging XML:")
-            ui.log.log(lxml.etree.tostring(element, pretty_print=True).decode())
-            baseRoot.append(copy.deepcopy(element))
+            ui.log.debug("Merging XML:")
+            ui.log.debug(lambda: lxml.etree.tostring(element, pretty_print=True).decode())
+            mergedElement = copy.deepcopy(element)
+            baseRoot.append(mergedElement)
+            if elementID is not None:
+                index[elementID] = [mergedElement]
             merged += 1
 
         if merged:
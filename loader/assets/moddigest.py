@@ -0,0 +1,107 @@
+"""Digests of the files of mod folders, shared by the QuickLaunch signature and the snapshot step keys"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import time
+
+import ui.log
+from ui.database import DISABLED_MARKER
+
+DIGEST_CACHE_FILENAME = "digest_cache.json"
+# bump when the cached digests change meaning
+DIGEST_CACHE_FORMAT = 1
+
+# files the loader itself writes into mod folders
+IGNORED_MOD_FILES = [DISABLED_MARKER, "custom_texture_*.png", "library/generated_textures.xml"]
+
+# a file changed twice within the same mtime tick would look unchanged, don't trust fresh mtimes
+RACY_MTIME_SECONDS = 2
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class DigestCache:
+    """File digests remembered by path, size and mtime so unchanged files are not read again
+
+    With `hashFiles` False nothing is read, files not in the cache set `missing` and get an empty digest.
+    """
+
+    def __init__(self, path=None, hashFiles=True):
+        self.path = path
+        self.hashFiles = hashFiles
+        self.missing = False
+        self.entries = {}
+        self.dirty = False
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("format") == DIGEST_CACHE_FORMAT:
+                    self.entries = data["files"]
+            except FileNotFoundError:
+                pass
+            except Exception as ex:
+                ui.log.log("Ignoring unreadable digest cache {}: {}".format(path, ex))
+
+    def digest(self, filePath):
+        filePath = os.path.abspath(filePath)
+        stat = os.stat(filePath)
+        entry = self.entries.get(filePath)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        if not self.hashFiles:
+            self.missing = True
+            return ""
+
+        digest = hashlib.sha1()
+        with open(filePath, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+
+        if time.time_ns() - stat.st_mtime_ns > RACY_MTIME_SECONDS * 1000000000:
+            self.entries[filePath] = [stat.st_size, stat.st_mtime_ns, digest]
+            self.dirty = True
+        return digest
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+
+        self.entries = {path: entry for path, entry in self.entries.items() if os.path.isfile(path)}
+        try:
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"format": DIGEST_CACHE_FORMAT, "files": self.entries}, f)
+            os.replace(self.path + ".tmp", self.path)
+            self.dirty = False
+        except Exception as ex:
+            ui.log.log("Failed to write digest cache {}: {}".format(self.path, ex))
+
+
+def _ignored(relative):
+    return any(fnmatch.fnmatch(relative, pattern) for pattern in IGNORED_MOD_FILES)
+
+
+def mod_files(modPath, directories=None):
+    """Sorted paths, relative to the mod, of the files in `directories` of the mod or the whole folder when None
+
+    The files the loader writes there are left out.
+    """
+    files = []
+    for directory in directories if directories is not None else [""]:
+        for root, dirs, filenames in os.walk(os.path.join(modPath, directory)):
+            for filename in filenames:
+                relative = os.path.relpath(os.path.join(root, filename), modPath).replace(os.sep, "/")
+                if not _ignored(relative):
+                    files.append(relative)
+    return sorted(files)
+
+
+def mod_tree_digest(modPath, cache: DigestCache, directories=None):
+    """Digest of the files of a mod returned by `mod_files`"""
+    digest = hashlib.sha1()
+    for relative in mod_files(modPath, directories):
+        digest.update("{} {}\n".format(relative, cache.digest(os.path.join(modPath, relative))).encode())
+    return digest.hexdigest()
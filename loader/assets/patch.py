@@ -1,9 +1,16 @@
 import copy
+import functools
+import os
+import time
 
 import lxml.etree
 import ui.log
 import re
 
+from loader import timing
+
+XPATH_CACHE_SIZE = 1024
+
 
 def AttributeSet(patchArgs):
     """Set the attribute on the node, adding if not present"""
@@ -241,17 +248,27 @@ def PatchDispatch(patchType):
     return patchDispatcher.get(patchType, BadOp)
 
 
-def doPatchType(coreLib, mod: dict, patch: lxml.etree._Element, location: str):
-    """Execute a single patch. Provided to reduce indentation level"""
+@functools.lru_cache(maxsize=XPATH_CACHE_SIZE)
+def compileXPath(xpath: str) -> lxml.etree.XPath:
+    """Compile an XPath expression once, mods tend to repeat the same ones"""
+    return lxml.etree.XPath(xpath)
 
-    patchType = patch.attrib["Class"]
-    xpath = patch.find("xpath").text
-    matchingElements = coreLib[location].xpath(xpath)
-    count = len(matchingElements)
-    value = patch.find("value")
-    attribute = patch.find("attribute")
 
-    # Log
+def logXPathCacheStats(since=None):
+    """Log how often compiled XPath expressions were reused since `since`, a `compileXPath.cache_info()` taken before the patch pass
+
+    The cache outlives a launch in the window, counting from `since` keeps the previous launches out of the numbers.
+    """
+    info = compileXPath.cache_info()
+    hits = info.hits - (since.hits if since else 0)
+    lookups = hits + info.misses - (since.misses if since else 0)
+    if not lookups:
+        return
+    ui.log.log(f"  XPath cache: {hits}/{lookups} hits ({100 * hits / lookups:.1f}%), {info.currsize} expressions cached")
+
+
+def describePatch(patch: lxml.etree._Element, patchType: str, xpath: str, count: int, attribute, value):
+    """Detailed dump of a patch operation for debug logging"""
     log = [""]
     log.append(lxml.etree.tostring(patch, pretty_print=True).decode())
     log.append(f"    {patchType.upper():15}")
@@ -268,6 +285,25 @@ def doPatchType(coreLib, mod: dict, patch: lxml.etree._Element, location: str):
         strValue = re.sub(r"\s+", " ", strValue)
         strValue = (strValue[:150] + "...") if len(strValue) > 150 else strValue
         log.append(f"      value:      {strValue}")
+    return log
+
+
+def doPatchType(coreLib, mod: dict, patch: lxml.etree._Element, location: str):
+    """Execute a single patch. Provided to reduce indentation level"""
+
+    started = time.perf_counter()
+    patchType = patch.attrib["Class"]
+    xpath = patch.find("xpath").text
+    matchingElements = compileXPath(xpath)(coreLib[location])
+    count = len(matchingElements)
+    timing.count("xpath_matches", count)
+    value = patch.find("value")
+    attribute = patch.find("attribute")
+
+    # Log, the detailed dump is only built when debug logging will write it
+    debug = ui.log.isDebugEnabled()
+    log = describePatch(patch, patchType, xpath, count, attribute, value) if debug else []
+    result = "ERROR"
 
     try:
         # Check patch type
@@ -276,7 +312,7 @@ def doPatchType(coreLib, mod: dict, patch: lxml.etree._Element, location: str):
 
         # Don't perform patch if no matches are found
         if count <= 0:
-            log.append("      result:      not performed: no xpath matches")
+            result = "not performed: no xpath matches"
             return
 
         patchEnable = patch.find("enable")
@@ -303,11 +339,11 @@ def doPatchType(coreLib, mod: dict, patch: lxml.etree._Element, location: str):
 
         # Skip if disabled
         if patchEnable is not None and patchEnable in [0, "0", "f", "n", "false", "no", "off"]:
-            log.append(f"      result:      skipped (enable = {patchEnable})")
+            result = f"skipped (enable = {patchEnable})"
             return
 
         if patchDisable is not None and patchDisable in [1, "1", "t", "y", "true", "yes", "on"]:
-            log.append(f"      result:      skipped (disable = {patchDisable})")
+            result = f"skipped (disable = {patchDisable})"
             return
 
         # Execute patch
@@ -318,17 +354,30 @@ def doPatchType(coreLib, mod: dict, patch: lxml.etree._Element, location: str):
         }
 
         PatchDispatch(patchType)(patchArgs)
-        log.append("      result:     OK")
-
-    except:
-        log.append("      result:     ERROR <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<")
-        raise
+        result = "OK"
 
     finally:
-        for line in log:
-            ui.log.log(line)
+        elapsed = (time.perf_counter() - started) * 1000
+        if debug:
+            log.append(f"      result:     {result}" + (" <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<" if result == "ERROR" else ""))
+            for line in log:
+                ui.log.debug(line)
+        ui.log.log(f"      {mod.name}: {location} {patchType} matches={count} {result} ({elapsed:.1f} ms)")
+
+
+def _patch_file_name(patchList, mod, location):
+    """The patch file relative to its mod, for the timing report"""
+    url = patchList.docinfo.URL
+    if not url:
+        return location
+    try:
+        return os.path.relpath(url, mod.path).replace(os.sep, "/")
+    except ValueError:
+        # on another drive
+        return url
 
 
+@timing.timed("doPatches", mod=lambda coreLib, modLib, mod: os.path.basename(mod.path))
 def doPatches(coreLib, modLib, mod: dict):
 
     # Execution
@@ -349,21 +398,22 @@ def doPatches(coreLib, modLib, mod: dict):
             ui.log.log(f"    Executing Patch Operations: mod='{mod.name}', file='{location}'...")
 
             # Run patch operations
-            for patchOperation in patchList.getroot():
-                patchOperation: lxml.etree._Element
-
-                # Skip XML comments
-                if isinstance(patchOperation, lxml.etree._Comment):
-                    ui.log.log("Skipping comment in patching")
-                    ui.log.log(lxml.etree.tostring(patchOperation, pretty_print=True).decode())
-                    continue
-
-                try:
-                    doPatchType(coreLib, mod, patchOperation, location)
-
-                except Exception as e:
-                    uri = patchOperation.base
-                    line = patchOperation.sourceline
-                    ui.log.log(f"      Failed to apply patch operation {uri}:{line}")
-                    ui.log.log(f"      Reason: {repr(e)}")
-                    raise SyntaxError("Patch operation failed, see logs.txt for more details.") from None
+            with timing.span(timing.PATCH_FILE_STAGE, detail=_patch_file_name(patchList, mod, location)):
+                for patchOperation in patchList.getroot():
+                    patchOperation: lxml.etree._Element
+
+                    # Skip XML comments
+                    if isinstance(patchOperation, lxml.etree._Comment):
+                        ui.log.debug("Skipping comment in patching")
+                        ui.log.debug(lambda: lxml.etree.tostring(patchOperation, pretty_print=True).decode())
+                        continue
+
+                    try:
+                        doPatchType(coreLib, mod, patchOperation, location)
+
+                    except Exception as e:
+                        uri = patchOperation.base
+                        line = patchOperation.sourceline
+                        ui.log.log(f"      Failed to apply patch operation {uri}:{line}")
+                        ui.log.log(f"      Reason: {repr(e)}")
+                        raise SyntaxError("Patch operation failed, see logs.txt for more details.") from None
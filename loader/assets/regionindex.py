@@ -0,0 +1,83 @@
+"""Digests of the vanilla texture regions, so a sprite a mod ships unchanged leaves its page alone
+
+A region is hashed the first time a mod overrides it and the digest is kept next to the core library cache, so each
+vanilla page is decoded at most once per game version for this.
+"""
+
+import hashlib
+import json
+import os
+
+import ui.log
+
+from . import codec
+from .explode import Texture
+
+REGION_INDEX_FILENAME = "region_hashes.json"
+# bump when the digests change meaning
+REGION_INDEX_FORMAT = 1
+
+
+def digest(rows):
+    """Digest of RGBA pixels as returned by `codec.read_rgba` or `Texture.region`"""
+    if hasattr(rows, "tobytes"):
+        return hashlib.sha1(rows.tobytes()).hexdigest()
+    rowsDigest = hashlib.sha1()
+    for row in rows:
+        rowsDigest.update(row)
+    return rowsDigest.hexdigest()
+
+
+class RegionIndex:
+    """Vanilla region digests by page and rectangle, read from and saved to `indexPath` when given"""
+
+    def __init__(self, library, indexPath=None):
+        self.library = library
+        self.indexPath = indexPath
+        self.digests = {}
+        self.pages = {}
+        self.changed = False
+
+        if indexPath and os.path.isfile(indexPath):
+            try:
+                with open(indexPath, "r", encoding="utf-8") as f:
+                    index = json.load(f)
+                if index.get("format") == REGION_INDEX_FORMAT:
+                    self.digests = index["pages"]
+            except Exception as ex:
+                ui.log.log("  Ignoring unreadable region index {}: {}".format(indexPath, ex))
+
+    def vanilla_digest(self, page, x, y, w, h):
+        """Digest of the vanilla pixels in the rectangle, None if it is not on the page"""
+        rect = "{} {} {} {}".format(x, y, w, h)
+        pageDigests = self.digests.setdefault(page, {})
+        if rect not in pageDigests:
+            texture = self.pages.get(page)
+            if texture is None:
+                with self.library.open("library/{}.cim".format(page)) as f:
+                    texture = self.pages[page] = Texture.from_file(f, "{}.cim".format(page))
+            inside = x + w <= texture.width and y + h <= texture.height
+            pageDigests[rect] = digest(texture.region(x, y, w, h)) if inside else None
+            self.changed = True
+        return pageDigests[rect]
+
+    def unchanged(self, page, pngFile, x, y, w, h):
+        """Whether `pngFile` holds exactly the vanilla pixels of the region it replaces"""
+        width, height, rows = codec.decode_cache.read_rgba(pngFile)
+        if (width, height) != (w, h):
+            return False
+        vanilla = self.vanilla_digest(page, x, y, w, h)
+        return vanilla is not None and digest(rows) == vanilla
+
+    def save(self):
+        """Write the digests taken this launch, if the core library cache they belong to exists"""
+        self.pages = {}
+        if not self.changed or not self.indexPath or not os.path.isdir(os.path.dirname(self.indexPath)):
+            return
+        try:
+            with open(self.indexPath + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"format": REGION_INDEX_FORMAT, "pages": self.digests}, f)
+            os.replace(self.indexPath + ".tmp", self.indexPath)
+            self.changed = False
+        except OSError as ex:
+            ui.log.log("  Failed to write region index {}: {}".format(self.indexPath, ex))
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import zlib
+
+import lxml.etree
+import ui.log
+import version
+
+from . import corecache
+from .library import PATCHABLE_XML_FILES, JarLibrary
+from .moddigest import DigestCache, mod_tree_digest
+
+SNAPSHOT_DIRNAME = "snapshots"
+SNAPSHOT_BLOBS = "blobs"
+# bump when the snapshot index or the merge state change shape
+SNAPSHOT_FORMAT = 2
+# snapshots are written on every cold launch, favour speed over size
+SNAPSHOT_COMPRESSION = 1
+
+# the parts of a mod folder that its merge and its patches read, config values are part of the patch step instead
+# of the info.xml they are saved to
+MERGE_DIRECTORIES = ["library", "textures"]
+PATCH_DIRECTORIES = ["patches"]
+
+MERGE_STEP = "merge"
+PATCH_STEP = "patch"
+
+
+def mod_digest(modPath, directories, cache: DigestCache):
+    """Digest of the files in `directories` of a mod, `MERGE_DIRECTORIES` or `PATCH_DIRECTORIES`"""
+    return mod_tree_digest(modPath, cache, directories)
+
+
+def base_key(library: JarLibrary):
+    """Key every step chains from: the vanilla library and the loader doing the merging"""
+    coreKey = corecache.cache_key(library)
+    if coreKey is None:
+        return None
+    return hashlib.sha1("format {}\nloader {}\ncore {}\n".format(SNAPSHOT_FORMAT, version.version, coreKey).encode()).hexdigest()
+
+
+def step_keys(baseKey, steps):
+    """Chain a key through `steps`, a list of (kind, modPath, modDigest, variables) tuples
+
+    The key of a step covers every step before it, so the first changed mod changes every key after it. The merge state
+    keeps absolute texture paths, so a mod moved to another folder changes its keys too.
+    """
+    keys = []
+    key = baseKey
+    for kind, modPath, modDigest, variables in steps:
+        digest = hashlib.sha1("{}\n{} {} {}\n".format(key, kind, os.path.realpath(modPath), modDigest).encode())
+        for name, value in variables:
+            digest.update("{}={}\n".format(name, value).encode())
+        key = digest.hexdigest()
+        keys.append(key)
+    return keys
+
+
+def _merge_state(coreLibrary):
+    return {
+        "next_region_id": coreLibrary["_next_region_id"],
+        "all_modded_textures": coreLibrary["_all_modded_textures"],
+        "custom_textures_cim": {page: dict(attrib) for page, attrib in coreLibrary["_custom_textures_cim"].items()},
+    }
+
+
+class SnapshotStore:
+    """Merged library snapshots in `snapshotDir`, one per step of the load order
+
+    XML files are stored once per content in a blob folder, a step only writes the files it touched.
+    """
+
+    def __init__(self, snapshotDir):
+        self.snapshotDir = snapshotDir
+        self.blobDir = os.path.join(snapshotDir, SNAPSHOT_BLOBS)
+        self.blobs = {}
+        self.enabled = True
+
+    def _index_path(self, key):
+        return os.path.join(self.snapshotDir, key + ".json")
+
+    def restore(self, keys):
+        """Find the longest snapshotted prefix of `keys`
+
+        Returns the number of steps it covers, with the core library trees and core facts of that point.
+        """
+        for count in range(len(keys), 0, -1):
+            indexPath = self._index_path(keys[count - 1])
+            if not os.path.isfile(indexPath):
+                continue
+
+            try:
+                with open(indexPath, "r", encoding="utf-8") as indexFile:
+                    index = json.load(indexFile)
+                if index.get("format") != SNAPSHOT_FORMAT:
+                    continue
+
+                parser = lxml.etree.XMLParser(huge_tree=True)
+                coreLibrary = {}
+                for filename in PATCHABLE_XML_FILES:
+                    with open(os.path.join(self.blobDir, index["blobs"][filename]), "rb") as blob:
+                        coreLibrary[filename] = lxml.etree.ElementTree(lxml.etree.fromstring(zlib.decompress(blob.read()), parser=parser))
+            except Exception as ex:
+                ui.log.log("  Ignoring unreadable snapshot {}: {}".format(indexPath, ex))
+                continue
+
+            state = index["state"]
+            coreLibrary["_next_region_id"] = state["next_region_id"]
+            coreLibrary["_all_modded_textures"] = state["all_modded_textures"]
+            coreLibrary["_custom_textures_cim"] = state["custom_textures_cim"]
+            self.blobs = dict(index["blobs"])
+            return count, coreLibrary, index["facts"]
+
+        return 0, None, None
+
+    def _write_blob(self, tree):
+        data = lxml.etree.tostring(tree, encoding="UTF-8")
+        blobId = hashlib.sha1(data).hexdigest()
+        blobPath = os.path.join(self.blobDir, blobId)
+        if not os.path.exists(blobPath):
+            with open(blobPath + ".tmp", "wb") as blob:
+                blob.write(zlib.compress(data, SNAPSHOT_COMPRESSION))
+            os.replace(blobPath + ".tmp", blobPath)
+        return blobId
+
+    def save(self, key, coreLibrary, facts, touched):
+        """Snapshot the state after the step `key`, `touched` lists the library files the step may have changed"""
+        if not self.enabled:
+            return
+
+        try:
+            os.makedirs(self.blobDir, exist_ok=True)
+            for filename in PATCHABLE_XML_FILES:
+                if filename in touched or filename not in self.blobs:
+                    self.blobs[filename] = self._write_blob(coreLibrary[filename])
+
+            indexPath = self._index_path(key)
+            with open(indexPath + ".tmp", "w", encoding="utf-8") as indexFile:
+                json.dump({"format": SNAPSHOT_FORMAT, "blobs": self.blobs, "state": _merge_state(coreLibrary), "facts": facts}, indexFile)
+            os.replace(indexPath + ".tmp", indexPath)
+        except Exception as ex:
+            ui.log.log("  Failed to write snapshot {}, not snapshotting the remaining mods: {}".format(key, ex))
+            self.enabled = False
+
+    def prune(self, keys):
+        """Drop the snapshots of other load orders and the blobs only they used"""
+        if not os.path.isdir(self.snapshotDir):
+            return
+
+        keep = set(key + ".json" for key in keys)
+        usedBlobs = set()
+        for entry in os.listdir(self.snapshotDir):
+            entryPath = os.path.join(self.snapshotDir, entry)
+            if not os.path.isfile(entryPath):
+                continue
+            if entry not in keep:
+                os.remove(entryPath)
+                continue
+            try:
+                with open(entryPath, "r", encoding="utf-8") as indexFile:
+                    usedBlobs.update(json.load(indexFile)["blobs"].values())
+            except Exception:
+                os.remove(entryPath)
+
+        if os.path.isdir(self.blobDir):
+            for entry in os.listdir(self.blobDir):
+                if entry not in usedBlobs:
+                    os.remove(os.path.join(self.blobDir, entry))
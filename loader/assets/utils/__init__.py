@@ -5,3 +5,14 @@ from lxml import etree
 
 def create_xml_parser() -> etree.XMLParser:
     return etree.XMLParser(recover=True, encoding=os.environ.get('FORCE_PARSER_ENCODING', None), remove_comments=True)
+
+
+def texture_workers() -> int:
+    """Number of texture pages processed at once, can be forced with the TEXTURE_WORKERS environment variable."""
+    try:
+        workers = int(os.environ.get('TEXTURE_WORKERS', 0))
+    except ValueError:
+        workers = 0
+    if workers <= 0:
+        workers = min(8, os.cpu_count() or 1)
+    return workers
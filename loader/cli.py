@@ -0,0 +1,224 @@
+"""Command line entry point running the mod loader pipeline without the Tk window, see `python -m loader --help`"""
+
+import argparse
+import os
+import sys
+import time
+import traceback
+
+import ui.database
+import ui.log
+from ui.gameinfo import GameInfo
+
+import loader.assets.explode
+import loader.extract
+import loader.load
+import loader.signature
+import loader.timing
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_CACHE_MISS = 3
+
+
+def _info_file(path):
+    for name in ("info", "info.xml"):
+        if os.path.isfile(os.path.join(path, name)):
+            return os.path.join(path, name)
+    return None
+
+
+def _mod_folders(paths):
+    """Mod folders in the order given, a folder without an info file stands for the mods inside it"""
+    folders = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            raise FileNotFoundError("Mod folder not found: {}".format(path))
+        if _info_file(path):
+            folders.append(path)
+            continue
+        folders.extend(os.path.join(path, child) for child in sorted(os.listdir(path)) if _info_file(os.path.join(path, child)))
+    return folders
+
+
+def load_mods(jarPath, paths, gameInfo=None):
+    """Build the mods in `paths` and register them like the window's mod database does"""
+    gameInfo = gameInfo or GameInfo(jarPath)
+    folders = _mod_folders(paths)
+    database = ui.database.ModDatabase(sorted(set(os.path.dirname(folder) for folder in folders)), gameInfo)
+    database.mods = [ui.database.Mod(_info_file(folder), gameInfo) for folder in folders]
+    return database.mods
+
+
+def _game_mods_path(jarPath):
+    return os.path.dirname(loader.load.modloader_data_dir(jarPath))
+
+
+def cmd_build(args):
+    gameInfo = GameInfo(args.jar)
+    mods = load_mods(args.jar, args.mods, gameInfo)
+    started = time.perf_counter()
+    loader.load.build(args.jar, mods, args.output, args.mode, use_caches=not args.no_cache, cim_level=args.cim_level, game_version=gameInfo.version)
+    print("Built {} with {} mod(s) in {:.2f}s".format(args.output, len(mods), time.perf_counter() - started))
+    return EXIT_OK
+
+
+def cmd_extract(args):
+    loader.extract.extract(args.jar, args.output)
+    print("Extracted {} to {}".format(args.jar, args.output))
+    return EXIT_OK
+
+
+def cmd_annotate(args):
+    # imported here, annotation is only needed by this command
+    from loader.assets.annotate import annotate
+
+    annotate(args.core)
+    print("Annotated {}".format(os.path.join(args.core, "library")))
+    return EXIT_OK
+
+
+def cmd_quickload(args):
+    mods = load_mods(args.jar, args.mods)
+    signature = loader.signature.signature(args.jar, mods, loader.load.modloader_data_dir(args.jar))
+    if not os.path.isfile(loader.load.quick_launch_filename(signature, args.jar, args.mode)):
+        print("No QuickLaunch file for signature {}".format(signature))
+        return EXIT_CACHE_MISS
+
+    loader.load.quickload(args.jar, signature, args.mode)
+    print("Quickloaded {}".format(signature))
+    return EXIT_OK
+
+
+def cmd_unload(args):
+    loader.load.unload(args.jar)
+    return EXIT_OK
+
+
+def cmd_report(args):
+    report = loader.timing.read_report(loader.load.modloader_data_dir(args.jar))
+    if report is None:
+        print("No timing report yet, build or launch with mods first")
+        return EXIT_ERROR
+
+    print("{} started {}".format(report["name"], report["started"]))
+    for line in loader.timing.format_mod_costs(report.get("mod_costs", []), patch_files=args.files):
+        print(line)
+    return EXIT_OK
+
+
+def cmd_cache_stats(args):
+    stats = loader.load.quick_launch_stats(args.jar)
+    lookups = stats["hits"] + stats["misses"]
+    print("files:    {}".format(stats["files"]))
+    print("size:     {:.1f} MB of {:.1f} MB".format(stats["bytes"] / 1024**2, stats["budget"] / 1024**2))
+    print("hits:     {}".format(stats["hits"]))
+    print("misses:   {}".format(stats["misses"]))
+    print("hit rate: {}".format("{:.0%}".format(stats["hits"] / lookups) if lookups else "n/a"))
+    for basename in stats["pinned"]:
+        print("pinned:   {}".format(basename))
+    return EXIT_OK
+
+
+def cmd_cache_pin(args):
+    loader.load.pin_quick_launch(args.jar, args.signature, args.mode, pinned=args.command_name == "pin")
+    return EXIT_OK
+
+
+def cmd_cache_budget(args):
+    loader.load.set_quick_launch_budget(args.jar, int(args.megabytes * 1024**2) if args.megabytes else None)
+    loader.load.prune_quick_launch_cache(args.jar)
+    return EXIT_OK
+
+
+def cmd_cache_clear(args):
+    print("Removed {} QuickLaunch file(s)".format(loader.load.clear_quick_launch_cache(args.jar)))
+    return EXIT_OK
+
+
+def _parser():
+    parser = argparse.ArgumentParser(prog="python -m loader", description="Space Haven mod loader, without the window.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the log to stdout too, it always goes to mods/modloader/logs.txt")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def _command(parent, name, handler, help):
+        command = parent.add_parser(name, help=help, description=help)
+        command.set_defaults(handler=handler, command_name=name)
+        return command
+
+    def _mode(command):
+        command.add_argument("--mode", choices=loader.load.LOAD_MODES, default=loader.load.LOAD_MODE_REWRITE, help="full jar or overlay jar (default: %(default)s)")
+
+    command = _command(commands, "build", cmd_build, "merge mods into a copy of spacehaven.jar")
+    command.add_argument("jar", help="path to spacehaven.jar")
+    command.add_argument("mods", nargs="+", help="mod folders in load order, or folders of mods loaded by name")
+    command.add_argument("-o", "--output", required=True, help="path of the jar to write")
+    command.add_argument("--no-cache", action="store_true", help="ignore the core library cache and mod snapshots")
+    command.add_argument("--cim-level", type=int, choices=range(0, 10), metavar="0-9", help="zlib level of repacked texture pages, 1 builds fastest (default: {})".format(loader.assets.explode.CIM_COMPRESSION_LEVEL))
+    _mode(command)
+
+    command = _command(commands, "extract", cmd_extract, "extract the game library and unpack its textures")
+    command.add_argument("jar", help="path to spacehaven.jar")
+    command.add_argument("output", help="folder to extract to")
+
+    command = _command(commands, "annotate", cmd_annotate, "annotate an extracted library, run from the mod loader folder")
+    command.add_argument("core", help="folder the library was extracted to")
+
+    command = _command(commands, "quickload", cmd_quickload, "install the cached jar of these mods into the game, exits with 3 if there is none")
+    command.add_argument("jar", help="path to spacehaven.jar")
+    command.add_argument("mods", nargs="+", help="mod folders in load order, or folders of mods loaded by name")
+    _mode(command)
+
+    command = _command(commands, "unload", cmd_unload, "restore the vanilla game jar")
+    command.add_argument("jar", help="path to spacehaven.jar")
+
+    command = _command(commands, "report", cmd_report, "rank the mods of the last build by the time they took")
+    command.add_argument("jar", help="path to spacehaven.jar")
+    command.add_argument("--files", action="store_true", help="also list the time and XPath matches of each patch file")
+
+    cache = commands.add_parser("cache", help="manage the QuickLaunch cache").add_subparsers(dest="cache_command", required=True)
+
+    command = _command(cache, "stats", cmd_cache_stats, "show QuickLaunch cache usage")
+    command.add_argument("jar", help="path to spacehaven.jar")
+
+    for name, help in (("pin", "never evict the QuickLaunch file of a signature"), ("unpin", "let the QuickLaunch file of a signature be evicted again")):
+        command = _command(cache, name, cmd_cache_pin, help)
+        command.add_argument("jar", help="path to spacehaven.jar")
+        command.add_argument("signature", help="signature of the QuickLaunch file")
+        _mode(command)
+
+    command = _command(cache, "budget", cmd_cache_budget, "set the QuickLaunch cache size budget and prune to it")
+    command.add_argument("jar", help="path to spacehaven.jar")
+    command.add_argument("megabytes", type=float, nargs="?", help="budget in MB, omit to restore the default")
+
+    command = _command(cache, "clear", cmd_cache_clear, "remove every QuickLaunch file")
+    command.add_argument("jar", help="path to spacehaven.jar")
+
+    return parser
+
+
+def main(argv=None):
+    # stdout is for command output, also while argparse reports usage errors
+    ui.log.logger.echo = False
+    args = _parser().parse_args(argv)
+    ui.log.logger.echo = args.verbose
+
+    jarPath = getattr(args, "jar", None)
+    if jarPath:
+        if not os.path.isfile(jarPath):
+            print("Game jar not found: {}".format(jarPath), file=sys.stderr)
+            return EXIT_USAGE
+        args.jar = os.path.abspath(jarPath)
+        ui.log.setGameModPath(_game_mods_path(args.jar))
+
+    try:
+        return args.handler(args)
+    except Exception as ex:
+        ui.log.log("!! Exception !!")
+        ui.log.log(traceback.format_exc())
+        print("Error: {}".format(ex), file=sys.stderr)
+        return EXIT_ERROR
+    finally:
+        ui.log.flush()
@@ -1,19 +1,49 @@
 import os
 import glob
+import json
+import shutil
 import sys
 import tempfile
+import time
 
+import ui.database
 import ui.log
 
+import loader.assets.atlas
+import loader.assets.corecache
+import loader.assets.explode
+import loader.assets.moddigest
+import loader.assets.snapshot
 import loader.assets.library
 import loader.assets.merge
+import loader.timing
 
 
 MODLOADER_DATA_DIR = "modloader"
 QUICK_LAUNCH_PREFIX = "quicklaunch_"
 QUICK_LAUNCH_SUFFIX = ".jar"
+QUICK_LAUNCH_OVERLAY_SUFFIX = ".overlay.jar"
 PREVIOUS_GAME_PATH_FILENAME = "previous_spacehaven_path.txt"
 EXTRA_MODS_PATH_FILENAME = "extra_mods_path.txt"
+LOAD_MODE_FILENAME = "load_mode.txt"
+QUICK_LAUNCH_STATE_FILENAME = "quicklaunch_cache.json"
+QUICK_LAUNCH_STATE_FORMAT = 1
+# total size of the QuickLaunch files kept around, unless changed with set_quick_launch_budget()
+QUICK_LAUNCH_DEFAULT_BUDGET = 4 * 1024 * 1024 * 1024
+# launches are built for QuickLaunch, where build time matters more than a somewhat bigger jar
+LAUNCH_CIM_LEVEL = loader.assets.explode.CIM_FAST_COMPRESSION_LEVEL
+
+# rewrite: spacehaven.jar is replaced by a fully patched copy
+# overlay: a jar holding only the modded library files is put ahead of spacehaven.jar on the classPath
+LOAD_MODE_REWRITE = "rewrite"
+LOAD_MODE_OVERLAY = "overlay"
+LOAD_MODES = [LOAD_MODE_REWRITE, LOAD_MODE_OVERLAY]
+
+# Lives next to spacehaven.jar so its classPath entry stays relative like the game's own
+OVERLAY_JAR_FILENAME = "spacehaven-modloader-overlay.jar"
+
+# ioctl cloning a whole file on copy-on-write filesystems (btrfs, XFS, ...), from linux/fs.h
+FICLONE = 0x40049409
 
 
 def modloader_data_dir(jarPath):
@@ -27,12 +57,75 @@ def modloader_state_file(jarPath, filename):
     return os.path.join(modloader_data_dir(jarPath), filename)
 
 
-def quick_launch_basename(mods_cache_signature):
-    return QUICK_LAUNCH_PREFIX + mods_cache_signature + QUICK_LAUNCH_SUFFIX
+def overlay_jar_path(jarPath):
+    return os.path.join(os.path.dirname(os.path.abspath(jarPath)), OVERLAY_JAR_FILENAME)
+
+
+def game_config_path(jarPath):
+    return os.path.join(os.path.dirname(os.path.abspath(jarPath)), "config.json")
+
+
+def _reflink(src, dst):
+    """Clone `src` to `dst` sharing its blocks, returns False where the platform or filesystem can't"""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    try:
+        with open(src, "rb") as srcFile, open(dst, "wb") as dstFile:
+            fcntl.ioctl(dstFile.fileno(), FICLONE, srcFile.fileno())
+        return True
+    except OSError:
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        return False
+
+
+def _swap(newPath, dst, backup=None):
+    """Rename `newPath` over `dst` in one step, keeping the replaced file as `backup`"""
+    if backup:
+        # a link keeps `dst` in place until the rename, moving it away would leave a moment without it
+        try:
+            os.link(dst, backup)
+        except OSError:
+            os.rename(dst, backup)
+    os.replace(newPath, dst)
+
+
+def place_file(src, dst, backup=None):
+    """Make `dst` a copy of `src` and return how it was made
+
+    Tries a hardlink, then a reflink, then a byte copy. The result is renamed over `dst` so it is replaced atomically.
+    Jars are never written in place, so sharing their data between the game folder and the QuickLaunch cache is safe.
+    """
+    tmpPath = dst + ".tmp"
+    if os.path.exists(tmpPath):
+        os.remove(tmpPath)
+
+    try:
+        os.link(src, tmpPath)
+        method = "hardlink"
+    except OSError:
+        if _reflink(src, tmpPath):
+            method = "reflink"
+        else:
+            shutil.copyfile(src, tmpPath)
+            method = "copy"
+
+    _swap(tmpPath, dst, backup)
+    return method
 
 
-def quick_launch_filename(mods_cache_signature, jarPath=None):
-    filename = quick_launch_basename(mods_cache_signature)
+def quick_launch_basename(mods_cache_signature, load_mode=LOAD_MODE_REWRITE):
+    suffix = QUICK_LAUNCH_OVERLAY_SUFFIX if load_mode == LOAD_MODE_OVERLAY else QUICK_LAUNCH_SUFFIX
+    return QUICK_LAUNCH_PREFIX + mods_cache_signature + suffix
+
+
+def quick_launch_filename(mods_cache_signature, jarPath=None, load_mode=LOAD_MODE_REWRITE):
+    filename = quick_launch_basename(mods_cache_signature, load_mode)
     if jarPath:
         return os.path.join(modloader_data_dir(jarPath), filename)
     return filename
@@ -74,72 +167,234 @@ def clear_quick_launch_cache(jarPath):
     return removed
 
 
-def prune_quick_launch_cache(jarPath, keep_signature=None, max_files=10):
+def _read_quick_launch_state(jarPath):
+    """Usage of the QuickLaunch files: last use per file, pinned files, hit/miss counters and the size budget"""
+    state = {"format": QUICK_LAUNCH_STATE_FORMAT, "files": {}, "pinned": [], "hits": 0, "misses": 0, "budget": None}
+    path = modloader_state_file(jarPath, QUICK_LAUNCH_STATE_FILENAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        if stored.get("format") == QUICK_LAUNCH_STATE_FORMAT:
+            state.update(stored)
+    except FileNotFoundError:
+        pass
+    except Exception as ex:
+        ui.log.log("Ignoring unreadable QuickLaunch cache state {}: {}".format(path, ex))
+    return state
+
+
+def _write_quick_launch_state(jarPath, state):
+    path = modloader_state_file(jarPath, QUICK_LAUNCH_STATE_FILENAME)
+    try:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(path + ".tmp", path)
+    except Exception as ex:
+        ui.log.log("Failed to write QuickLaunch cache state {}: {}".format(path, ex))
+
+
+def record_quick_launch_use(jarPath, mods_cache_signature, load_mode=LOAD_MODE_REWRITE, hit=True):
+    """Count a QuickLaunch hit or miss and mark the file for `mods_cache_signature` as just used"""
+    state = _read_quick_launch_state(jarPath)
+    state["hits" if hit else "misses"] += 1
+    state["files"][quick_launch_basename(mods_cache_signature, load_mode)] = {"last_used": time.time()}
+    _write_quick_launch_state(jarPath, state)
+
+
+def pin_quick_launch(jarPath, mods_cache_signature, load_mode=LOAD_MODE_REWRITE, pinned=True):
+    """Keep the QuickLaunch file for `mods_cache_signature` out of pruning, or release it again"""
+    state = _read_quick_launch_state(jarPath)
+    basename = quick_launch_basename(mods_cache_signature, load_mode)
+    if pinned and basename not in state["pinned"]:
+        state["pinned"].append(basename)
+    elif not pinned and basename in state["pinned"]:
+        state["pinned"].remove(basename)
+    _write_quick_launch_state(jarPath, state)
+
+
+def set_quick_launch_budget(jarPath, budget):
+    """Set the QuickLaunch cache size budget in bytes, None restores the default"""
+    state = _read_quick_launch_state(jarPath)
+    state["budget"] = budget
+    _write_quick_launch_state(jarPath, state)
+
+
+def quick_launch_budget(jarPath):
+    return _read_quick_launch_state(jarPath)["budget"] or QUICK_LAUNCH_DEFAULT_BUDGET
+
+
+def quick_launch_stats(jarPath):
+    state = _read_quick_launch_state(jarPath)
     files = quick_launch_files(jarPath)
-    if len(files) <= max_files:
-        return 0
+    return {
+        "files": len(files),
+        "bytes": sum(os.path.getsize(path) for path in files),
+        "budget": state["budget"] or QUICK_LAUNCH_DEFAULT_BUDGET,
+        "hits": state["hits"],
+        "misses": state["misses"],
+        "pinned": [basename for basename in state["pinned"] if os.path.isfile(os.path.join(modloader_data_dir(jarPath), basename))],
+    }
+
 
-    keepFile = quick_launch_filename(keep_signature, jarPath) if keep_signature else None
-    deleteCandidates = [path for path in files if os.path.abspath(path) != os.path.abspath(keepFile or "")]
-    deleteCandidates.sort(key=lambda path: os.path.getmtime(path))
-    deleteCount = max(0, len(files) - max_files)
+def prune_quick_launch_cache(jarPath, keep_signature=None, max_files=None, load_mode=LOAD_MODE_REWRITE, budget=None):
+    """Evict least recently used QuickLaunch files until they fit the size budget (and `max_files`, if given)
+
+    Pinned files and the file of `keep_signature` are never evicted.
+    """
+    state = _read_quick_launch_state(jarPath)
+    if budget is None:
+        budget = state["budget"] or QUICK_LAUNCH_DEFAULT_BUDGET
+
+    files = quick_launch_files(jarPath)
+    sizes = {path: os.path.getsize(path) for path in files}
+    totalSize = sum(sizes.values())
+    fileCount = len(files)
+
+    def _last_used(path):
+        entry = state["files"].get(os.path.basename(path))
+        return entry["last_used"] if entry else os.path.getmtime(path)
+
+    keepFile = quick_launch_filename(keep_signature, jarPath, load_mode) if keep_signature else None
+    deleteCandidates = [
+        path for path in files if os.path.abspath(path) != os.path.abspath(keepFile or "") and os.path.basename(path) not in state["pinned"]
+    ]
+    deleteCandidates.sort(key=_last_used)
 
     removed = 0
-    for path in deleteCandidates[:deleteCount]:
+    for path in deleteCandidates:
+        if totalSize <= budget and (max_files is None or fileCount <= max_files):
+            break
         try:
             os.unlink(path)
             removed += 1
-            ui.log.log("Pruned old QuickLaunch cache file: {}".format(path))
+            totalSize -= sizes[path]
+            fileCount -= 1
+            ui.log.log("Pruned least recently used QuickLaunch cache file: {}".format(path))
         except FileNotFoundError:
             pass
         except Exception as ex:
             ui.log.log("Failed to prune QuickLaunch cache file {}: {}".format(path, ex))
+
+    # forget the usage of files that are gone
+    existing = set(os.path.basename(path) for path in files if os.path.exists(path))
+    state["files"] = {basename: entry for basename, entry in state["files"].items() if basename in existing}
+    _write_quick_launch_state(jarPath, state)
     return removed
 
 
-def load(jarPath, activeMods, mods_cache_signature=None):
-    """Load mods into spacehaven.jar"""
+def build(jarPath, activeMods, resultPath, load_mode=LOAD_MODE_REWRITE, use_caches=True, cim_level=None, game_version=None):
+    """Merge `activeMods` into the library of `jarPath` and write the modded jar to `resultPath`
 
+    In overlay mode the result only holds the modded library files. `jarPath` itself is never modified.
+    With `use_caches`, the core library cache and mod snapshots in the modloader data folder are used.
+    `cim_level` is the zlib level of repacked texture pages, see `explode.CIM_COMPRESSION_LEVEL`.
+    `game_version` is the version read by `GameInfo`, it names the core library cache.
+    """
     modPaths = [mod.path for mod in activeMods]
 
-    unload(jarPath, message=False)
-
     coreDirectory = tempfile.TemporaryDirectory()
     corePath = coreDirectory.name
 
     ui.log.log("Loading mods...")
     ui.log.log("  jarPath: {}".format(jarPath))
     ui.log.log("  corePath: {}".format(corePath))
+    ui.log.log("  loadMode: {}".format(load_mode))
     ui.log.log("  modPaths:\n  {}".format("\n  ".join(modPaths)))
 
-    loader.assets.library.extract(jarPath, corePath)
     ui.log.updateBackgroundState("Installing Mods")
-    extra_assets = loader.assets.merge.mods(corePath, activeMods, modPaths)
-
-    os.rename(jarPath, jarPath + ".vanilla")
-    loader.assets.library.patch(jarPath + ".vanilla", corePath, jarPath, extra_assets=extra_assets)
+    coreCacheDir = snapshotDir = atlasDir = textureDebugDir = digestCachePath = None
+    if use_caches:
+        digestCachePath = os.path.join(modloader_data_dir(jarPath), loader.assets.moddigest.DIGEST_CACHE_FILENAME)
+        coreCacheDir = os.path.join(modloader_data_dir(jarPath), loader.assets.corecache.CORE_CACHE_DIRNAME)
+        snapshotDir = os.path.join(modloader_data_dir(jarPath), loader.assets.snapshot.SNAPSHOT_DIRNAME)
+        atlasDir = os.path.join(modloader_data_dir(jarPath), loader.assets.atlas.ATLAS_DIRNAME)
+    if loader.assets.atlas.debug_enabled():
+        textureDebugDir = os.path.join(modloader_data_dir(jarPath), loader.assets.atlas.TEXTURE_DEBUG_DIRNAME)
+    with loader.timing.session("build", modloader_data_dir(jarPath)):
+        # vanilla files are streamed from the jar, only modified ones end up in corePath
+        with loader.assets.library.JarLibrary(jarPath, corePath) as library:
+            extra_assets = loader.assets.merge.mods(
+                corePath,
+                activeMods,
+                modPaths,
+                library,
+                core_cache_dir=coreCacheDir,
+                snapshot_dir=snapshotDir,
+                atlas_dir=atlasDir,
+                texture_debug_dir=textureDebugDir,
+                cim_level=cim_level,
+                digest_cache_path=digestCachePath,
+                game_version=game_version,
+            )
+
+        if load_mode == LOAD_MODE_OVERLAY:
+            loader.assets.library.overlay(jarPath, corePath, resultPath, extra_assets=extra_assets)
+        else:
+            loader.assets.library.patch(jarPath, corePath, resultPath, extra_assets=extra_assets)
 
     coreDirectory.cleanup()
 
-    if mods_cache_signature:
-        import shutil
-
-        quicklaunchfilename = quick_launch_filename(mods_cache_signature, jarPath)
-        ui.log.updateBackgroundState("Saving QuickLaunch file")
-        ui.log.log("Writing to quickLaunch file: {}".format(quicklaunchfilename))
-        shutil.copyfile(jarPath, quicklaunchfilename)
-        prune_quick_launch_cache(jarPath, keep_signature=mods_cache_signature)
 
+def load(jarPath, activeMods, mods_cache_signature=None, load_mode=LOAD_MODE_REWRITE, game_version=None):
+    """Load mods into spacehaven.jar"""
 
-def quickload(jarPath, mods_cache_signature):
-    import shutil
-
+    with loader.timing.session("load", modloader_data_dir(jarPath)):
+        with loader.timing.span("unload"):
+            unload(jarPath, message=False)
+
+        if load_mode == LOAD_MODE_OVERLAY:
+            resultPath = overlay_jar_path(jarPath)
+            build(jarPath, activeMods, resultPath, load_mode, cim_level=LAUNCH_CIM_LEVEL, game_version=game_version)
+            enable_overlay(jarPath)
+        else:
+            resultPath = jarPath
+            # the game folder always has a complete spacehaven.jar, even if patching fails halfway
+            build(jarPath, activeMods, jarPath + ".tmp", load_mode, cim_level=LAUNCH_CIM_LEVEL, game_version=game_version)
+            _swap(jarPath + ".tmp", jarPath, backup=jarPath + ".vanilla")
+
+        if mods_cache_signature:
+            quicklaunchfilename = quick_launch_filename(mods_cache_signature, jarPath, load_mode)
+            ui.log.updateBackgroundState("Saving QuickLaunch file")
+            with loader.timing.span("save quicklaunch"):
+                method = place_file(resultPath, quicklaunchfilename)
+            ui.log.log("Wrote quickLaunch file ({}): {}".format(method, quicklaunchfilename))
+            record_quick_launch_use(jarPath, mods_cache_signature, load_mode, hit=False)
+            prune_quick_launch_cache(jarPath, keep_signature=mods_cache_signature, load_mode=load_mode)
+
+
+def quickload(jarPath, mods_cache_signature, load_mode=LOAD_MODE_REWRITE):
     unload(jarPath, message=False)
-    os.rename(jarPath, jarPath + ".vanilla")
-    quicklaunchfilename = quick_launch_filename(mods_cache_signature, jarPath)
+    quicklaunchfilename = quick_launch_filename(mods_cache_signature, jarPath, load_mode)
     ui.log.updateBackgroundState("Loading QuickLaunch file")
-    ui.log.log("Reusing quickLaunch file: {}".format(quicklaunchfilename))
-    shutil.copyfile(quicklaunchfilename, jarPath)
+    if load_mode == LOAD_MODE_OVERLAY:
+        method = place_file(quicklaunchfilename, overlay_jar_path(jarPath))
+        enable_overlay(jarPath)
+    else:
+        method = place_file(quicklaunchfilename, jarPath, backup=jarPath + ".vanilla")
+    ui.log.log("Reusing quickLaunch file ({}): {}".format(method, quicklaunchfilename))
+    record_quick_launch_use(jarPath, mods_cache_signature, load_mode, hit=True)
+
+
+def enable_overlay(jarPath):
+    """Put the overlay jar ahead of spacehaven.jar on the classPath"""
+    configPath = game_config_path(jarPath)
+    ui.log.log("  Adding {} to the classPath in {}".format(OVERLAY_JAR_FILENAME, configPath))
+    ui.database.add_classpath_entry(configPath, OVERLAY_JAR_FILENAME)
+
+
+def disable_overlay(jarPath):
+    """Remove the overlay jar and its classPath entry, returns whether anything was removed"""
+    removed = False
+    try:
+        removed = ui.database.remove_classpath_entry(game_config_path(jarPath), OVERLAY_JAR_FILENAME)
+    except Exception as ex:
+        ui.log.log("  Failed to remove {} from the classPath: {}".format(OVERLAY_JAR_FILENAME, ex))
+
+    overlayPath = overlay_jar_path(jarPath)
+    if os.path.exists(overlayPath):
+        os.remove(overlayPath)
+        removed = True
+    return removed
 
 
 def unload(jarPath, message=True):
@@ -148,6 +403,9 @@ def unload(jarPath, message=True):
     if message:
         ui.log.updateBackgroundState("Unloading mods")
 
+    if disable_overlay(jarPath):
+        ui.log.log("  Removed overlay {}".format(overlay_jar_path(jarPath)))
+
     vanillaPath = jarPath + ".vanilla"
     if not os.path.exists(vanillaPath):
         if message:
@@ -156,5 +414,4 @@ def unload(jarPath, message=True):
 
     ui.log.log("  Restoring original {} from {}".format(jarPath, vanillaPath))
     # FIXME check if the game is running again if that fails ? Restarting from ingame after a language change does that
-    os.remove(jarPath)
-    os.rename(vanillaPath, jarPath)
+    os.replace(vanillaPath, jarPath)
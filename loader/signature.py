@@ -0,0 +1,34 @@
+import hashlib
+import os
+
+import version
+
+from loader.assets.moddigest import DIGEST_CACHE_FILENAME, DigestCache, mod_tree_digest
+
+# bump when what goes into a signature changes, so old QuickLaunch files stop matching
+SIGNATURE_FORMAT = 1
+
+
+def signature(jarPath, activeMods, cacheDir=None, cachedOnly=False):
+    """QuickLaunch signature of loading `activeMods` in this order into `jarPath`
+
+    Covers the loader version, the game jar, and the files and config values of every mod.
+    With `cacheDir`, file digests are cached there between calls. With `cachedOnly`, no file is read: the signature is
+    only built from digests cached for the same path, size and mtime, and is None when a file has none.
+    """
+    cache = DigestCache(os.path.join(cacheDir, DIGEST_CACHE_FILENAME) if cacheDir else None, hashFiles=not cachedOnly)
+
+    lines = ["format {}".format(SIGNATURE_FORMAT), "loader {}".format(version.version)]
+    # a jar left patched by a crashed launch still has its original next to it
+    vanillaPath = jarPath + ".vanilla"
+    lines.append("jar {}".format(cache.digest(vanillaPath if os.path.isfile(vanillaPath) else jarPath)))
+
+    for mod in activeMods:
+        lines.append("mod {} {}".format(os.path.basename(mod.path), mod_tree_digest(mod.path, cache)))
+        for var in mod.variables:
+            lines.append("  var {}={}".format(var.name, var.value))
+
+    if cache.missing:
+        return None
+    cache.save()
+    return hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()
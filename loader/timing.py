@@ -0,0 +1,276 @@
+"""Spans timing the stages of a launch, written as a JSON report next to logs.txt
+
+Code marks stages with `span()`, which costs nothing unless a `session()` is running.
+`count()` adds to counters of the running span and its mod, like XPath matches or texture bytes.
+Setting MODLOADER_PROFILE=1 also dumps a cProfile of the session, open it with `python -m pstats`.
+"""
+
+import contextlib
+import cProfile
+import datetime
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+import ui.log
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+TIMING_REPORT_FILENAME = "timings.json"
+PROFILE_FILENAME = "profile.pstats"
+PROFILE_ENV = "MODLOADER_PROFILE"
+# bump when the report changes shape
+REPORT_FORMAT = 1
+
+# stages adding up to the cost of a mod, the other spans of a mod nest inside them
+MOD_COST_STAGES = {"parse": "buildLibrary", "merge": "doMerges", "patch": "doPatches"}
+MOD_COST_COUNTERS = ["xpath_matches", "texture_bytes", "audio_bytes"]
+PATCH_FILE_STAGE = "patch file"
+
+
+def peak_rss():
+    """Peak resident memory of the process so far in bytes, None where unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes everywhere but macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Recorder:
+    """Collects the spans of one session, spans nest per thread"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+        self.modNames = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def span(self, name, mod=None, detail=None):
+        stack = self.local.__dict__.setdefault("stack", [])
+        record = {"name": name, "mod": mod, "parent": stack[-1]["name"] if stack else None, "depth": len(stack)}
+        if mod is None and stack:
+            record["mod"] = stack[-1]["mod"]
+        if detail is not None:
+            record["detail"] = detail
+        stack.append(record)
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        record["start"] = round(wall - self.origin, 6)
+        try:
+            yield record
+        finally:
+            record["wall"] = round(time.perf_counter() - wall, 6)
+            record["cpu"] = round(time.process_time() - cpu, 6)
+            record["peak_rss"] = peak_rss()
+            stack.pop()
+            with self.lock:
+                self.spans.append(record)
+
+    def count(self, key, amount=1, mod=None):
+        """Add `amount` to counter `key` of the innermost span of this thread and of `mod`, by default the span's mod"""
+        stack = self.local.__dict__.get("stack")
+        if stack:
+            counts = stack[-1].setdefault("counts", {})
+            counts[key] = counts.get(key, 0) + amount
+            if mod is None:
+                mod = stack[-1]["mod"]
+        with self.lock:
+            counters = self.counters.setdefault(mod, {})
+            counters[key] = counters.get(key, 0) + amount
+
+    def name_mod(self, mod, name):
+        with self.lock:
+            self.modNames[mod] = name
+
+    def report(self):
+        """The spans with totals per stage and per mod"""
+        with self.lock:
+            spans = sorted(self.spans, key=lambda record: (record["start"], record["depth"]))
+            counters = {mod: dict(counts) for mod, counts in self.counters.items()}
+            modNames = dict(self.modNames)
+
+        stages = {}
+        mods = {}
+        for record in spans:
+            stage = stages.setdefault(record["name"], {"wall": 0.0, "cpu": 0.0, "count": 0})
+            stage["wall"] += record["wall"]
+            stage["cpu"] += record["cpu"]
+            stage["count"] += 1
+            if record["mod"] is not None:
+                modStages = mods.setdefault(record["mod"], {})
+                modStages[record["name"]] = modStages.get(record["name"], 0.0) + record["wall"]
+
+        return {
+            "format": REPORT_FORMAT,
+            "name": self.name,
+            "started": self.started.isoformat(timespec="seconds"),
+            "peak_rss": peak_rss(),
+            "stages": stages,
+            "mods": mods,
+            "counters": counters.pop(None, {}),
+            "mod_costs": mod_costs(mods, counters, spans, modNames),
+            "spans": spans,
+        }
+
+
+def mod_costs(mods, counters, spans, modNames=None):
+    """Rows of the time and work spent on each mod, the most expensive first
+
+    `mods` and `counters` are the per mod totals of a report, `spans` supplies the time of each patch file.
+    `modNames` maps mod folder names to the names shown for them, see `name_mod`.
+    """
+    rows = {}
+    for mod in set(mods) | set(counters):
+        stages = mods.get(mod, {})
+        row = {"mod": mod, "name": (modNames or {}).get(mod) or mod}
+        for column, stage in MOD_COST_STAGES.items():
+            row[column] = round(stages.get(stage, 0.0), 6)
+        row["total"] = round(sum(row[column] for column in MOD_COST_STAGES), 6)
+        for key in MOD_COST_COUNTERS:
+            row[key] = counters.get(mod, {}).get(key, 0)
+        row["patch_files"] = []
+        rows[mod] = row
+
+    for record in spans:
+        if record["name"] == PATCH_FILE_STAGE and record["mod"] in rows:
+            rows[record["mod"]]["patch_files"].append(
+                {"file": record.get("detail"), "wall": record["wall"], "xpath_matches": record.get("counts", {}).get("xpath_matches", 0)}
+            )
+
+    return sorted(rows.values(), key=lambda row: (-row["total"], row["mod"]))
+
+
+def _size(count):
+    for unit in ("B", "KB", "MB"):
+        if count < 1024:
+            return "{:.0f} {}".format(count, unit)
+        count /= 1024
+    return "{:.1f} GB".format(count)
+
+
+def format_mod_costs(rows, patch_files=False):
+    """The rows of `mod_costs` as the lines of a ranked table"""
+    lines = ["{:>3}  {:<32} {:>8} {:>8} {:>8} {:>8} {:>8} {:>9} {:>9}".format("#", "mod", "total", "parse", "merge", "patch", "matches", "textures", "audio")]
+    for rank, row in enumerate(rows, 1):
+        times = "{:>7.2f}s {:>7.2f}s {:>7.2f}s {:>7.2f}s".format(row["total"], row["parse"], row["merge"], row["patch"])
+        lines.append("{:>3}  {:<32} {} {:>8} {:>9} {:>9}".format(rank, row.get("name", row["mod"])[:32], times, row["xpath_matches"], _size(row["texture_bytes"]), _size(row["audio_bytes"])))
+        if patch_files:
+            for patchFile in sorted(row["patch_files"], key=lambda patchFile: -patchFile["wall"]):
+                lines.append("{:>3}    {:<30} {:>7.2f}s {:>36}".format("", (patchFile["file"] or "?")[-30:], patchFile["wall"], patchFile["xpath_matches"]))
+    return lines
+
+
+def read_report(reportDir):
+    """The last report written to `reportDir`, None if there is none"""
+    try:
+        with open(os.path.join(reportDir, TIMING_REPORT_FILENAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+_active = None
+
+
+def span(name, mod=None, detail=None):
+    """Time the enclosed block as stage `name`, optionally on behalf of `mod`, `detail` tells spans of a stage apart"""
+    recorder = _active
+    if recorder is None:
+        return contextlib.nullcontext()
+    return recorder.span(name, mod, detail)
+
+
+def count(key, amount=1, mod=None):
+    """Add `amount` to counter `key` of the running span, `mod` charges it to a mod outside of its spans"""
+    recorder = _active
+    if recorder is not None:
+        recorder.count(key, amount, mod)
+
+
+def name_mod(mod, name):
+    """Show `mod`, the folder name the spans are charged to, as `name` in the mod costs"""
+    recorder = _active
+    if recorder is not None:
+        recorder.name_mod(mod, name)
+
+
+def timed(name, mod=None):
+    """Decorator running the function in a span, `mod` picks the mod name out of the call arguments"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            recorder = _active
+            if recorder is None:
+                return function(*args, **kwargs)
+            with recorder.span(name, mod(*args, **kwargs) if mod else None):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextlib.contextmanager
+def session(name, reportDir):
+    """Record the spans of the enclosed block and write them to `reportDir`
+
+    Nested sessions become spans of the running one.
+    """
+    global _active
+    if _active is not None:
+        with _active.span(name):
+            yield _active
+        return
+
+    recorder = Recorder(name)
+    profiler = cProfile.Profile() if os.environ.get(PROFILE_ENV, "").strip() not in ("", "0") else None
+    _active = recorder
+    if profiler:
+        profiler.enable()
+    try:
+        with recorder.span(name):
+            yield recorder
+    finally:
+        if profiler:
+            profiler.disable()
+        _active = None
+        _write_report(recorder, reportDir, profiler)
+
+
+def _write_report(recorder, reportDir, profiler):
+    report = recorder.report()
+    for stage, totals in sorted(report["stages"].items(), key=lambda item: -item[1]["wall"]):
+        ui.log.log("  {:<24} {:8.2f}s wall {:8.2f}s cpu  x{}".format(stage, totals["wall"], totals["cpu"], totals["count"]))
+    if report["mod_costs"]:
+        ui.log.log("Cost per mod:")
+        for line in format_mod_costs(report["mod_costs"]):
+            ui.log.log("  " + line)
+
+    try:
+        os.makedirs(reportDir, exist_ok=True)
+        reportPath = os.path.join(reportDir, TIMING_REPORT_FILENAME)
+        with open(reportPath, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+        ui.log.log("Wrote timing report to {}".format(reportPath))
+
+        if profiler:
+            profilePath = os.path.join(reportDir, PROFILE_FILENAME)
+            profiler.dump_stats(profilePath)
+            ui.log.log("Wrote profile to {}".format(profilePath))
+    except Exception as ex:
+        ui.log.log("Failed to write timing report: {}".format(ex))
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import multiprocessing
 import os
 import platform
 import threading
@@ -13,6 +14,8 @@ from tkinter import filedialog, messagebox, ttk, font, scrolledtext
 
 import loader.extract
 import loader.load
+import loader.signature
+import loader.timing
 import ui.database
 from loader.assets.annotate import annotate
 from ui.gameinfo import GameInfo
@@ -195,6 +198,7 @@ class Window(Frame):
         self.config_dirty = False
         self.config_filter_var = StringVar()
         self.config_status_var = StringVar(value="No unsaved changes")
+        self.overlay_mode_var = BooleanVar(value=False)
 
         # separator
         # Frame(self, height=1, bg="grey").pack(fill=X, padx=4, pady=8)
@@ -311,6 +315,12 @@ class Window(Frame):
         self.quickLaunchClear = Button(buttonFrame, text="Clear QuickLaunch cache", command=self.clear_quick_launch)
         self.quickLaunchClear.pack(side=RIGHT, expand=False, padx=8, pady=4)
 
+        self.modCostsButton = Button(buttonFrame, text="Mod costs", command=self.show_mod_costs)
+        self.modCostsButton.pack(side=RIGHT, expand=False, padx=8, pady=4)
+
+        self.overlayModeToggle = Checkbutton(buttonFrame, text="Overlay jar", variable=self.overlay_mode_var, command=self.save_load_mode)
+        self.overlayModeToggle.pack(side=RIGHT, expand=False, padx=8, pady=4)
+
         buttonFrame.pack(fill=X, padx=4, pady=8)
 
         self.autolocateSpacehaven()
@@ -430,6 +440,7 @@ class Window(Frame):
             self.modPath.append(self.workshopPath)
 
         self.load_extra_mod_paths()
+        self.restore_load_mode()
 
         DatabaseHandler(self.modPath, self.gameInfo)
         self.refreshModList()
@@ -482,6 +493,34 @@ class Window(Frame):
         except Exception as ex:
             ui.log.log("Unable to migrate extra mod paths to {}: {}".format(statePath, ex))
 
+    def load_mode(self):
+        return loader.load.LOAD_MODE_OVERLAY if self.overlay_mode_var.get() else loader.load.LOAD_MODE_REWRITE
+
+    def restore_load_mode(self):
+        try:
+            mode = _read_text_file(self.modloader_state_file(loader.load.LOAD_MODE_FILENAME)).strip()
+        except FileNotFoundError:
+            mode = loader.load.LOAD_MODE_REWRITE
+        except Exception as ex:
+            ui.log.log("Unable to read load mode: {}".format(ex))
+            mode = loader.load.LOAD_MODE_REWRITE
+        if mode not in loader.load.LOAD_MODES:
+            ui.log.log("Ignoring unknown load mode: {}".format(mode))
+            mode = loader.load.LOAD_MODE_REWRITE
+        self.overlay_mode_var.set(mode == loader.load.LOAD_MODE_OVERLAY)
+        ui.log.log("  loadMode: {}".format(mode))
+
+    def save_load_mode(self):
+        if not self.jarPath:
+            return
+        mode = self.load_mode()
+        try:
+            _write_text_file(self.modloader_state_file(loader.load.LOAD_MODE_FILENAME), mode)
+            ui.log.log("Saved load mode: {}".format(mode))
+        except Exception as ex:
+            ui.log.log("Unable to save load mode: {}".format(ex))
+        self.check_quick_launch()
+
     def checkForLoadedMods(self):
         if self.jarPath is None:
             return
@@ -810,6 +849,8 @@ class Window(Frame):
         self.modEnableDisable.config(state=state)
         self.spacehavenBrowse.config(state=state)
         self.quickLaunchClear.config(state=state)
+        self.modCostsButton.config(state=state)
+        self.overlayModeToggle.config(state=state)
         self.modListRefresh.config(state=state)
         self.modListOpenFolder.config(state=state)
         self.modMoveUp.config(state=state)
@@ -852,6 +893,7 @@ class Window(Frame):
             try:
                 task()
             finally:
+                ui.log.flush()
                 self.background_finished = True
 
         self.background_thread = threading.Thread(target=_wrapper)
@@ -894,22 +936,19 @@ class Window(Frame):
     def mods_enabled(self):
         return DatabaseHandler.getActiveMods()
 
-    def current_mods_signature(self):
-        import hashlib
-
-        mods_signature = ["spacehaven", self.gameInfo.version]
-        # mods are supposedly ordered alphabetically
-        for mod in self.mods_enabled():
-            mods_signature.append(mod.name)
-            mods_signature.append(mod.version or "VERSION_UNKNOWN")
+    def current_mods_signature(self, cached_only=False):
+        return loader.signature.signature(self.jarPath, self.mods_enabled(), loader.load.modloader_data_dir(self.jarPath), cachedOnly=cached_only)
 
-        text_sig = "__".join(mods_signature).lower()
-        md5 = hashlib.md5(text_sig.encode("utf-8")).hexdigest()
-        return md5
+    def quick_launch_available(self, cached_only=True):
+        """Whether a QuickLaunch file matches the enabled mods
 
-    def quick_launch_available(self):
-        mods_sig = self.current_mods_signature()
-        return os.path.isfile(loader.load.quick_launch_filename(mods_sig, self.jarPath))
+        Reading the jar and the mods can take seconds, the window only compares the paths, sizes and mtimes of the last
+        signature. Launches compute the full one from the background thread.
+        """
+        if not self.jarPath:
+            return False
+        mods_sig = self.current_mods_signature(cached_only)
+        return mods_sig is not None and os.path.isfile(loader.load.quick_launch_filename(mods_sig, self.jarPath, self.load_mode()))
 
     def check_quick_launch(self):
         has_cache = self.jarPath and loader.load.has_quick_launch_cache(self.jarPath)
@@ -931,6 +970,19 @@ class Window(Frame):
         ui.log.log("Cleared {} QuickLaunch cache file(s).".format(removed))
         self.check_quick_launch()
 
+    def show_mod_costs(self):
+        report = loader.timing.read_report(loader.load.modloader_data_dir(self.jarPath)) if self.jarPath else None
+        if not report or not report.get("mod_costs"):
+            messagebox.showinfo("Mod costs", "No mods were built yet, launch the game with mods first.")
+            return
+
+        window = Toplevel(self)
+        window.title("Mod costs, {} started {}".format(report["name"], report["started"]))
+        text = scrolledtext.ScrolledText(window, wrap=NONE, width=120, height=30, font=font.nametofont("TkFixedFont"))
+        text.insert(END, "\n".join(loader.timing.format_mod_costs(report["mod_costs"], patch_files=True)))
+        text.config(state=DISABLED)
+        text.pack(fill=BOTH, expand=True)
+
     def launch_wrapper(self):
         if self.config_dirty:
             answer = messagebox.askyesnocancel(
@@ -952,21 +1004,30 @@ class Window(Frame):
         if not self.mods_enabled():
             task = self.launch_vanilla
             message = "Launching original game"
-        elif self.quick_launch_available():
-            task = self.quick_launch
-            message = "Quicklaunching"
         else:
-            task = self.patchAndLaunch
-            message = "Launching"
+            task = self.launch_mods
+            message = "Checking mods"
 
         self.start_background_task(task, message)
 
     def launch_vanilla(self):
         ui.launcher.launchAndWait(self.gamePath)
 
+    def launch_mods(self):
+        try:
+            if self.quick_launch_available(cached_only=False):
+                ui.log.updateBackgroundState("Quicklaunching")
+                self.quick_launch()
+            else:
+                ui.log.updateBackgroundState("Launching")
+                self.patchAndLaunch()
+        finally:
+            # files written just before the last signature were too fresh to cache, so the window can check this one
+            self.current_mods_signature()
+
     def quick_launch(self):
         try:
-            loader.load.quickload(self.jarPath, self.current_mods_signature())
+            loader.load.quickload(self.jarPath, self.current_mods_signature(), self.load_mode())
             ui.launcher.launchAndWait(self.gamePath)
             # FIXME this will crash if the game restarts by itself (changing language)
             loader.load.unload(self.jarPath)
@@ -995,7 +1056,7 @@ class Window(Frame):
                     mod.saveConfig()
 
         try:
-            loader.load.load(self.jarPath, activeMods, self.current_mods_signature())
+            loader.load.load(self.jarPath, activeMods, self.current_mods_signature(), self.load_mode(), game_version=self.gameInfo.version)
             ui.launcher.launchAndWait(self.gamePath)
             loader.load.unload(self.jarPath)
         except:
@@ -1008,6 +1069,7 @@ class Window(Frame):
         if not self.confirm_unsaved_config("quitting"):
             return
         if self.can_quit:
+            ui.log.flush()
             self.master.destroy()
             return
 
@@ -1019,11 +1081,14 @@ def handleException(type, value, trace):
 
     ui.log.log("!! Exception !!")
     ui.log.log(message)
+    ui.log.flush()
 
     messagebox.showerror("Error", "Sorry, something went wrong!\n\n" "Please open an issue at https://github.com/Spacehaven-modding-tools/spacehaven-modloader and attach logs.txt from your mods/modloader/ folder.")
 
 
 if __name__ == "__main__":
+    # texture explode runs in a process pool, frozen builds have to hand its workers over here
+    multiprocessing.freeze_support()
     root = Tk()
 
     # Pick a default window size that fits the user's screen. SteamDeck is
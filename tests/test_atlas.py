@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+
+import lxml.etree
+
+import loader.assets.atlas as atlas
+from loader.assets.explode import CIM_COMPRESSION_LEVEL
+
+
+class AtlasTests(unittest.TestCase):
+    def test_sprites_spill_into_extra_pages(self):
+        sizes = {str(region): (6, 6) for region in range(5)}
+        sizes["5"] = (2, 2)
+
+        pages = atlas.pack(sizes, pageSize=12)
+
+        # four 6x6 sprites fill a page, the small one goes on the first page with room
+        self.assertEqual([len(page) for page in pages], [4, 2])
+        self.assertEqual(set().union(*pages), set(sizes))
+        for page in pages:
+            cells = [(x + dx, y + dy) for x, y, w, h in page.values() for dx in range(w) for dy in range(h)]
+            self.assertEqual(len(cells), len(set(cells)))
+            self.assertTrue(all(x < 12 and y < 12 for x, y in cells))
+
+    def test_sprites_larger_than_a_page_are_an_error(self):
+        with self.assertRaisesRegex(Exception, "big.png"):
+            atlas.pack({"big.png": (13, 1), "small.png": (1, 1)}, pageSize=12)
+
+    def test_page_ids_skip_pages_in_use(self):
+        self.assertEqual(atlas.page_ids(3, {"0", "24", "26", "9999"}), ["25", "27", "28"])
+        self.assertEqual(atlas.page_ids(0, set()), [])
+
+    def test_page_key_covers_the_compression_level(self):
+        with tempfile.TemporaryDirectory() as root:
+            sprite = os.path.join(root, "sprite.png")
+            with open(sprite, "wb") as f:
+                f.write(b"png")
+            cache = atlas.AtlasCache(root)
+            blits = [(sprite, 0, 0, 1, 1)]
+
+            self.assertEqual(cache.page_key(4, 4, blits), cache.page_key(4, 4, blits, CIM_COMPRESSION_LEVEL))
+            self.assertNotEqual(cache.page_key(4, 4, blits, 1), cache.page_key(4, 4, blits, 9))
+
+    def test_generated_regions_are_inserted_in_id_order(self):
+        textures = lxml.etree.fromstring(
+            '<AllTexturesAndRegions><textures/><regions><re n="100" t="0"/><!-- mod --><re n="102" t="7"/><re n="104" t="7"/></regions></AllTexturesAndRegions>'
+        )
+        sprites = {region: {"atlas": True, "w": 8, "h": 8, "filename": region + ".png"} for region in ("101", "103", "105")}
+        coreLibrary = {"library/textures": lxml.etree.ElementTree(textures), "_all_modded_textures": sprites, "_custom_textures_cim": {"7": {}}}
+
+        # one sprite per page, the pages interleave their ids
+        self.assertEqual(atlas.add_pages(coreLibrary, pageSize=12), ["24", "25", "26"])
+
+        self.assertEqual(textures.xpath("regions/re/@n"), ["100", "101", "102", "103", "104", "105"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+
+import ui.log
+from benchmarks import pipeline
+
+TINY_SIZES = {"elements": 50, "texts": 50, "regions_per_page": 4, "page_size": 64, "audio": 2, "classes": 5}
+
+
+class BenchmarkTests(unittest.TestCase):
+    def test_pipeline_times_every_stage_on_a_tiny_corpus(self):
+        self.addCleanup(setattr, ui.log.logger, "echo", ui.log.logger.echo)
+        ui.log.logger.echo = False
+
+        report = pipeline.run([3], TINY_SIZES)
+
+        stages = [result["stage"] for result in report["results"]]
+        self.assertEqual(stages, ["build"] + pipeline.BUILD_STAGES + ["signature", "quickload"])
+        self.assertTrue(all(result["mods"] == 3 and result["seconds"] >= 0 for result in report["results"]))
+        self.assertGreater(report["jar_bytes"], 0)
+        seconds = {result["stage"]: result["seconds"] for result in report["results"]}
+        self.assertLessEqual(seconds["merge.mods"], seconds["build"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import io
+import tempfile
+import unittest
+import zipfile
+from contextlib import redirect_stdout
+from pathlib import Path
+from unittest import mock
+
+import loader.cli as cli
+import ui.log
+from tests.test_jarmod_xml import CORE_FILES
+
+INFO = "<mod><name>{}</name><description>test mod</description></mod>"
+
+
+class CliTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.jar_path = self.root / "spacehaven.jar"
+        with zipfile.ZipFile(self.jar_path, "w", compression=zipfile.ZIP_DEFLATED) as jar:
+            jar.writestr("version.txt", "0.14.1\nalpha 14\n")
+            for name, content in CORE_FILES.items():
+                jar.writestr("library/" + name, content)
+
+        self.mod_path = self.root / "mods" / "XmlMod"
+        (self.mod_path / "library").mkdir(parents=True)
+        (self.mod_path / "info.xml").write_text(INFO.format("XmlMod"), encoding="utf-8")
+        (self.mod_path / "library" / "haven.xml").write_text("<data><Element><me mid=\"42\"/></Element></data>", encoding="utf-8")
+
+        # keep the shared logger on its own file and quiet
+        patcher = mock.patch.object(ui.log, "setGameModPath")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, ui.log.logger, "echo", ui.log.logger.echo)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _run(self, *argv):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            status = cli.main([str(arg) for arg in argv])
+        return status, output.getvalue()
+
+    def test_build_writes_modded_jar_without_touching_the_game(self):
+        output = self.root / "out" / "modded.jar"
+        output.parent.mkdir()
+
+        status, _ = self._run("build", self.jar_path, self.root / "mods", "-o", output)
+
+        self.assertEqual(status, cli.EXIT_OK)
+        with zipfile.ZipFile(output) as jar:
+            self.assertIn(b'mid="42"', jar.read("library/haven"))
+        with zipfile.ZipFile(self.jar_path) as jar:
+            self.assertNotIn(b'mid="42"', jar.read("library/haven"))
+
+    def test_quickload_without_cached_jar_reports_a_miss(self):
+        status, output = self._run("quickload", self.jar_path, self.mod_path)
+
+        self.assertEqual(status, cli.EXIT_CACHE_MISS)
+        self.assertIn("No QuickLaunch file", output)
+
+    def test_cache_stats(self):
+        status, output = self._run("cache", "stats", self.jar_path)
+
+        self.assertEqual(status, cli.EXIT_OK)
+        self.assertIn("hit rate: n/a", output)
+
+    def test_report_ranks_the_mods_of_the_last_build(self):
+        self.assertEqual(self._run("report", self.jar_path)[0], cli.EXIT_ERROR)
+
+        (self.mod_path / "info.xml").write_text(INFO.format("XmlPatcher"), encoding="utf-8")
+        (self.mod_path / "patches").mkdir()
+        patch = '<Patch><Operation Class="AttributeSet"><xpath>/data</xpath><attribute>patched</attribute><value>1</value></Operation></Patch>'
+        (self.mod_path / "patches" / "haven.xml").write_text(patch, encoding="utf-8")
+        self._run("build", self.jar_path, self.mod_path, "-o", self.root / "modded.jar")
+
+        status, output = self._run("report", self.jar_path, "--files")
+
+        self.assertEqual(status, cli.EXIT_OK)
+        lines = output.splitlines()
+        self.assertTrue(any(line.split()[:2] == ["1", "XmlPatcher"] for line in lines))
+        self.assertTrue(any("patches/haven.xml" in line and line.split()[-1] == "1" for line in lines))
+
+    def test_missing_jar_and_failures_have_their_own_status(self):
+        self.assertEqual(self._run("cache", "stats", self.root / "missing.jar")[0], cli.EXIT_USAGE)
+        self.assertEqual(self._run("build", self.jar_path, self.root / "missing", "-o", self.root / "out.jar")[0], cli.EXIT_ERROR)
+
+
+if __name__ == "__main__":
+    unittest.main()
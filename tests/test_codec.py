@@ -0,0 +1,120 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import png
+
+import loader.assets.codec as codec
+
+WIDTH = 5
+HEIGHT = 3
+ROWS = [bytes(value for x in range(WIDTH) for value in (x * 40 + y, y * 80, x * y, 255 - x)) for y in range(HEIGHT)]
+
+
+def write_pypng(path):
+    with open(path, "wb") as f:
+        png.Writer(width=WIDTH, height=HEIGHT, greyscale=False, alpha=True).write_packed(f, ROWS)
+
+
+def as_bytes(rows):
+    return b"".join(bytes(row) for row in (rows.reshape(len(rows), -1) if hasattr(rows, "reshape") else rows))
+
+
+class CodecTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _backends(self):
+        backends = [codec.BACKEND_PYPNG]
+        if codec.Image is not None:
+            backends.append(codec.BACKEND_PILLOW)
+        return backends
+
+    def test_backends_decode_to_the_same_rows(self):
+        path = self.root / "region.png"
+        write_pypng(path)
+
+        for backend in self._backends():
+            with self.subTest(backend=backend):
+                width, height, rows = codec.read_rgba(str(path), backend)
+                self.assertEqual((width, height), (WIDTH, HEIGHT))
+                self.assertEqual(as_bytes(rows), b"".join(ROWS))
+
+    @unittest.skipIf(codec.Image is None, "Pillow is not installed")
+    def test_pillow_decodes_palette_and_grey_pngs_to_rgba(self):
+        grey, palette = self.root / "grey.png", self.root / "palette.png"
+        with open(grey, "wb") as f:
+            png.Writer(width=2, height=1, greyscale=True, alpha=True).write(f, [[10, 20, 30, 40]])
+        with open(palette, "wb") as f:
+            png.Writer(width=2, height=1, palette=[(1, 2, 3, 4), (5, 6, 7, 8)]).write(f, [[1, 0]])
+
+        self.assertEqual(codec.BACKEND, codec.BACKEND_PILLOW)
+        for path, expected in ((grey, bytes((10, 10, 10, 20, 30, 30, 30, 40))), (palette, bytes((5, 6, 7, 8, 1, 2, 3, 4)))):
+            with self.subTest(path=path.name):
+                width, height, rows = codec.read_rgba(str(path), codec.BACKEND_PILLOW)
+                self.assertEqual((width, height), (2, 1))
+                self.assertEqual(as_bytes(rows), expected)
+                self.assertEqual(as_bytes(rows), as_bytes(codec.read_rgba(str(path), codec.BACKEND_PYPNG)[2]))
+
+    def test_written_pngs_decode_with_every_filter(self):
+        path = self.root / "written.png"
+        _, _, rows = codec.read_rgba(str(self._source()), codec.BACKEND_PYPNG)
+
+        for level, filter in ((0, codec.FILTER_NONE), (9, codec.FILTER_UP), (None, codec.FILTER_UP)):
+            with self.subTest(level=level, filter=filter):
+                codec.write_rgba(str(path), WIDTH, HEIGHT, rows, level, filter)
+                width, height, decoded, _ = png.Reader(filename=str(path)).asRGBA8()
+                self.assertEqual((width, height), (WIDTH, HEIGHT))
+                self.assertEqual(b"".join(bytes(row) for row in decoded), b"".join(ROWS))
+
+    def test_works_without_numpy(self):
+        path = self.root / "written.png"
+        with mock.patch.object(codec, "numpy", None):
+            _, _, rows = codec.read_rgba(str(self._source()), codec.BACKEND_PYPNG)
+            self.assertIsInstance(rows, list)
+            codec.write_rgba(str(path), WIDTH, HEIGHT, rows)
+
+        self.assertEqual(as_bytes(codec.read_rgba(str(path))[2]), b"".join(ROWS))
+
+    def test_read_size_only_needs_the_header(self):
+        path = self.root / "region.png"
+        write_pypng(path)
+        with open(path, "r+b") as f:
+            f.truncate(40)
+
+        self.assertEqual(codec.read_size(str(path)), (WIDTH, HEIGHT))
+        (self.root / "texture.txt").write_text("not a png")
+        with self.assertRaises(ValueError):
+            codec.read_size(str(self.root / "texture.txt"))
+
+    def test_decode_cache_decodes_each_file_once(self):
+        first, second = self.root / "first.png", self.root / "second.png"
+        write_pypng(first)
+        write_pypng(second)
+        # room for one decoded file
+        cache = codec.DecodeCache(maxBytes=WIDTH * HEIGHT * codec.PIXEL_SIZE)
+
+        with mock.patch.object(codec, "read_rgba", wraps=codec.read_rgba) as read_rgba:
+            decoded = cache.read_rgba(str(first))
+            self.assertIs(cache.read_rgba(str(first)), decoded)
+            cache.read_rgba(str(second))
+            cache.read_rgba(str(first))
+
+        self.assertEqual(read_rgba.call_count, 3)
+        self.assertEqual((cache.hits, cache.misses, len(cache.entries)), (1, 3, 1))
+        cache.clear()
+        self.assertEqual((cache.bytes, len(cache.entries)), (0, 0))
+
+    def _source(self):
+        path = self.root / "source.png"
+        write_pypng(path)
+        return path
+
+
+if __name__ == "__main__":
+    unittest.main()
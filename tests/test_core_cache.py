@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+import lxml.etree
+
+import loader.assets.corecache as corecache
+from loader.assets.library import PATCHABLE_XML_FILES, JarLibrary
+from tests.test_jarmod_xml import CORE_FILES
+
+
+class CoreCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.jar_path = self.root / "spacehaven.jar"
+        self.core_path = self.root / "core"
+        self.cache_dir = self.root / "mods" / "modloader" / corecache.CORE_CACHE_DIRNAME
+        self._write_jar(CORE_FILES)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write_jar(self, files):
+        with zipfile.ZipFile(self.jar_path, "w", compression=zipfile.ZIP_DEFLATED) as jar:
+            jar.writestr("version.txt", "0.14.1\nalpha 14\n")
+            for name, content in files.items():
+                jar.writestr("library/" + name, "<!-- vanilla -->\n" + content.replace("><", ">\n  <"))
+            jar.writestr("library/sound/ogg/click.ogg", b"click")
+
+    def _load(self, cache_dir=True):
+        with JarLibrary(str(self.jar_path), str(self.core_path)) as library:
+            return corecache.load(library, str(self.cache_dir) if cache_dir else None, "0.14.1")
+
+    def test_second_load_comes_from_cache_and_matches(self):
+        built, built_facts = self._load()
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        cached, cached_facts = self._load()
+
+        self.assertEqual(cached_facts, built_facts)
+        self.assertEqual(cached_facts["last_core_region_id"], 100)
+        self.assertEqual(cached_facts["original_audio"], ["library/sound/ogg/click.ogg"])
+        for filename in PATCHABLE_XML_FILES:
+            self.assertEqual(lxml.etree.tostring(cached[filename]), lxml.etree.tostring(built[filename]))
+
+    def test_uncached_load_matches_cached_load(self):
+        self._load()
+        cached, _ = self._load()
+
+        parsed, _ = self._load(cache_dir=False)
+
+        self.assertTrue(os.listdir(self.cache_dir)[0].startswith("0.14.1_"))
+        for filename in PATCHABLE_XML_FILES:
+            self.assertEqual(lxml.etree.tostring(parsed[filename]), lxml.etree.tostring(cached[filename]))
+
+    def test_broken_cache_is_rebuilt(self):
+        self._load()
+        (cache_path,) = [self.cache_dir / entry for entry in os.listdir(self.cache_dir)]
+        (cache_path / "haven.xml").write_text("<data><Element>", encoding="utf-8")
+
+        coreLibrary, facts = self._load()
+
+        self.assertTrue(coreLibrary["library/haven"].xpath("/data/Element/me"))
+        self.assertEqual(facts["last_core_region_id"], 100)
+        self.assertEqual(os.listdir(self.cache_dir), [cache_path.name])
+        self.assertTrue(lxml.etree.parse(str(cache_path / "haven.xml")).xpath("/data/Element/me"))
+
+    def test_changed_library_rebuilds_and_replaces_cache(self):
+        self._load()
+        first = os.listdir(self.cache_dir)
+
+        self._write_jar(dict(CORE_FILES, haven="<data><Element><me mid=\"2\"/></Element></data>"))
+        coreLibrary, _ = self._load()
+
+        self.assertTrue(coreLibrary["library/haven"].xpath("/data/Element/me[@mid='2']"))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        self.assertNotEqual(os.listdir(self.cache_dir), first)
+
+    def test_without_cache_dir_nothing_is_written(self):
+        with JarLibrary(str(self.jar_path), str(self.core_path)) as library:
+            corecache.load(library, None)
+
+        self.assertFalse(self.cache_dir.exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
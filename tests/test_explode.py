@@ -0,0 +1,135 @@
+import struct
+import sys
+import tempfile
+import types
+import unittest
+import zlib
+from pathlib import Path
+from unittest import mock
+
+import png
+
+import loader.assets.cim as cim
+import loader.assets.codec as codec
+import loader.assets.explode as explode
+from loader.assets.explode import PIXEL_SIZE, RGBA_FORMAT, Texture
+
+
+def write_png(path, width, height, pixel_of):
+    rows = [[value for x in range(width) for value in pixel_of(x, y)] for y in range(height)]
+    with open(path, "wb") as f:
+        png.Writer(width=width, height=height, greyscale=False, alpha=True).write(f, rows)
+
+
+def read_png(path):
+    width, height, rows, _ = png.Reader(filename=str(path)).asRGBA8()
+    return width, height, [bytes(row) for row in rows]
+
+
+class TextureTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _blit_and_crop(self):
+        region = self.root / "region.png"
+        write_png(region, 3, 2, lambda x, y: (x, y, 7, 255))
+
+        page = Texture(None, create=True, width=8, height=4)
+        page.pack_png(str(region), 4, 1, 3, 2)
+        # does not fit, the page is left alone
+        page.pack_png(str(region), 6, 3, 3, 2)
+
+        crop = self.root / "crop.png"
+        page.export_png(str(crop), 3, 1, 4, 2)
+        whole = self.root / "whole.png"
+        page.export_png(str(whole))
+        return page, read_png(crop), read_png(whole)
+
+    def test_blit_and_crop(self):
+        page, crop, whole = self._blit_and_crop()
+
+        start = (4 + 1 * 8) * PIXEL_SIZE
+        self.assertEqual(bytes(page.data[start : start + 3 * PIXEL_SIZE]), bytes([0, 0, 7, 255, 1, 0, 7, 255, 2, 0, 7, 255]))
+        self.assertEqual(crop[:2], (4, 2))
+        self.assertEqual(crop[2][1], bytes([0, 0, 0, 0, 0, 1, 7, 255, 1, 1, 7, 255, 2, 1, 7, 255]))
+        self.assertEqual((whole[0], whole[1]), (8, 4))
+        self.assertEqual(b"".join(whole[2]), bytes(page.data))
+
+    def test_numpy_and_row_copies_agree(self):
+        if codec.numpy is None:
+            self.skipTest("numpy is not installed")
+        page, *with_numpy = self._blit_and_crop()
+        self.assertEqual(page.pixels.shape, (4, 8, PIXEL_SIZE))
+        with mock.patch.object(codec, "numpy", None):
+            page, crop, whole = self._blit_and_crop()
+            self.assertIsNone(page.pixels)
+        self.assertEqual([crop, whole], with_numpy)
+
+    def test_cim_round_trip_in_chunks(self):
+        page = Texture(None, create=True, width=64, height=32)
+        page.data[:] = bytes(range(256)) * (len(page.data) // 256)
+        fast, best = self.root / "fast.cim", self.root / "best.cim"
+
+        with mock.patch.object(explode, "CIM_CHUNK_SIZE", 1000), mock.patch.object(cim, "CIM_CHUNK_SIZE", 1000):
+            page.export_cim(str(fast), explode.CIM_FAST_COMPRESSION_LEVEL)
+            page.export_cim(str(best), 9)
+            decoded = Texture(str(fast))
+
+        self.assertEqual(zlib.decompress(best.read_bytes()), zlib.decompress(fast.read_bytes()))
+        self.assertEqual((decoded.width, decoded.height, decoded.format), (64, 32, RGBA_FORMAT))
+        self.assertEqual(decoded.data, page.data)
+
+    def test_short_cim_is_padded_to_the_page_size(self):
+        path = self.root / "short.cim"
+        path.write_bytes(zlib.compress(struct.pack(">3i", 2, 2, RGBA_FORMAT) + b"\x01" * 8))
+
+        texture = Texture(str(path))
+
+        self.assertEqual(texture.data, bytearray(b"\x01" * 8 + b"\x00" * 8))
+
+    def _write_core(self, core):
+        library = core / "library"
+        library.mkdir(parents=True)
+        for page, colour in (("0", 10), ("1", 20)):
+            texture = Texture(None, create=True, width=4, height=4)
+            texture.data[:] = bytes((colour + index) % 256 for index in range(len(texture.data)))
+            texture.export_cim(str(library / "{}.cim".format(page)))
+        (library / "textures").write_text(
+            '<AllTexturesAndRegions><regions><re n="1" t="0" x="0" y="0" w="2" h="2"/><re n="2" t="1" x="1" y="2" w="3" h="2"/>'
+            '<re n="3" t="0" x="2" y="1" w="2" h="3"/></regions></AllTexturesAndRegions>'
+        )
+
+    def test_explode_in_processes_matches_serial(self):
+        exploded = {}
+        logged = {}
+        for workers in (1, 2):
+            core = self.root / str(workers)
+            self._write_core(core)
+            with mock.patch.object(explode.ui.log, "log") as log:
+                explode.explode(str(core), workers=workers)
+            out = core / "library" / "textures.exploded"
+            exploded[workers] = {str(path.relative_to(out)): read_png(path) for path in out.rglob("*.png")}
+            logged[workers] = sorted(call.args[0] for call in log.call_args_list if "vanilla md5" in call.args[0])
+
+        self.assertEqual(sorted(exploded[1]), ["0.png", "0/1.png", "0/3.png", "1.png", "1/2.png"])
+        self.assertEqual(exploded[2], exploded[1])
+        self.assertEqual(exploded[1]["1/2.png"][:2], (3, 2))
+        # the messages of the worker processes reach the log of the parent
+        self.assertEqual(len(logged[2]), 2)
+        self.assertEqual(logged[2], logged[1])
+
+    def test_workers_are_not_handed_the_main_script(self):
+        main = types.ModuleType("__main__")
+        main.__file__ = "/path/to/spacehaven-modloader.py"
+        with mock.patch.dict(sys.modules, {"__main__": main}):
+            with explode._main_script_hidden():
+                self.assertFalse(hasattr(main, "__file__"))
+            self.assertEqual(main.__file__, "/path/to/spacehaven-modloader.py")
+
+
+if __name__ == "__main__":
+    unittest.main()
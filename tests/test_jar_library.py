@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+import lxml.etree
+
+import loader.assets.merge as merge
+from loader.assets.library import JarLibrary
+from tests.test_jarmod_xml import CORE_FILES
+
+
+class JarLibraryTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.jar_path = self.root / "spacehaven.jar"
+        self.core_path = self.root / "core"
+
+        with zipfile.ZipFile(self.jar_path, "w", compression=zipfile.ZIP_DEFLATED) as jar:
+            for name, content in CORE_FILES.items():
+                jar.writestr("library/" + name, content)
+            jar.writestr("library/0.cim", b"not decoded unless a mod touches page 0")
+            jar.writestr("library/sound/ogg/click.ogg", b"click")
+            jar.writestr("library/music/mp3/theme.mp3", b"theme")
+            jar.writestr("fi/bugbyte/Game.class", b"\xca\xfe\xba\xbe")
+
+        self.mod_path = self.root / "mods" / "XmlMod"
+        (self.mod_path / "library").mkdir(parents=True)
+        (self.mod_path / "library" / "haven.xml").write_text("<data><Element><me mid=\"42\"/></Element></data>", encoding="utf-8")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_reads_members_without_extracting(self):
+        with JarLibrary(str(self.jar_path), str(self.core_path)) as library:
+            with library.open("library/haven") as f:
+                self.assertIn(b"<data>", f.read())
+            self.assertEqual(library.namelist("library/sound/"), ["library/sound/ogg/click.ogg"])
+
+        self.assertFalse(self.core_path.exists())
+
+    def test_files_in_core_path_shadow_the_jar(self):
+        (self.core_path / "library").mkdir(parents=True)
+        (self.core_path / "library" / "haven").write_text("<data/>", encoding="utf-8")
+
+        with JarLibrary(str(self.jar_path), str(self.core_path)) as library:
+            with library.open("library/haven") as f:
+                self.assertEqual(f.read(), b"<data/>")
+            self.assertEqual(library.extract("library/0.cim"), str(self.core_path / "library" / "0.cim"))
+
+        self.assertTrue((self.core_path / "library" / "0.cim").is_file())
+
+    def test_xml_only_mods_only_write_xml(self):
+        with JarLibrary(str(self.jar_path), str(self.core_path)) as library:
+            merge.mods(str(self.core_path), [], [str(self.mod_path)], library)
+
+        written = sorted(os.listdir(self.core_path / "library"))
+        self.assertEqual(written, sorted(CORE_FILES))
+        merged = lxml.etree.parse(self.core_path / "library" / "haven")
+        self.assertTrue(merged.xpath("/data/Element/me[@mid='42']"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+import loader.assets.library as library
+
+
+class LibraryPatchTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.jar_path = self.root / "spacehaven.jar"
+        self.result_path = self.root / "spacehaven.patched.jar"
+        self.core_path = self.root / "core"
+
+        with zipfile.ZipFile(self.jar_path, "w") as jar:
+            jar.writestr("fi/bugbyte/Game.class", b"\xca\xfe\xba\xbe" * 1000, compress_type=zipfile.ZIP_DEFLATED)
+            jar.writestr("version.txt", b"0.0.1\n")
+            jar.writestr("library/sound/click.ogg", b"vanilla click")
+            jar.writestr("library/haven", b"<data/>", compress_type=zipfile.ZIP_DEFLATED)
+
+        for filename in library.PATCHABLE_XML_FILES + library.PATCHABLE_CIM_FILES:
+            path = self.core_path / filename
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b"modded " + filename.encode())
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _patch(self, **kwargs):
+        library.patch(str(self.jar_path), str(self.core_path), str(self.result_path), **kwargs)
+        return zipfile.ZipFile(self.result_path, "r")
+
+    def test_raw_copy_keeps_untouched_entries_compressed(self):
+        with self._patch() as patched, zipfile.ZipFile(self.jar_path, "r") as original:
+            self.assertIsNone(patched.testzip())
+            for name in ["fi/bugbyte/Game.class", "version.txt", "library/sound/click.ogg"]:
+                self.assertEqual(patched.read(name), original.read(name))
+                self.assertEqual(patched.getinfo(name).compress_type, original.getinfo(name).compress_type)
+                self.assertEqual(patched.getinfo(name).compress_size, original.getinfo(name).compress_size)
+
+    def test_patchable_files_are_replaced_once(self):
+        with self._patch() as patched:
+            self.assertEqual(patched.namelist().count("library/haven"), 1)
+            self.assertEqual(patched.read("library/haven"), b"modded library/haven")
+
+    def test_extra_assets_replace_vanilla_entries(self):
+        extra = "library/sound/click.ogg"
+        (self.core_path / extra).parent.mkdir(parents=True, exist_ok=True)
+        (self.core_path / extra).write_bytes(b"modded click")
+
+        with self._patch(extra_assets=[extra]) as patched:
+            self.assertEqual(patched.namelist().count(extra), 1)
+            self.assertEqual(patched.read(extra), b"modded click")
+
+    def test_without_raw_copy_matches_raw_copy_content(self):
+        with self._patch(raw_copy=False) as patched:
+            self.assertIsNone(patched.testzip())
+            self.assertEqual(patched.read("version.txt"), b"0.0.1\n")
+            self.assertTrue(os.path.getsize(self.result_path) > 0)
+
+    def test_overlay_contains_only_modified_library_files(self):
+        with zipfile.ZipFile(self.jar_path, "a") as jar:
+            jar.writestr("library/3.cim", b"modded library/3.cim")
+
+        library.overlay(str(self.jar_path), str(self.core_path), str(self.result_path))
+
+        with zipfile.ZipFile(self.result_path, "r") as overlay:
+            names = overlay.namelist()
+            self.assertEqual(set(library.PATCHABLE_XML_FILES) - set(names), set())
+            self.assertNotIn("library/3.cim", names)
+            self.assertIn("library/4.cim", names)
+            self.assertNotIn("fi/bugbyte/Game.class", names)
+
+
+if __name__ == "__main__":
+    unittest.main()
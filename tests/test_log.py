@@ -0,0 +1,68 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+import ui.log
+
+
+class LoggerTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.logger = ui.log.Logger()
+
+    def tearDown(self):
+        self.logger.flush()
+        if self.logger.localLog:
+            self.logger.localLog.close()
+        self.temp_dir.cleanup()
+
+    def _logged_lines(self):
+        self.logger.flush()
+        return (self.root / "modloader" / "logs.txt").read_text().splitlines()
+
+    def test_messages_logged_before_the_game_path_are_written_in_order(self):
+        self.logger.log("before")
+        self.logger.setGameModPath(str(self.root))
+        self.logger.log("after")
+
+        lines = self._logged_lines()
+        self.assertLess(lines.index("before"), lines.index("after"))
+        self.assertEqual(lines[0], "Space Haven Modloader v{}".format(ui.log.version.version))
+
+    def test_flush_writes_messages_from_every_thread(self):
+        self.logger.setGameModPath(str(self.root))
+
+        def _log_many(prefix):
+            for index in range(200):
+                self.logger.log("{} {}".format(prefix, index))
+
+        threads = [threading.Thread(target=_log_many, args=(name,)) for name in "ab"]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        lines = self._logged_lines()
+        for prefix in "ab":
+            own = [line for line in lines if line.startswith(prefix + " ")]
+            self.assertEqual(own, ["{} {}".format(prefix, index) for index in range(200)])
+
+    def test_debug_messages_are_built_lazily(self):
+        self.logger.setGameModPath(str(self.root))
+        built = []
+
+        self.logger.setLevel(ui.log.INFO)
+        self.logger.debug(lambda: built.append("info") or "hidden")
+        self.logger.setLevel(ui.log.DEBUG)
+        self.logger.debug(lambda: built.append("debug") or "shown")
+
+        lines = self._logged_lines()
+        self.assertEqual(built, ["debug"])
+        self.assertIn("shown", lines)
+        self.assertNotIn("hidden", lines)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+import lxml.etree
+
+import loader.assets.merge as merge
+
+
+def parse(text):
+    return lxml.etree.ElementTree(lxml.etree.fromstring(text))
+
+
+class MergeIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.core = {"library/texts": parse("<t><l id=\"1\">one</l><l id=\"2\">two</l><l id=\"3\">three</l></t>")}
+
+    def _merge(self, *mod_texts):
+        mod = {"library/texts": [parse(text) for text in mod_texts]}
+        merge.mergeDefinitions(self.core, mod, "library/texts", "/t", "id")
+
+    def _texts(self):
+        return [(e.get("id"), e.text) for e in self.core["library/texts"].getroot()]
+
+    def test_conflicts_are_replaced_and_new_ids_appended(self):
+        self._merge("<t><l id=\"2\">deux</l><l id=\"4\">quatre</l></t>")
+
+        self.assertEqual(self._texts(), [("1", "one"), ("3", "three"), ("2", "deux"), ("4", "quatre")])
+
+    def test_index_is_reused_and_kept_up_to_date_across_mods(self):
+        self._merge("<t><l id=\"4\">four</l></t>")
+        self._merge("<t><l id=\"4\">vier</l><l id=\"1\">eins</l></t>", "<t><l id=\"4\">quatre</l></t>")
+
+        self.assertEqual(self._texts(), [("2", "two"), ("3", "three"), ("1", "eins"), ("4", "quatre")])
+        self.assertEqual(len(self.core["_merge_indexes"]), 1)
+
+    def test_ids_with_quotes_do_not_break_the_merge(self):
+        self._merge("<t><l id=\"it's\">quoted</l><l id=\"it's\">again</l></t>")
+
+        self.assertEqual(self._texts()[-1], ("it's", "again"))
+        self.assertEqual(len(self._texts()), 4)
+
+    def test_elements_without_an_id_are_all_kept(self):
+        self._merge("<t><l>a</l><l>b</l></t>", "<t><l>c</l></t>")
+
+        self.assertEqual(self._texts()[3:], [(None, "a"), (None, "b"), (None, "c")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+from unittest import mock
+
+import lxml.etree
+
+import loader.assets.patch as patch
+import ui.log
+
+
+class FakeMod:
+    name = "PatchMod"
+    variables = []
+
+
+def parse(text):
+    return lxml.etree.ElementTree(lxml.etree.fromstring(text))
+
+
+PATCHES = """<Patch>
+    <Operation Class="AttributeSet">
+        <xpath>/data/Element/me[@mid='1']</xpath>
+        <attribute>hp</attribute>
+        <value>10</value>
+    </Operation>
+    <Operation Class="AttributeMath">
+        <xpath>/data/Element/me[@mid='1']</xpath>
+        <attribute>hp</attribute>
+        <value opType="multiply">3</value>
+    </Operation>
+</Patch>"""
+
+
+class PatchTests(unittest.TestCase):
+    def setUp(self):
+        patch.compileXPath.cache_clear()
+        self.core = {"library/haven": parse("<data><Element><me mid=\"1\"/><me mid=\"2\"/></Element></data>")}
+
+    def test_repeated_xpath_is_compiled_once(self):
+        patch.doPatches(self.core, {"library/haven": [parse(PATCHES)]}, FakeMod())
+
+        element = self.core["library/haven"].xpath("/data/Element/me[@mid='1']")[0]
+        self.assertEqual(element.get("hp"), "30")
+        info = patch.compileXPath.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+
+    def test_cache_stats_only_count_the_current_pass(self):
+        patches = {"library/haven": [parse(PATCHES)]}
+        patch.doPatches(self.core, patches, FakeMod())
+
+        since = patch.compileXPath.cache_info()
+        patch.doPatches(self.core, patches, FakeMod())
+        with mock.patch.object(ui.log, "log") as log:
+            patch.logXPathCacheStats(since)
+
+        log.assert_called_once_with("  XPath cache: 2/2 hits (100.0%), 1 expressions cached")
+
+    def test_invalid_xpath_fails_the_patch(self):
+        bad = parse("<Patch><Operation Class=\"NodeRemove\"><xpath>/data/[</xpath></Operation></Patch>")
+
+        with self.assertRaises(SyntaxError):
+            patch.doPatches(self.core, {"library/haven": [bad]}, FakeMod())
+
+    def test_detailed_dump_is_only_built_for_debug_logging(self):
+        patches = {"library/haven": [parse(PATCHES)]}
+        previous_level = ui.log.logger.level
+        self.addCleanup(ui.log.logger.setLevel, previous_level)
+
+        with mock.patch.object(patch, "describePatch", wraps=patch.describePatch) as describe:
+            ui.log.logger.setLevel(ui.log.INFO)
+            patch.doPatches(self.core, patches, FakeMod())
+            self.assertEqual(describe.call_count, 0)
+
+            ui.log.logger.setLevel(ui.log.DEBUG)
+            patch.doPatches(self.core, patches, FakeMod())
+            self.assertEqual(describe.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
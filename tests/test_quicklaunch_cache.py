@@ -1,3 +1,4 @@
+import json
 import os
 import sys
 import tempfile
@@ -64,6 +65,111 @@ class QuickLaunchCacheTests(unittest.TestCase):
         self.assertTrue(current_file.exists())
         self.assertEqual(len(loader.load.quick_launch_files(str(self.jar_path))), 10)
 
+    def test_overlay_quicklaunch_file_is_distinct_from_full_jar(self):
+        full = loader.load.quick_launch_filename("abc", str(self.jar_path))
+        overlay = loader.load.quick_launch_filename("abc", str(self.jar_path), loader.load.LOAD_MODE_OVERLAY)
+
+        self.assertNotEqual(full, overlay)
+        Path(overlay).write_text("overlay", encoding="utf-8")
+        self.assertIn(overlay, loader.load.quick_launch_files(str(self.jar_path)))
+
+    def test_overlay_is_added_before_spacehaven_and_removed_on_unload(self):
+        config_path = self.game_dir / "config.json"
+        config_path.write_text(json.dumps({"classPath": ["other.jar", "spacehaven.jar"]}), encoding="utf-8")
+        self.jar_path.write_text("jar", encoding="utf-8")
+        Path(loader.load.overlay_jar_path(str(self.jar_path))).write_text("overlay", encoding="utf-8")
+
+        loader.load.enable_overlay(str(self.jar_path))
+        loader.load.enable_overlay(str(self.jar_path))
+        classPath = json.loads(config_path.read_text(encoding="utf-8"))["classPath"]
+        self.assertEqual(classPath, ["other.jar", loader.load.OVERLAY_JAR_FILENAME, "spacehaven.jar"])
+
+        loader.load.unload(str(self.jar_path))
+        classPath = json.loads(config_path.read_text(encoding="utf-8"))["classPath"]
+        self.assertEqual(classPath, ["other.jar", "spacehaven.jar"])
+        self.assertFalse(os.path.exists(loader.load.overlay_jar_path(str(self.jar_path))))
+        self.assertTrue(self.jar_path.exists())
+
+    def test_place_file_prefers_a_hardlink(self):
+        src = self.root / "src.jar"
+        src.write_text("jar", encoding="utf-8")
+        dst = self.root / "dst.jar"
+        dst.write_text("old", encoding="utf-8")
+
+        method = loader.load.place_file(str(src), str(dst))
+
+        self.assertEqual(method, "hardlink")
+        self.assertTrue(os.path.samefile(src, dst))
+
+    def test_place_file_falls_back_to_a_copy(self):
+        src = self.root / "src.jar"
+        src.write_text("jar", encoding="utf-8")
+        dst = self.root / "dst.jar"
+
+        with patch("loader.load.os.link", side_effect=OSError("not supported")), patch("loader.load._reflink", return_value=False):
+            method = loader.load.place_file(str(src), str(dst))
+
+        self.assertEqual(method, "copy")
+        self.assertEqual(dst.read_text(encoding="utf-8"), "jar")
+        self.assertFalse(os.path.samefile(src, dst))
+
+    def test_quickload_swaps_jar_and_unload_restores_it(self):
+        self.jar_path.write_text("vanilla", encoding="utf-8")
+        cached = Path(loader.load.quick_launch_filename("abc", str(self.jar_path)))
+        cached.write_text("modded", encoding="utf-8")
+
+        loader.load.quickload(str(self.jar_path), "abc")
+        self.assertEqual(self.jar_path.read_text(encoding="utf-8"), "modded")
+        self.assertEqual(Path(str(self.jar_path) + ".vanilla").read_text(encoding="utf-8"), "vanilla")
+
+        loader.load.unload(str(self.jar_path))
+        self.assertEqual(self.jar_path.read_text(encoding="utf-8"), "vanilla")
+        self.assertEqual(cached.read_text(encoding="utf-8"), "modded")
+        self.assertFalse(os.path.exists(str(self.jar_path) + ".vanilla"))
+
+    def _write_cached(self, signature, size, mtime):
+        path = Path(loader.load.quick_launch_filename(signature, str(self.jar_path)))
+        path.write_bytes(b"x" * size)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_prune_evicts_least_recently_used_until_within_budget(self):
+        oldest = self._write_cached("a", 10, 1)
+        middle = self._write_cached("b", 10, 2)
+        newest = self._write_cached("c", 10, 3)
+        # quickloading the oldest file makes it the most recently used
+        loader.load.record_quick_launch_use(str(self.jar_path), "a")
+
+        removed = loader.load.prune_quick_launch_cache(str(self.jar_path), budget=15)
+
+        self.assertEqual(removed, 2)
+        self.assertTrue(oldest.exists())
+        self.assertFalse(middle.exists())
+        self.assertFalse(newest.exists())
+
+    def test_pinned_files_are_never_evicted(self):
+        pinned = self._write_cached("a", 10, 1)
+        other = self._write_cached("b", 10, 2)
+        loader.load.pin_quick_launch(str(self.jar_path), "a")
+
+        loader.load.prune_quick_launch_cache(str(self.jar_path), budget=5)
+
+        self.assertTrue(pinned.exists())
+        self.assertFalse(other.exists())
+        self.assertEqual(loader.load.quick_launch_stats(str(self.jar_path))["pinned"], [pinned.name])
+
+    def test_stats_persist_hits_misses_and_budget(self):
+        self._write_cached("a", 10, 1)
+        loader.load.record_quick_launch_use(str(self.jar_path), "a", hit=False)
+        loader.load.record_quick_launch_use(str(self.jar_path), "a")
+        loader.load.record_quick_launch_use(str(self.jar_path), "a")
+        loader.load.set_quick_launch_budget(str(self.jar_path), 1024)
+
+        stats = loader.load.quick_launch_stats(str(self.jar_path))
+
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 1))
+        self.assertEqual((stats["files"], stats["bytes"], stats["budget"]), (1, 10, 1024))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import loader.assets.moddigest as moddigest
+import loader.signature as signature
+
+
+class FakeVar:
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+
+class FakeMod:
+    def __init__(self, path, variables=()):
+        self.path = str(path)
+        self.variables = list(variables)
+
+
+class SignatureTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.jar_path = self.root / "spacehaven.jar"
+        self.jar_path.write_bytes(b"vanilla jar")
+        self.cache_dir = self.root / "mods" / "modloader"
+        self.cache_dir.mkdir(parents=True)
+
+        self.first = self._make_mod("FirstMod", [FakeVar("HP", 1)])
+        self.second = self._make_mod("SecondMod")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _make_mod(self, name, variables=()):
+        mod_path = self.root / "mods" / name
+        (mod_path / "library").mkdir(parents=True)
+        (mod_path / "info.xml").write_text("<mod><name>{}</name><version>1</version></mod>".format(name), encoding="utf-8")
+        (mod_path / "library" / "haven.xml").write_text("<data/>", encoding="utf-8")
+        return FakeMod(mod_path, variables)
+
+    def _signature(self, mods=None):
+        return signature.signature(str(self.jar_path), mods or [self.first, self.second], str(self.cache_dir))
+
+    def test_same_inputs_give_the_same_signature(self):
+        self.assertEqual(self._signature(), self._signature())
+
+    def test_file_edit_without_version_bump_changes_signature(self):
+        before = self._signature()
+        (Path(self.second.path) / "library" / "haven.xml").write_text("<data><Element/></data>", encoding="utf-8")
+
+        self.assertNotEqual(self._signature(), before)
+
+    def test_config_values_load_order_and_jar_change_signature(self):
+        before = self._signature()
+
+        self.first.variables[0].value = 2
+        self.assertNotEqual(self._signature(), before)
+        self.first.variables[0].value = 1
+
+        self.assertNotEqual(self._signature([self.second, self.first]), before)
+
+        self.jar_path.write_bytes(b"updated jar")
+        self.assertNotEqual(self._signature(), before)
+
+    def test_files_written_by_the_loader_are_ignored(self):
+        before = self._signature()
+        (Path(self.first.path) / "custom_texture_42.png").write_bytes(b"png")
+        (Path(self.first.path) / "library" / "generated_textures.xml").write_text("<t/>", encoding="utf-8")
+
+        self.assertEqual(self._signature(), before)
+
+    def test_unchanged_files_are_not_hashed_again(self):
+        # pretend every file is old enough for its mtime to be trusted
+        with mock.patch.object(moddigest, "RACY_MTIME_SECONDS", -1):
+            before = self._signature()
+            with mock.patch.object(signature.hashlib, "sha1", wraps=signature.hashlib.sha1) as sha1:
+                self.assertEqual(self._signature(), before)
+
+        # one digest per mod tree and one for the signature itself, no file digests
+        self.assertEqual(sha1.call_count, 3)
+        self.assertTrue(os.path.isfile(self.cache_dir / moddigest.DIGEST_CACHE_FILENAME))
+
+    def test_cached_only_signature_reads_no_file(self):
+        with mock.patch.object(moddigest, "RACY_MTIME_SECONDS", -1):
+            with mock.patch.object(moddigest, "open", side_effect=AssertionError, create=True):
+                self.assertIsNone(signature.signature(str(self.jar_path), [self.first], str(self.cache_dir), cachedOnly=True))
+            full = signature.signature(str(self.jar_path), [self.first], str(self.cache_dir))
+            cached = signature.signature(str(self.jar_path), [self.first], str(self.cache_dir), cachedOnly=True)
+
+        self.assertEqual(cached, full)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+import loader.assets.merge as merge
+import loader.assets.moddigest as moddigest
+import loader.assets.snapshot as snapshot
+from loader.assets.library import JarLibrary
+from tests.test_jarmod_xml import CORE_FILES
+
+PATCHES = """<Patch>
+    <Operation Class="AttributeSet">
+        <xpath>/data/Element/me[@mid='{mid}']</xpath>
+        <attribute>hp</attribute>
+        <value>HP</value>
+    </Operation>
+</Patch>"""
+
+
+class FakeVar:
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+
+class FakeMod:
+    def __init__(self, path, hp):
+        self.path = str(path)
+        self.name = os.path.basename(self.path)
+        self.variables = [FakeVar("HP", hp)]
+
+
+class SnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.jar_path = self.root / "spacehaven.jar"
+        self.snapshot_dir = self.root / "mods" / "modloader" / snapshot.SNAPSHOT_DIRNAME
+        self.digest_cache_path = None
+
+        with zipfile.ZipFile(self.jar_path, "w", compression=zipfile.ZIP_DEFLATED) as jar:
+            jar.writestr("version.txt", "0.14.1\nalpha 14\n")
+            for name, content in CORE_FILES.items():
+                jar.writestr("library/" + name, content)
+
+        self.mods = [self._make_mod("FirstMod", 10, hp=1), self._make_mod("SecondMod", 20, hp=2), self._make_mod("ThirdMod", 30, hp=3)]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _make_mod(self, name, mid, hp):
+        mod_path = self.root / "mods" / name
+        (mod_path / "library").mkdir(parents=True)
+        (mod_path / "patches").mkdir()
+        (mod_path / "library" / "haven.xml").write_text("<data><Element><me mid=\"{}\"/></Element></data>".format(mid), encoding="utf-8")
+        (mod_path / "patches" / "haven.xml").write_text(PATCHES.format(mid=mid), encoding="utf-8")
+        return FakeMod(mod_path, hp)
+
+    def _merge(self, snapshots=True):
+        core_path = tempfile.mkdtemp(dir=self.root)
+        with mock.patch.object(merge, "doMerges", wraps=merge.doMerges) as doMerges, mock.patch.object(merge, "doPatches", wraps=merge.doPatches) as doPatches:
+            with JarLibrary(str(self.jar_path), core_path) as library:
+                merge.mods(core_path, self.mods, [mod.path for mod in self.mods], library, snapshot_dir=str(self.snapshot_dir) if snapshots else None, digest_cache_path=self.digest_cache_path)
+
+        replayed = [os.path.basename(call.args[2]) for call in doMerges.call_args_list]
+        replayed += [call.args[2].name for call in doPatches.call_args_list]
+        haven = Path(core_path, "library", "haven").read_bytes()
+        return replayed, haven
+
+    def test_unchanged_load_order_replays_nothing(self):
+        self._merge()
+
+        replayed, haven = self._merge()
+
+        self.assertEqual(replayed, [])
+        self.assertEqual(haven, self._merge(snapshots=False)[1])
+
+    def test_resumes_after_the_unchanged_prefix(self):
+        self._merge()
+        (Path(self.mods[1].path) / "library" / "haven.xml").write_text("<data><Element><me mid=\"21\"/></Element></data>", encoding="utf-8")
+
+        replayed, haven = self._merge()
+
+        self.assertEqual(replayed, ["SecondMod", "ThirdMod", "FirstMod", "SecondMod", "ThirdMod"])
+        self.assertEqual(haven, self._merge(snapshots=False)[1])
+
+    def test_changed_variable_only_replays_patches_from_that_mod(self):
+        self._merge()
+        self.mods[2].variables[0].value = 33
+
+        replayed, haven = self._merge()
+
+        self.assertEqual(replayed, ["ThirdMod"])
+        self.assertIn(b'hp="33"', haven)
+        self.assertEqual(haven, self._merge(snapshots=False)[1])
+
+    def test_saving_the_config_to_info_xml_only_replays_patches(self):
+        self._merge()
+        # the database writes the variable values back to info.xml on every config change
+        self.mods[1].variables[0].value = 22
+        (Path(self.mods[1].path) / "info.xml").write_text("<mod><config><var name=\"HP\" value=\"22\"/></config></mod>", encoding="utf-8")
+
+        replayed, haven = self._merge()
+
+        self.assertEqual(replayed, ["SecondMod", "ThirdMod"])
+        self.assertEqual(haven, self._merge(snapshots=False)[1])
+
+    def test_moved_mod_is_merged_again(self):
+        self._merge()
+        moved = self.root / "elsewhere" / "ThirdMod"
+        moved.parent.mkdir()
+        os.rename(self.mods[2].path, moved)
+        self.mods[2].path = str(moved)
+
+        replayed, haven = self._merge()
+
+        self.assertEqual(replayed, ["ThirdMod", "FirstMod", "SecondMod", "ThirdMod"])
+        self.assertEqual(haven, self._merge(snapshots=False)[1])
+
+    def test_unchanged_mod_files_are_not_hashed_again(self):
+        self.snapshot_dir.parent.mkdir()
+        self.digest_cache_path = str(self.snapshot_dir.parent / moddigest.DIGEST_CACHE_FILENAME)
+        # pretend every file is old enough for its mtime to be trusted
+        with mock.patch.object(moddigest, "RACY_MTIME_SECONDS", -1):
+            self._merge()
+            with mock.patch.object(moddigest, "hashlib", wraps=moddigest.hashlib) as hashlib:
+                replayed, _ = self._merge()
+
+        self.assertEqual(replayed, [])
+        # a merge and a patch digest per mod, no file digests
+        self.assertEqual(hashlib.sha1.call_count, 2 * len(self.mods))
+
+    def test_prune_keeps_only_the_current_load_order(self):
+        self._merge()
+        self.mods.pop()
+        self._merge()
+
+        indexes = [entry for entry in os.listdir(self.snapshot_dir) if entry.endswith(".json")]
+        self.assertEqual(len(indexes), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
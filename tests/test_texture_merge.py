@@ -0,0 +1,192 @@
+import os
+import struct
+import tempfile
+import unittest
+import zipfile
+import zlib
+from pathlib import Path
+from unittest import mock
+
+import lxml.etree
+import png
+
+import loader.assets.atlas as atlas
+import loader.assets.codec as codec
+import loader.assets.merge as merge
+import loader.assets.regionindex as regionindex
+from loader.assets.explode import HEADER_SIZE, PIXEL_SIZE, RGBA_FORMAT
+from loader.assets.library import JarLibrary
+from tests.test_jarmod_xml import CORE_FILES
+
+PAGE_SIZE = 4
+
+CORE_TEXTURES = (
+    "<AllTexturesAndRegions><textures></textures><regions>"
+    "<re n=\"100\" t=\"0\" x=\"0\" y=\"0\" w=\"1\" h=\"1\"/>"
+    "<re n=\"101\" t=\"1\" x=\"0\" y=\"0\" w=\"1\" h=\"1\"/>"
+    "</regions></AllTexturesAndRegions>"
+)
+
+
+def write_cim(path, fill):
+    header = struct.pack(">3i", PAGE_SIZE, PAGE_SIZE, RGBA_FORMAT)
+    path.write_bytes(zlib.compress(header + bytes(fill) * PAGE_SIZE * PAGE_SIZE))
+
+
+def read_cim_pixel(path, x, y):
+    data = zlib.decompress(path.read_bytes())
+    start = HEADER_SIZE + (x + y * PAGE_SIZE) * PIXEL_SIZE
+    return tuple(data[start:start + PIXEL_SIZE])
+
+
+def write_png(path, pixel):
+    with open(path, "wb") as f:
+        png.Writer(width=1, height=1, greyscale=False, alpha=True).write(f, [list(pixel)])
+
+
+class TextureMergeTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+
+        self.core_path = self.root / "core"
+        core_library = self.core_path / "library"
+        core_library.mkdir(parents=True)
+        for name, content in dict(CORE_FILES, textures=CORE_TEXTURES).items():
+            (core_library / name).write_text(content, encoding="utf-8")
+        write_cim(core_library / "0.cim", (0, 0, 0, 255))
+        write_cim(core_library / "1.cim", (0, 0, 0, 255))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _make_texture_mod(self, regions):
+        mod_path = self.root / "mods" / "TextureMod"
+        (mod_path / "library").mkdir(parents=True)
+        (mod_path / "textures").mkdir()
+        (mod_path / "library" / "animations.xml").write_text("<AllAnimations><animations/></AllAnimations>", encoding="utf-8")
+        # regions named after the texture file override the core region with the same id
+        res = "".join("<re n=\"{}.png\" t=\"{}\" x=\"0\" y=\"0\" w=\"1\" h=\"1\"/>".format(name, page) for name, page, _ in regions)
+        (mod_path / "library" / "textures.xml").write_text(
+            "<AllTexturesAndRegions><textures/><regions>{}</regions></AllTexturesAndRegions>".format(res), encoding="utf-8"
+        )
+        for name, _, pixel in regions:
+            write_png(mod_path / "textures" / "{}.png".format(name), pixel)
+        return mod_path
+
+    def _assert_repacked(self, workers):
+        mod_path = self._make_texture_mod([("100", "0", (255, 0, 0, 255)), ("101", "1", (0, 255, 0, 255))])
+
+        merge.mods(str(self.core_path), [], [str(mod_path)], texture_workers=workers)
+
+        self.assertEqual(read_cim_pixel(self.core_path / "library" / "0.cim", 0, 0), (255, 0, 0, 255))
+        self.assertEqual(read_cim_pixel(self.core_path / "library" / "1.cim", 0, 0), (0, 255, 0, 255))
+        self.assertEqual(read_cim_pixel(self.core_path / "library" / "0.cim", 1, 0), (0, 0, 0, 255))
+
+    def test_modded_regions_are_repacked_serially(self):
+        self._assert_repacked(workers=1)
+
+    def test_modded_regions_are_repacked_in_parallel(self):
+        self._assert_repacked(workers=2)
+
+    def test_zero_workers_repack_serially(self):
+        self._assert_repacked(workers=0)
+
+    def _make_sprite_mods(self):
+        mods = []
+        for index, pixel in enumerate([(255, 0, 0, 255), (0, 0, 255, 255)]):
+            mod_path = self.root / "mods" / "SpriteMod{}".format(index)
+            (mod_path / "library").mkdir(parents=True)
+            (mod_path / "textures").mkdir()
+            animation = "<animation n=\"SpriteMod{0}\"><assetPos filename=\"sprite{0}\"/></animation>".format(index)
+            (mod_path / "library" / "animations.xml").write_text("<AllAnimations><animations>{}</animations></AllAnimations>".format(animation), encoding="utf-8")
+            write_png(mod_path / "textures" / "sprite{}.png".format(index), pixel)
+            mods.append(str(mod_path))
+        return mods
+
+    def test_generated_regions_of_all_mods_share_a_page(self):
+        mods = self._make_sprite_mods()
+
+        extra_assets = merge.mods(str(self.core_path), [], mods)
+
+        textures = lxml.etree.parse(str(self.core_path / "library" / "textures"))
+        self.assertEqual(textures.xpath("//textures/t/@i"), ["24"])
+        regions = textures.xpath("//re[@t='24']")
+        self.assertEqual([(region.get("n"), region.get("file")) for region in regions], [("102", "sprite0.png"), ("103", "sprite1.png")])
+        self.assertIn("library/24.cim", extra_assets)
+
+        page = self.core_path / "library" / "24.cim"
+        for region, pixel in zip(regions, [(255, 0, 0, 255), (0, 0, 255, 255)]):
+            data = zlib.decompress(page.read_bytes())
+            start = HEADER_SIZE + (int(region.get("x")) + int(region.get("y")) * atlas.PAGE_SIZE) * PIXEL_SIZE
+            self.assertEqual(tuple(data[start : start + PIXEL_SIZE]), pixel)
+
+    def test_patched_page_colliding_with_a_generated_page_is_an_error(self):
+        mods = self._make_sprite_mods()
+        patches = Path(mods[1]) / "patches"
+        patches.mkdir()
+        (patches / "textures.xml").write_text(
+            '<Patch><Operation Class="Add"><xpath>/AllTexturesAndRegions/textures</xpath><value><t i="24" w="4" h="4"/></value></Operation></Patch>', encoding="utf-8"
+        )
+        patcher = mock.Mock(path=mods[1], variables=[])
+        patcher.name = "SpriteMod1"
+
+        with self.assertRaisesRegex(Exception, "ids used by more than one page: 24"):
+            merge.mods(str(self.core_path), [patcher], mods)
+
+    def test_generated_pages_are_reused_from_the_atlas_cache(self):
+        mods = self._make_sprite_mods()
+        atlas_dir = self.root / "atlas"
+        merge.mods(str(self.core_path), [], mods, atlas_dir=str(atlas_dir))
+        page = (self.core_path / "library" / "24.cim").read_bytes()
+        (self.core_path / "library" / "24.cim").unlink()
+        # the merge wrote its textures over the vanilla ones
+        (self.core_path / "library" / "textures").write_text(CORE_TEXTURES, encoding="utf-8")
+
+        with mock.patch.object(atlas, "pack") as pack, mock.patch.object(merge, "Texture", wraps=merge.Texture) as texture:
+            merge.mods(str(self.core_path), [], mods, atlas_dir=str(atlas_dir))
+
+        pack.assert_not_called()
+        # only the vanilla pages the mods don't touch stay unread
+        texture.assert_not_called()
+        self.assertEqual((self.core_path / "library" / "24.cim").read_bytes(), page)
+        self.assertFalse((Path(mods[0]) / "library" / "generated_textures.xml").exists())
+
+    def test_texture_debug_writes_pages_and_generated_textures(self):
+        mods = self._make_sprite_mods()
+        debug_dir = self.root / "texture_debug"
+
+        with mock.patch.dict(os.environ, {atlas.DEBUG_ENV: "1"}):
+            merge.mods(str(self.core_path), [], mods, atlas_dir=str(self.root / "atlas"), texture_debug_dir=str(debug_dir))
+
+        self.assertEqual(codec.read_size(str(debug_dir / "24.png")), (atlas.PAGE_SIZE, atlas.PAGE_SIZE))
+        regions = lxml.etree.parse(str(debug_dir / atlas.DEBUG_TEXTURES_FILENAME)).xpath("//re")
+        self.assertEqual([(region.get("n"), region.get("t"), region.get("path")) for region in regions], [("102", "24", str(Path(mods[0]) / "textures" / "sprite0.png")), ("103", "24", str(Path(mods[1]) / "textures" / "sprite1.png"))])
+        self.assertFalse((Path(mods[0]) / "library" / "generated_textures.xml").exists())
+
+    def test_regions_identical_to_vanilla_leave_their_page_alone(self):
+        jar_path = self.root / "spacehaven.jar"
+        with zipfile.ZipFile(jar_path, "w") as jar:
+            jar.writestr("version.txt", "0.14.1\nalpha 14\n")
+            for name in sorted(set(CORE_FILES) | {"textures", "0.cim", "1.cim"}):
+                jar.write(self.core_path / "library" / name, "library/" + name)
+        core_path = self.root / "modded"
+        core_path.mkdir()
+        cache_dir = self.root / "core_cache"
+        # region 100 is a re-export of the vanilla sprite
+        mod_path = self._make_texture_mod([("100", "0", (0, 0, 0, 255)), ("101", "1", (0, 255, 0, 255))])
+
+        for run in range(2):
+            patcher = mock.patch.object(regionindex.Texture, "from_file", wraps=regionindex.Texture.from_file)
+            with JarLibrary(str(jar_path), str(core_path)) as library, patcher as from_file:
+                merge.mods(str(core_path), [], [str(mod_path)], library, core_cache_dir=str(cache_dir))
+
+            self.assertFalse((core_path / "library" / "0.cim").exists())
+            self.assertEqual(read_cim_pixel(core_path / "library" / "1.cim", 0, 0), (0, 255, 0, 255))
+            # vanilla regions are only hashed on the first run
+            self.assertEqual(from_file.call_count, 2 if run == 0 else 0)
+            (core_path / "library" / "1.cim").unlink()
+
+
+if __name__ == "__main__":
+    unittest.main()
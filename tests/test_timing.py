@@ -0,0 +1,106 @@
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import loader.timing as timing
+
+
+@timing.timed("work", mod=lambda name: name)
+def work(name):
+    with timing.span("inner"):
+        return name.upper()
+
+
+class TimingTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.report_dir = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _report(self):
+        with open(os.path.join(self.report_dir, timing.TIMING_REPORT_FILENAME), encoding="utf-8") as f:
+            return json.load(f)
+
+    def test_spans_outside_a_session_are_free(self):
+        self.assertEqual(work("a"), "A")
+        self.assertIsNone(timing._active)
+
+    def test_session_reports_stages_and_mods(self):
+        with timing.session("load", self.report_dir):
+            work("FirstMod")
+            work("SecondMod")
+            thread = threading.Thread(target=work, args=("ThreadMod",))
+            thread.start()
+            thread.join()
+
+        report = self._report()
+        self.assertEqual(report["stages"]["work"]["count"], 3)
+        self.assertEqual(report["stages"]["load"]["count"], 1)
+        # nested spans without a mod of their own are attributed to the enclosing one
+        self.assertEqual(set(report["mods"]), {"FirstMod", "SecondMod", "ThreadMod"})
+        self.assertIn("inner", report["mods"]["FirstMod"])
+        inner = [span for span in report["spans"] if span["name"] == "inner" and span["mod"] == "FirstMod"][0]
+        self.assertEqual((inner["parent"], inner["depth"]), ("work", 2))
+        self.assertTrue(all(span["wall"] >= 0 and span["cpu"] >= 0 for span in report["spans"]))
+
+    def test_nested_session_becomes_a_span(self):
+        with timing.session("load", self.report_dir):
+            with timing.session("build", os.path.join(self.report_dir, "elsewhere")):
+                work("Mod")
+
+        self.assertEqual(self._report()["stages"]["build"]["count"], 1)
+        self.assertFalse(os.path.exists(os.path.join(self.report_dir, "elsewhere")))
+
+    def test_counters_add_up_per_span_and_per_mod(self):
+        with timing.session("load", self.report_dir):
+            timing.name_mod("Slow", "SlowPatcher")
+            with timing.span("doPatches", mod="Slow"):
+                with timing.span(timing.PATCH_FILE_STAGE, detail="patches/haven.xml"):
+                    timing.count("xpath_matches", 3)
+                    timing.count("xpath_matches", 4)
+                time.sleep(0.01)
+            with timing.span("buildLibrary", mod="Fast"):
+                timing.count("texture_bytes", 100)
+            timing.count("audio_bytes", 50, mod="Fast")
+            timing.count("files")
+
+        report = self._report()
+        self.assertEqual(report["counters"], {"files": 1})
+        self.assertEqual([(row["mod"], row["name"]) for row in report["mod_costs"]], [("Slow", "SlowPatcher"), ("Fast", "Fast")])
+        slow, fast = report["mod_costs"]
+        self.assertEqual(slow["xpath_matches"], 7)
+        self.assertEqual(slow["total"], slow["patch"])
+        self.assertEqual([(patch["file"], patch["xpath_matches"]) for patch in slow["patch_files"]], [("patches/haven.xml", 7)])
+        self.assertEqual((fast["texture_bytes"], fast["audio_bytes"]), (100, 50))
+
+        lines = timing.format_mod_costs(report["mod_costs"], patch_files=True)
+        self.assertEqual(lines[1].split()[:2], ["1", "SlowPatcher"])
+        self.assertIn("patches/haven.xml", lines[2])
+        self.assertEqual(lines[3].split()[:2], ["2", "Fast"])
+
+    def test_report_is_written_when_the_session_fails(self):
+        with self.assertRaises(ValueError):
+            with timing.session("load", self.report_dir):
+                raise ValueError("broken mod")
+
+        self.assertIn("load", self._report()["stages"])
+        self.assertIsNone(timing._active)
+
+    def test_profile_is_dumped_when_enabled(self):
+        with mock.patch.dict(os.environ, {timing.PROFILE_ENV: "1"}):
+            with timing.session("load", self.report_dir):
+                work("Mod")
+
+        stats = pstats.Stats(os.path.join(self.report_dir, timing.PROFILE_FILENAME))
+        self.assertTrue(any(function[2] == "work" for function in stats.stats))
+
+
+if __name__ == "__main__":
+    unittest.main()
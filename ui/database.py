@@ -201,6 +201,32 @@ def _write_json_file(path, jsonObj):
     os.replace(tmp_path, path)
 
 
+def add_classpath_entry(configPath, entry):
+    """Put `entry` on the config.json classPath just ahead of spacehaven.jar"""
+    with open(configPath, "r", encoding="utf-8") as configFile:
+        jsonObj = json.load(configFile)
+    classPath = jsonObj.setdefault("classPath", [])
+    if entry in classPath:
+        return False
+    _insert_before_spacehaven(classPath, entry)
+    _write_json_file(configPath, jsonObj)
+    return True
+
+
+def remove_classpath_entry(configPath, entry):
+    """Drop `entry` from the config.json classPath, returns whether it was present"""
+    if not os.path.isfile(configPath):
+        return False
+    with open(configPath, "r", encoding="utf-8") as configFile:
+        jsonObj = json.load(configFile)
+    classPath = jsonObj.get("classPath", [])
+    if entry not in classPath:
+        return False
+    jsonObj["classPath"] = [value for value in classPath if value != entry]
+    _write_json_file(configPath, jsonObj)
+    return True
+
+
 class ModDatabase:
     """Information about a collection of mods"""
 
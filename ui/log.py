@@ -1,17 +1,40 @@
+import atexit
 import os
+import queue
 import sys
+import threading
+import time
 
 import version
 
+DEBUG = 10
+INFO = 20
+LEVELS = {"debug": DEBUG, "info": INFO}
+
+# queued by flush() to make the writer thread write out what it has collected right away
+_FLUSH = object()
+
 
 class Logger:
-    """Logger that writes to the modloader diagnostics folder once the game is located."""
+    """Logger that writes to the modloader diagnostics folder once the game is located.
+
+    Messages are handed to a writer thread which writes them in batches, at most `flushInterval` seconds apart.
+    """
+
+    flushInterval = 0.5
 
     def __init__(self):
+        self.queue = queue.Queue()
+        self.lock = threading.RLock()
+        self.writer = None
         self.gameLog = None
         self.localLog = None
         self.localPath = None
         self.bufferedMessages = []
+        # whether messages are also printed to stdout
+        self.echo = True
+        # MODLOADER_LOG_LEVEL=debug brings back the per-operation merge and patch dumps
+        self.level = LEVELS.get(os.environ.get("MODLOADER_LOG_LEVEL", "info").strip().lower(), INFO)
 
         print("Buffering logs until the Space Haven folder is detected...")
 
@@ -22,6 +45,16 @@ class Logger:
         os.makedirs(dataDir, exist_ok=True)
         newPath = os.path.join(dataDir, "logs.txt")
 
+        # messages logged so far belong to the previous file (or the startup buffer)
+        self.flush()
+
+        with self.lock:
+            self._switchLocalLog(newPath)
+
+        self.logInitialInfo()
+        self.log("Logging to {}".format(self.localPath))
+
+    def _switchLocalLog(self, newPath):
         if self.localPath is None or os.path.abspath(newPath) != os.path.abspath(self.localPath):
             try:
                 if self.localLog:
@@ -43,25 +76,84 @@ class Logger:
                 pass
             self.gameLog = None
 
-        self.logInitialInfo()
-        self.log("Logging to {}".format(self.localPath))
-
     def logInitialInfo(self):
         self.log("Space Haven Modloader v{}".format(version.version))
         self.log(f"version defined by {version.source}")
         self.log(f"Python: {sys.implementation.name} {sys.version}")
 
-    def log(self, message=""):
-        print("[LOG] {}".format(message))
-        if self.localLog:
-            self.localLog.write(message + "\n")
-            self.localLog.flush()
-        else:
-            self.bufferedMessages.append(message)
+    def setLevel(self, level):
+        self.level = level
+
+    def isEnabledFor(self, level):
+        return level >= self.level
+
+    def log(self, message="", level=INFO):
+        if level < self.level:
+            return
+
+        if self.writer is None:
+            self._startWriter()
+        self.queue.put(message)
+
+    def _startWriter(self):
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._writerLoop, name="LogWriter", daemon=True)
+                self.writer.start()
+
+    def _writerLoop(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flushInterval
+            while batch[-1] is not _FLUSH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
 
-        if self.gameLog:
-            self.gameLog.write(message + "\n")
-            self.gameLog.flush()
+            try:
+                self._write([message for message in batch if message is not _FLUSH])
+            except Exception as ex:
+                print("Failed to write logs: {}".format(ex))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write(self, messages):
+        if not messages:
+            return
+
+        text = "".join(str(message) + "\n" for message in messages)
+        with self.lock:
+            if self.echo:
+                print("".join("[LOG] {}\n".format(message) for message in messages), end="", flush=True)
+            if self.localLog:
+                self.localLog.write(text)
+                self.localLog.flush()
+            else:
+                self.bufferedMessages.extend(messages)
+
+            if self.gameLog:
+                self.gameLog.write(text)
+                self.gameLog.flush()
+
+    def flush(self):
+        """Block until every message logged so far has been written"""
+        if self.writer is None or threading.current_thread() is self.writer:
+            return
+        self.queue.put(_FLUSH)
+        self.queue.join()
+
+    def debug(self, message):
+        """Log at debug level. `message` may be a callable so expensive dumps are only built when they get written"""
+        if not self.isEnabledFor(DEBUG):
+            return
+        if callable(message):
+            message = message()
+        self.log(message, DEBUG)
 
     def updateBackgroundState(self, message):
         self.backgroundState = message
@@ -69,5 +161,12 @@ class Logger:
 
 logger = Logger()
 log = logger.log
+debug = logger.debug
+flush = logger.flush
+atexit.register(logger.flush)
 updateBackgroundState = updateLaunchState = logger.updateBackgroundState
 setGameModPath = logger.setGameModPath
+
+
+def isDebugEnabled():
+    return logger.isEnabledFor(DEBUG)